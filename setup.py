@@ -6,11 +6,12 @@ setup(
     author='Nick Anthony',
     description='A GUI to assist in precisely setting the numerical aperture on a microscope.',
     author_email='nicholas.anthony@northwestern.edu',
-    python_requires='>3.7',
+    python_requires='>=3.8',
     install_requires=[
         'PyQt5',
         'instrumental-lib',
         'scikit-image',
+        'tifffile',
         'pywin32',
         'nicelib'
     ],
@@ -19,5 +20,7 @@ setup(
     packages=find_packages('src'),
     entry_points={'gui_scripts': [
         'nadetector = nadetector.__main__:main',
+    ], 'console_scripts': [
+        'nadetector-batch = nadetector.batch:main',
     ]}
 )
\ No newline at end of file
@@ -1,43 +1,79 @@
-from instrumental import instrument, list_instruments
-from nadetector.hardware import TestCamera
+from PyQt5 import QtCore
+from nadetector.hardware import TestCamera, ReplayCamera
 from nadetector.app import App
+import argparse
+import cProfile
+import pstats
 import sys
 import os
+import time
 from nadetector._resources import driverPath
 
 
+def openCamera():
+    """Open the camera used last time without searching for cameras, which is slow. If that fails then the first camera
+    found is opened and remembered for next time. Returns `None` if there are no cameras."""
+    from instrumental import instrument, list_instruments  # Importing instrumental is slow, it isn't needed for the simulated or replayed cameras.
+    settings = QtCore.QSettings("BackmanLab", "NADetector")
+    cached = settings.value("cameraParams")
+    if cached:
+        try:
+            return instrument(dict(cached))
+        except Exception as e:
+            print(f"Could not open the previous camera {cached}: {e}")
+    inst = list_instruments()
+    print(f"Found {len(inst)} cameras:")
+    print(inst)
+    if len(inst) == 0:
+        return None
+    cam = instrument(inst[0])  # Replace with your camera's alias
+    settings.setValue("cameraParams", dict(inst[0]))
+    return cam
+
+
 def main():
     os.environ['PATH'] += ';' + str(driverPath)  # This makes is so that the Camera driver DLL can be found.
 
-    test: bool = False  # If true then use a simulated camera.
+    parser = argparse.ArgumentParser(prog='python -m nadetector')
+    parser.add_argument('--test', action='store_true', help="Use a simulated camera.")
+    parser.add_argument('--replay', help="Play back frames from a recording directory or .npy file instead of using a camera.")
+    parser.add_argument('--fps', type=float, help="The frame rate of the simulated or replayed camera. By default frames are produced as fast as they are used.")
+    parser.add_argument('--profile', metavar='PATH', help="Profile the GUI thread with cProfile, save the stats to PATH and print the slowest functions on exit. "
+                                                          "The stages run on other threads are timed in the Timing tab of the advanced settings.")
+    args, qtArgs = parser.parse_known_args()
 
-    def tracefunc(frame, event, arg, indent=[0]):
-        if event == "call":
-            indent[0] += 2
-            print("-" * indent[0] + "> call function", frame.f_code.co_name)
-        elif event == "return":
-            print("<" + "-" * indent[0], "exit function", frame.f_code.co_name)
-            indent[0] -= 2
-        return tracefunc
+    test: bool = args.test  # If true then use a simulated camera.
 
     cam = None
-    if test:
-        cam = TestCamera((512, 1024), 10, ring=True)
+    if args.replay:
+        cam = ReplayCamera(args.replay, fps=args.fps)
+    elif test:
+        cam = TestCamera((512, 1024), 10, ring=True, fast=True, seed=0, fps=args.fps, motion=1)
     else:
-        inst = list_instruments()
-        print(f"Found {len(inst)} cameras:")
-        print(inst)
-        if len(inst) > 0:
-            cam = instrument(list_instruments()[0])  # Replace with your camera's alias
+        cam = openCamera()
 
     if cam is not None:
         with cam:
-            app = App(sys.argv, cam)
+            app = App(sys.argv[:1] + qtArgs, cam)
             # Initial settings for the app
             app.window.videoButton.click()  # Start the video
             app.window.advancedDlg.cameraTab.autoExposeCB.click()  # Turn on autoexposure
-            # sys.setprofile(tracefunc)
+            profiler = cProfile.Profile() if args.profile else None
+            start = time.perf_counter()
+            if profiler is not None:
+                profiler.enable()
             app.exec_()
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(args.profile)
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+            if args.replay:
+                elapsed = time.perf_counter() - start
+                buf = app.cameraManager.frameBuffer
+                displayed = buf.latestSeq - buf.overruns['display']
+                fitted = app.camview.fitWorker.fittedFrames
+                print(f"Replayed {cam.framesServed} frames in {elapsed:.1f} s ({cam.framesServed / elapsed:.1f} fps). "
+                      f"Displayed {displayed} ({displayed / elapsed:.1f} fps), fit {fitted} ({fitted / elapsed:.1f} fps).")
 
 
 if __name__ == '__main__':
@@ -4,119 +4,752 @@ Created on Thu May 30 09:56:28 2019
 
 @author: backman05
 """
-import time
+import typing
 from abc import ABC, abstractmethod
 
-import skimage as sk
-import skimage.filters as skfilters
-from typing import Tuple, Callable
+from typing import Tuple, Callable, List
 import numpy as np
-import scipy as sp
 
+# scipy and skimage take a long time to import so they are imported by the functions that use them, see `importDependencies`.
+from nadetector.constants import Methods
+from nadetector.thresholding import Thresholder, thresholdLi, thresholdOtsu
+from nadetector.timing import pipelineTimer
+if typing.TYPE_CHECKING:
+    from nadetector.fitWorker import ScratchBuffers
 
-def binarizeImageLi(im: np.ndarray) -> np.ndarray:
-    """Take the Uint8 image from the camera and binarize it for further processing."""
-    thresh = skfilters.threshold_li(im)
-    binar = im > thresh
+
+def importDependencies():
+    """Import the scipy and skimage modules used by the fitting functions. They are imported on first use so that the
+    GUI can open quickly. Calling this on a background thread at startup means the first fit doesn't wait for them."""
+    import scipy.ndimage
+    import scipy.optimize
+    import skimage.feature
+
+
+def binarizeImageLi(im: np.ndarray, out: np.ndarray = None, thresholder: Thresholder = None) -> np.ndarray:
+    """Take the Uint8 image from the camera and binarize it for further processing. If provided the result is stored in
+    the boolean array `out`. If a `thresholder` is provided then it is used to calculate the threshold from the previous
+    frames' results."""
+    thresh = thresholder.li(im) if thresholder is not None else thresholdLi(im)
+    binar = np.greater(im, thresh, out=out)
     return binar
 
 
-def binarizeImageOtsu(im: np.ndarray) -> np.ndarray:
-    """Take the Uint8 image from the camera and binarize it for further processing."""
-    thresh = sk.filters.threshold_otsu(im)
-    binar = im > thresh
+def binarizeImageOtsu(im: np.ndarray, out: np.ndarray = None, thresholder: Thresholder = None) -> np.ndarray:
+    """Take the Uint8 image from the camera and binarize it for further processing. If provided the result is stored in
+    the boolean array `out`. If a `thresholder` is provided then it is used to calculate the threshold from the previous
+    frames' results."""
+    thresh = thresholder.otsu(im) if thresholder is not None else thresholdOtsu(im)
+    binar = np.greater(im, thresh, out=out)
     return binar
 
 
-def initialGuessCircle(binary: np.ndarray):
-    """Generate an initial guess for x, y, and r of the circle based on a binarized image."""
-    regions = sk.measure.regionprops(binary.astype(np.uint8))
-    try:
-        bubble = regions[0]  # this will be the largest detected region.
-        y0, x0 = bubble.centroid
-        r0 = bubble.major_axis_length / 2  # These are our initial values that we will start our optimization with.
-    except IndexError:  # In rare cases there is no region found
-        x0, y0, r0 = 1, 1, 1
-    return x0, y0, r0
+def initialGuessCircle(binary: np.ndarray, blockSize: int = None, largestComponent: bool = True) -> Tuple[float, float, float]:
+    """Generate an initial guess for x, y, and r of the circle based on a binarized image.
 
+    The image is first reduced by a vote within each `blockSize` x `blockSize` block of pixels. A block is foreground if
+    the fraction of its pixels that are foreground is greater than `(1 + p) / 2`, where `p` is the fraction of the whole
+    image that is foreground, so noise that is scattered over the whole image is removed even when the threshold was
+    poor. The guess is then calculated from the moments of the reduced image: x and y are the centroid and r is half of
+    the major axis of the ellipse with the same second moments, the same as `major_axis_length` of
+    `skimage.measure.regionprops`.
 
-def fitCircle(binar: np.ndarray, x0, y0, r0) -> Tuple[float, float, float]:
-    def cost(args: (float, float, float)): #We have to use args here rather than individual arguments because of how the sp.optimize function works. the binarized image is included in the function using closure.
-        """Calculate the cost to be minimized which in this case is the negative of the number of pixels that overlap between our circle(x,y,r) and the binary image."""
+    Args:
+        binary: The binarized image.
+        blockSize: The size of the blocks that are voted on. Defaults to 1/128th of the shorter side of the image.
+        largestComponent: If True then only the largest connected region of the reduced image is used.
+
+    Returns:
+        x, y, r in pixels of `binary`. `1, 1, 1` if there is no foreground.
+    """
+    if blockSize is None:
+        blockSize = max(min(binary.shape) // 128, 1)
+    k = blockSize
+    h, w = binary.shape[0] // k, binary.shape[1] // k
+    total = np.count_nonzero(binary)
+    if total == 0 or h == 0 or w == 0:  # In rare cases there is no region found
+        return 1, 1, 1
+    # Count the foreground pixels of each block. Summing along each axis separately is much faster than both at once.
+    counts = binary[:h * k, :w * k].view(np.uint8).reshape(h, k, w * k).sum(axis=1, dtype=np.uint32).reshape(h, w, k).sum(axis=2)
+    small = counts > (1 + total / binary.size) / 2 * k * k
+    if largestComponent:
+        import scipy.ndimage
+        labels, n = scipy.ndimage.label(small)
+        if n > 1:
+            sizes = np.bincount(labels.ravel())
+            sizes[0] = 0  # The background
+            small = labels == np.argmax(sizes)
+    m00 = np.count_nonzero(small)
+    if m00 == 0:  # The foreground is smaller than a block, use it as is.
+        small, k, m00 = binary, 1, total
+    ys = np.arange(small.shape[0], dtype=float)
+    xs = np.arange(small.shape[1], dtype=float)
+    rows = np.count_nonzero(small, axis=1)
+    cols = np.count_nonzero(small, axis=0)
+    cx, cy = cols @ xs / m00, rows @ ys / m00
+    # Central second moments, normalized by the area.
+    mu20 = cols @ (xs - cx) ** 2 / m00
+    mu02 = rows @ (ys - cy) ** 2 / m00
+    mu11 = (ys - cy) @ (small @ (xs - cx)) / m00
+    majorVariance = (mu20 + mu02) / 2 + np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    r0 = 2 * np.sqrt(majorVariance)  # Half of the major axis length.
+    offset = (k - 1) / 2  # The center of a block in full resolution coordinates.
+    return cx * k + offset, cy * k + offset, r0 * k
+
+
+class OverlapCost:
+    """Scores candidate circles against a binary image without rendering a template for each evaluation.
+
+    The score is the number of pixels that agree between the binary image and a disk drawn at (x, y, r), the same
+    quantity that comparing against an `skimage.draw.circle` template gives. Since `agreement = N - sum(binar) + sum(2*binar - 1 over disk)`
+    only the sum of the weights inside the disk changes between candidates. A per-row prefix sum of the weights is
+    built once per frame so each row of the disk is scored with two lookups, making an evaluation O(perimeter).
+
+    Args:
+        binar: The binarized image that candidate circles are scored against.
+    """
+    def __init__(self, binar: np.ndarray):
+        h, w = binar.shape
+        self._shape = binar.shape
+        self._prefix = np.zeros((h, w + 1), dtype=np.int64)
+        np.cumsum(np.where(binar, 1, -1), axis=1, out=self._prefix[:, 1:])
+        self._constant = binar.size - np.count_nonzero(binar)
+        # Scratch buffers reused by every evaluation.
+        self._rows = np.arange(h)
+        self._rowsF = np.empty(h, dtype=float)
+        self._halfWidth = np.empty(h, dtype=float)
+        self._lo = np.empty(h, dtype=np.intp)
+        self._hi = np.empty(h, dtype=np.intp)
+
+    def score(self, x: float, y: float, r: float) -> int:
+        """Return the number of pixels that agree between the binary image and a disk at (x, y, r)."""
+        h, w = self._shape
+        if r <= 0:
+            return self._constant
+        # Rows and columns follow the same strict inequality that `skimage.draw.circle` uses.
+        top = max(int(np.floor(y - r)) + 1, 0)
+        bottom = min(int(np.ceil(y + r)) - 1, h - 1)
+        if bottom < top:
+            return self._constant
+        n = bottom - top + 1
+        rows = self._rows[top:bottom + 1]
+        rowsF = self._rowsF[:n]
+        half = self._halfWidth[:n]
+        lo = self._lo[:n]
+        hi = self._hi[:n]
+        np.subtract(rows, y, out=rowsF)
+        np.multiply(rowsF, rowsF, out=rowsF)
+        np.subtract(r * r, rowsF, out=half)
+        np.maximum(half, 0, out=half)
+        np.sqrt(half, out=half)
+        np.subtract(x, half, out=rowsF)
+        np.floor(rowsF, out=rowsF)
+        np.add(rowsF, 1, out=rowsF)
+        np.clip(rowsF, 0, w, out=rowsF)
+        lo[:] = rowsF
+        np.add(x, half, out=rowsF)
+        np.ceil(rowsF, out=rowsF)
+        np.clip(rowsF, 0, w, out=rowsF)
+        hi[:] = rowsF
+        np.maximum(hi, lo, out=hi)  # Rows where the disk lies entirely outside of the image contribute nothing.
+        inside = self._prefix[rows, hi].sum() - self._prefix[rows, lo].sum()
+        return self._constant + int(inside)
+
+    def __call__(self, args: Tuple[float, float, float]) -> int:
+        """The cost to be minimized by `scipy.optimize.minimize`, the negative of the agreement score."""
         x, y, r = args
-        coords = sk.draw.circle(y, x, r, shape=binar.shape)
-        template = np.zeros_like(binar) #Template is a binary array based on the x,y, and r
-        template[coords] = True
-        err = (np.sum(template == binar))
-        # print(x, y, r)
-        # print(err)
-        return -(err) #The score is the number of pixels that are correct. should this be changed?
-    
-    result = sp.optimize.minimize(cost, x0=(x0, y0, r0), method='COBYLA', jac=None, options={'disp': False})
+        return -self.score(x, y, r)
+
+
+def fitCircle(binar: np.ndarray, x0, y0, r0) -> Tuple[float, float, float]:
+    import scipy.optimize
+    cost = OverlapCost(binar)  # The cost is the negative of the number of pixels that overlap between our circle(x,y,r) and the binary image.
+    result = scipy.optimize.minimize(cost, x0=(x0, y0, r0), method='COBYLA', jac=None, options={'disp': False})
     X, Y, R = tuple(result.x)
     # print(result.success)
     # print(X,Y,R)
     return X, Y, R
 
 
+def detectBoundaryPoints(binar: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Locate the boundary of the binary regions with sub-pixel precision.
+
+    A point is placed halfway between every pair of horizontally or vertically adjacent pixels that have different
+    values, which is an unbiased estimate of where the edge crosses between the two pixel centers. Transitions are only
+    kept if there are at least two matching pixels on each side so that isolated noise pixels are ignored.
+
+    Returns:
+        The x and y coordinates of the boundary points.
+    """
+    a, b, c, d = binar[:, :-3], binar[:, 1:-2], binar[:, 2:-1], binar[:, 3:]
+    ys, xs = np.nonzero((b != c) & (a == b) & (c == d))
+    a, b, c, d = binar[:-3, :], binar[1:-2, :], binar[2:-1, :], binar[3:, :]
+    ys2, xs2 = np.nonzero((b != c) & (a == b) & (c == d))
+    x = np.concatenate([xs + 1.5, xs2.astype(float)])
+    y = np.concatenate([ys.astype(float), ys2 + 1.5])
+    return x, y
+
+
+def fitCircleAlgebraic(x: np.ndarray, y: np.ndarray) -> Tuple[float, float, float]:
+    """Fit a circle to a set of points in closed form using Taubin's algebraic method.
+
+    See N. Chernov, "Circular and Linear Regression: Fitting Circles and Lines by Least Squares" (2010). The fit is
+    calculated from the singular vector of a 3 column matrix so no iterative optimization is needed.
+
+    Returns:
+        The x, y and radius of the fitted circle.
+    """
+    xm, ym = x.mean(), y.mean()
+    X = x - xm
+    Y = y - ym
+    Z = X * X + Y * Y
+    Zm = Z.mean()
+    Z0 = (Z - Zm) / (2 * np.sqrt(Zm))
+    _, _, Vt = np.linalg.svd(np.column_stack([Z0, X, Y]), full_matrices=False)
+    A = Vt[2].copy()  # The singular vector with the smallest singular value.
+    A[0] = A[0] / (2 * np.sqrt(Zm))
+    A3 = -Zm * A[0]
+    xc = -A[1] / A[0] / 2 + xm
+    yc = -A[2] / A[0] / 2 + ym
+    r = np.sqrt(A[1] ** 2 + A[2] ** 2 - 4 * A[0] * A3) / abs(A[0]) / 2
+    return float(xc), float(yc), float(r)
+
+
+def fitCircleLeastSquares(binar: np.ndarray, x0, y0, r0) -> Tuple[float, float, float]:
+    """Fit a circle to the boundary of the binarized aperture with a closed-form least squares fit.
+
+    Only the region around the initial guess is used. It is cleaned with a morphological opening and only the largest
+    connected region is kept, so the transitions between noise pixels that a poor threshold leaves behind aren't mistaken
+    for the edge. Boundary points within an annulus around the initial guess are then fit, so the inner edge of a ring
+    shaped aperture doesn't bias the result. The annulus is narrowed around each new fit for a couple of passes and points
+    with a residual far larger than the median are rejected, as in `fitCircleRays`.
+    """
+    import scipy.ndimage
+    reach = 1.3 * r0 + 3  # The outer edge of the widest annulus, plus room for the opening.
+    top, bottom = max(int(y0 - reach), 0), min(int(np.ceil(y0 + reach)) + 1, binar.shape[0])
+    left, right = max(int(x0 - reach), 0), min(int(np.ceil(x0 + reach)) + 1, binar.shape[1])
+    if top >= bottom or left >= right:
+        return x0, y0, r0
+    clean = scipy.ndimage.binary_opening(binar[top:bottom, left:right], structure=np.ones((3, 3), dtype=bool))
+    labels, n = scipy.ndimage.label(clean)
+    if n > 1:
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0  # The background
+        clean = labels == np.argmax(sizes)
+    x, y = detectBoundaryPoints(clean)
+    x += left
+    y += top
+    # We expect the actual radius to be within range of the initial guess.
+    return _fitPointsInBands(x, y, x0, y0, r0, [0.3 * r0, 3, 1.5])
+
+
+def _fitPointsInBands(x: np.ndarray, y: np.ndarray, x0, y0, r0, bands: List[float]) -> Tuple[float, float, float]:
+    """Fit a circle with `fitCircleAlgebraic` to the points within each of `bands` pixels of the previous fit in turn,
+    starting from `x0, y0, r0`. Points with a residual far larger than the median are rejected after each fit."""
+    X, Y, R = x0, y0, r0
+    for band in bands:
+        mask = np.abs(np.hypot(x - X, y - Y) - R) < band
+        if np.count_nonzero(mask) < 3:  # Not enough points to define a circle. Stick with what we have.
+            break
+        px, py = x[mask], y[mask]
+        X, Y, R = fitCircleAlgebraic(px, py)
+        residuals = np.abs(np.hypot(px - X, py - Y) - R)
+        keep = residuals <= max(4.5 * np.median(residuals), 0.5)
+        if np.count_nonzero(keep) >= 3:
+            X, Y, R = fitCircleAlgebraic(px[keep], py[keep])
+    return X, Y, R
+
+
 def detectEdges(im: np.ndarray):
     from skimage.feature import canny
     #  detect edges
     edges = canny(im, sigma=3, low_threshold=10, high_threshold=50)
     return edges
 
-def fitCircleHough(edges: np.ndarray, x0, y0, r0):
-    """https://scikit-image.org/docs/dev/auto_examples/edges/plot_circular_elliptical_hough_transform.html"""
-    from skimage.transform import hough_circle, hough_circle_peaks
+def edgeGradients(im: np.ndarray, edges: np.ndarray, sigma: float = 3) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Calculate the intensity gradient of the smoothed image at each edge pixel. Central differences are only taken at
+    the edge pixels rather than across the whole image.
+
+    Args:
+        im: The image that `edges` was detected in.
+        edges: A boolean array of edge pixels, as returned by `detectEdges`.
+        sigma: The standard deviation of the gaussian smoothing. This should match the smoothing used to detect the edges.
+
+    Returns:
+        The y and x coordinates of each edge pixel followed by the y and x components of the gradient at that pixel.
+    """
+    import scipy.ndimage
+    smooth = scipy.ndimage.gaussian_filter(im.astype(np.float32), sigma)
+    h, w = im.shape
+    ys, xs = np.nonzero(edges)
+    gx = smooth[ys, np.minimum(xs + 1, w - 1)] - smooth[ys, np.maximum(xs - 1, 0)]
+    gy = smooth[np.minimum(ys + 1, h - 1), xs] - smooth[np.maximum(ys - 1, 0), xs]
+    return ys, xs, gy, gx
+
 
-    # Detect two radii
-    hough_radii = np.arange(int(r0*.7), int(r0*1.1), 1)# We expect that the actual radius we be within range of the initial guess
-    hough_res = hough_circle(edges, hough_radii)
+def fitCircleHoughGradient(im: np.ndarray, edges: np.ndarray, x0, y0, r0, radii: np.ndarray = None, centerRange: float = None) -> Tuple[float, float, float]:
+    """A Hough transform that only votes from edge pixels within the annulus where the aperture edge could plausibly be.
 
-    # Select the most prominent 3 circle
-    accums, cx, cy, radii = hough_circle_peaks(hough_res, hough_radii, total_num_peaks=1)
-    if len(cx) > 0:
-        return cx[0], cy[0], radii[0]
-    else:  # No circles were found
+    The aperture is brighter than its surroundings so the gradient at an edge pixel points towards the center. Each edge
+    pixel therefore casts one vote per radius, at the point that distance along its gradient, into a 2D accumulator
+    covering only the region where the center could be. The radius is then the most common distance from that center to
+    the edge pixels. Memory scales with the size of the center region and the number of radii rather than with the image
+    size times the number of radii.
+
+    Args:
+        im: The image that `edges` was detected in.
+        edges: A boolean array of edge pixels, as returned by `detectEdges`.
+        x0, y0, r0: The initial guess.
+        radii: The radii to search. If not provided then a range around `r0` is used.
+        centerRange: How far, in pixels, the center may be from (x0, y0). Defaults to a quarter of `r0`.
+
+    Returns:
+        The x, y, r of the circle. 0, 0, 0 if no circle was found.
+    """
+    if radii is None:
+        radii = np.arange(int(r0*.7), int(r0*1.1), 1)  # We expect that the actual radius we be within range of the initial guess
+    if centerRange is None:
+        centerRange = r0 / 4
+    if len(radii) == 0:
         return 0, 0, 0
+    m = int(np.ceil(centerRange))
+    size = 2 * m + 1
 
-def fitCircleTest(im: np.ndarray) -> Tuple[float, float, float]:
-    thresh = skfilters.threshold_li(im)
-    binar = im > thresh
-    regions = sk.measure.regionprops(binar.astype(np.uint8))
-    bubble = regions[0]  # this will be the largest detected region.
-    y0, x0 = bubble.centroid
-    r0 = bubble.major_axis_length / 2  # These are our initial values that we will start our optimization with.
-
-    def cost(args: (float, float,
-                    float)):  # We have to use args here rather than individual arguments because of out the sp.optimize function works. the binarized image is included in the function using closure.
-        """Calculate the cost to be minimized which in this case is the negative of the number of pixels that overlap between our circle(x,y,r) and the binary image."""
-        x, y, r = args
-        coords = sk.draw.circle(y, x, r, shape=binar.shape)
-        template = np.zeros_like(binar)
-        template[coords] = True
-        return -(np.sum(template == binar))
-
-    for meth in ['Nelder-Mead',
-                'Powell',
-                'CG',
-                'BFGS',
-                'Newton-CG',
-                'L-BFGS-B',
-                'TNC',
-                'COBYLA',
-                'SLSQP',
-                'dogleg' 
-                'trust-ncg']:
-        t = time.time()
-        try:
-            sp.optimize.minimize(cost, x0=(x0, y0, r0), method=meth, jac=False)
-        except:
-            print("Error")
-        print(meth, time.time()-t)
-
-    t = time.time()
-    X, Y, R = sp.optimize.fmin(cost, (x0, y0, r0))
-    print(time.time()-t)
-    t = time.time()
-    return X, Y, R
\ No newline at end of file
+    ys, xs, gy, gx = edgeGradients(im, edges)
+    dist = np.hypot(xs - x0, ys - y0)
+    mask = (dist > radii[0] - centerRange) & (dist < radii[-1] + centerRange)
+    norm = np.hypot(gx, gy)
+    mask &= norm > 0
+    if np.count_nonzero(mask) == 0:
+        return 0, 0, 0
+    ys, xs, norm = ys[mask], xs[mask], norm[mask]
+    ux, uy = gx[mask] / norm, gy[mask] / norm
+
+    # Votes are indexed relative to the corner of the center region.
+    ox, oy = int(round(x0)) - m, int(round(y0)) - m
+    cx = np.rint(xs[:, None] + ux[:, None] * radii[None, :] - ox).astype(np.intp)
+    cy = np.rint(ys[:, None] + uy[:, None] * radii[None, :] - oy).astype(np.intp)
+    inRegion = (cx >= 0) & (cx < size) & (cy >= 0) & (cy < size)
+    if np.count_nonzero(inRegion) == 0:
+        return 0, 0, 0
+    accum = np.bincount(cy[inRegion] * size + cx[inRegion], minlength=size * size).reshape(size, size)
+    py, px = np.unravel_index(np.argmax(accum), accum.shape)
+    # Refine the center to sub-pixel precision with the centroid of the votes around the peak.
+    top, left = max(py - 1, 0), max(px - 1, 0)
+    peak = accum[top:py + 2, left:px + 2]
+    wy, wx = np.mgrid[top:top + peak.shape[0], left:left + peak.shape[1]]
+    X = (wx * peak).sum() / peak.sum() + ox
+    Y = (wy * peak).sum() / peak.sum() + oy
+
+    # Find the radius as the peak of the histogram of distances from the center to the edge pixels.
+    d = np.hypot(xs - X, ys - Y)
+    rMin, rMax = radii[0], radii[-1]
+    inRange = (d >= rMin - 0.5) & (d < rMax + 0.5)
+    if np.count_nonzero(inRange) == 0:
+        return 0, 0, 0
+    d = d[inRange]
+    hist = np.bincount(np.rint(d - rMin).astype(np.intp), minlength=len(radii))
+    R = rMin + np.argmax(hist)
+    R = d[np.abs(d - R) <= 1].mean()  # Refine the radius with the mean distance of the edge pixels near the peak.
+    return X, Y, R
+
+
+def fitCircleRays(im: np.ndarray, x0, y0, r0, numRays: int = 360, band: float = None, iterations: int = 3, sigma: float = 1.5) -> Tuple[float, float, float]:
+    """Fit the aperture by casting rays outward from the estimated center and finding where each one crosses the edge.
+
+    The intensity profile along each ray is sampled with bilinear interpolation between `r - band` and `r + band`,
+    smoothed, and the edge is placed at the steepest drop in intensity with sub-sample precision from a parabola through
+    the derivative. Rays with a weak edge, such as those that leave the image before reaching the aperture edge, are
+    discarded and a circle is fit to the remaining edge points with `fitCircleAlgebraic`. This is repeated from the new
+    center with a narrower band. Only `numRays` profiles are read so the cost doesn't depend on the image size, and the
+    raw image is used directly so no binarization is needed.
+
+    Args:
+        im: The grayscale image. The aperture should be brighter than its surroundings.
+        x0, y0, r0: The initial guess.
+        numRays: The number of rays, evenly spaced in angle.
+        band: How far, in pixels, either side of `r0` to search for the edge on the first iteration. Defaults to half of
+            `r0`. Only drops in intensity are detected, so a wide band won't pick up the inner edge of a ring.
+        iterations: The number of times the rays are recast from the latest fit.
+        sigma: The standard deviation, in pixels, of the Gaussian used to smooth each profile.
+
+    Returns:
+        The x, y, r of the circle. 0, 0, 0 if too few edge points were found.
+    """
+    import scipy.ndimage
+    step = 0.5  # The spacing of the samples along each ray.
+    theta = np.linspace(0, 2 * np.pi, numRays, endpoint=False)
+    cos, sin = np.cos(theta)[:, None], np.sin(theta)[:, None]
+    rayIdx = np.arange(numRays)
+    h, w = im.shape[:2]
+    x, y, r = x0, y0, r0
+    if band is None:
+        band = 0.5 * r0
+    for _ in range(iterations):
+        band = max(band, 3 * sigma + 2)  # The window must be wide enough for the smoothing and derivative.
+        rho = np.arange(max(r - band, 0), r + band, step)
+        if len(rho) < 5:
+            return 0, 0, 0
+        xs = x + cos * rho[None, :]
+        ys = y + sin * rho[None, :]
+        profiles = scipy.ndimage.map_coordinates(im, [ys.ravel(), xs.ravel()], output=np.float32, order=1, mode='nearest').reshape(xs.shape)
+        scipy.ndimage.gaussian_filter1d(profiles, sigma / step, axis=1, output=profiles)
+        grad = np.diff(profiles, axis=1)  # grad[:, i] is the slope halfway between samples i and i + 1.
+        k = np.clip(np.argmin(grad, axis=1), 1, grad.shape[1] - 2)
+        g0, g1, g2 = grad[rayIdx, k - 1], grad[rayIdx, k], grad[rayIdx, k + 1]
+        curvature = g0 - 2 * g1 + g2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offset = np.where(curvature > 0, 0.5 * (g0 - g2) / curvature, 0)
+        edge = rho[0] + (k + 0.5 + np.clip(offset, -0.5, 0.5)) * step
+        ex, ey = x + cos[:, 0] * edge, y + sin[:, 0] * edge
+        strength = -g1
+        valid = (ex >= 0) & (ex <= w - 1) & (ey >= 0) & (ey <= h - 1) & (strength > 0.5 * np.median(strength)) & (strength > 0)
+        if np.count_nonzero(valid) < 5:
+            return 0, 0, 0
+        ex, ey = ex[valid], ey[valid]
+        x, y, r = fitCircleAlgebraic(ex, ey)
+        # Reject edge points that are far from the fit, such as from dust on the aperture, and fit again.
+        residuals = np.abs(np.hypot(ex - x, ey - y) - r)
+        mad = np.median(residuals)
+        keep = residuals <= max(4.5 * mad, step)
+        if np.count_nonzero(keep) >= 5:
+            x, y, r = fitCircleAlgebraic(ex[keep], ey[keep])
+        band = band / 4
+    return x, y, r
+
+
+def binnedShape(shape: Tuple[int, ...], factor: int) -> Tuple[int, int]:
+    """The shape of an image of `shape` after `binImage` with `factor`."""
+    return -(-shape[0] // factor), -(-shape[1] // factor)
+
+
+def binImage(im: np.ndarray, factor: int, out: np.ndarray = None, buffers: 'ScratchBuffers' = None) -> np.ndarray:
+    """Down-sample an image by averaging each `factor` x `factor` block of pixels.
+
+    The blocks are summed through reshaped views of the image, in integers for integer images, and the rounded means
+    are written straight into `out`. Blocks that are cut off by the bottom or right edge of the image are averaged over
+    the pixels they contain rather than padded with zeros, so the edges aren't darkened.
+
+    Args:
+        im: A 2D image.
+        factor: The size of the blocks.
+        out: An array of shape `binnedShape(im.shape, factor)` and the same dtype as `im` to store the result in.
+        buffers: If provided then the sums are accumulated in these buffers rather than newly allocated.
+
+    Returns:
+        The binned image. Pixel `i` is centered on pixel `i * factor + (factor - 1) / 2` of `im`.
+    """
+    shape = binnedShape(im.shape, factor)
+    if out is None:
+        out = np.empty(shape, dtype=im.dtype)
+    if factor == 1:
+        np.copyto(out, im)
+        return out
+    k = factor
+    h, w = im.shape[0] // k, im.shape[1] // k  # The number of whole blocks.
+    isFloat = im.dtype.kind == 'f'
+    if isFloat:
+        accType = np.float64
+    else:
+        accType = np.uint32 if im.dtype.kind == 'u' and im.dtype.itemsize <= 2 else np.int64  # Up to 256 x 256 blocks of uint16 fit in uint32.
+    get = buffers.get if buffers is not None else lambda name, shape, dtype: np.empty(shape, dtype)
+    rows = get('binRows', (h, w * k), accType)
+    sums = get('binSums', (h, w), accType)
+    np.sum(im[:h * k, :w * k].reshape(h, k, w * k), axis=1, dtype=accType, out=rows)
+    np.sum(rows.reshape(h, w, k), axis=2, out=sums)
+    if isFloat:
+        sums /= k * k
+    else:
+        sums += k * k // 2  # Round to nearest rather than truncating.
+        sums //= k * k
+    np.copyto(out[:h, :w], sums, casting='unsafe')
+
+    def storeMean(dst: np.ndarray, block: np.ndarray, axis):
+        mean = block.mean(axis=axis)
+        np.copyto(dst, mean if isFloat else np.rint(mean), casting='unsafe')
+
+    if shape[0] > h:  # A partial row of blocks along the bottom.
+        storeMean(out[h, :w], im[h * k:, :w * k].reshape(im.shape[0] - h * k, w, k), (0, 2))
+    if shape[1] > w:  # A partial column of blocks along the right side.
+        storeMean(out[:h, w], im[:h * k, w * k:].reshape(h, k, im.shape[1] - w * k), (1, 2))
+    if shape[0] > h and shape[1] > w:
+        storeMean(out[h, w:], im[h * k:, w * k:].reshape(1, -1), 1)
+    return out
+
+
+class FitIntermediates:
+    """
+    The intermediate results of fitting one frame. `measureCircle` and `measureCircleScaled` fill them in as they go so
+    that they can be displayed without being calculated again. The arrays may be views of scratch buffers that are
+    reused for the next frame so they shouldn't be kept past the next fit, `preview` is the exception.
+
+    Attributes:
+        method: The method used for the fit.
+        binary: The binarized image, or None if the method didn't binarize it.
+        edges: The edges found for the Hough transform, or None.
+        threshold: The binarization threshold, or None.
+        downSampled: The image that was fit, after down-sampling. The coarsest level when fitting with a pyramid.
+        scale: The number of full resolution pixels along each side of a pixel of the arrays.
+        origin: The row and column of the full frame that the arrays' top left corner is at, if a crop was fit.
+        preview: A uint8 image of the full frame made by `renderPreview`, which is safe to keep.
+    """
+    def __init__(self):
+        self.method: typing.Optional[Methods] = None
+        self.binary: typing.Optional[np.ndarray] = None
+        self.edges: typing.Optional[np.ndarray] = None
+        self.threshold: typing.Optional[float] = None
+        self.downSampled: typing.Optional[np.ndarray] = None
+        self.scale = 1
+        self.origin = (0, 0)
+        self.preview: typing.Optional[np.ndarray] = None
+
+    def renderPreview(self, shape: Tuple[int, int]) -> typing.Optional[np.ndarray]:
+        """Scale up the image that the method works on, the edges for the Hough transform and otherwise the binarized
+        image, to a uint8 image of the full frame's `shape` and store it as `preview`. Anything outside of a cropped
+        region is black. Ray casting works on the raw image so there is nothing to render and None is returned."""
+        mask = self.edges if self.method == Methods.HoughTransform else self.binary
+        if mask is None:
+            self.preview = None
+            return None
+        if self.scale != 1:
+            mask = np.repeat(np.repeat(mask, self.scale, axis=0), self.scale, axis=1)
+        preview = np.zeros(shape[:2], dtype=np.uint8)
+        top, left = self.origin
+        h, w = min(mask.shape[0], preview.shape[0] - top), min(mask.shape[1], preview.shape[1] - left)
+        preview[top:top + h, left:left + w][mask[:h, :w]] = 255
+        self.preview = preview
+        return preview
+
+
+def preprocessImage(im: np.ndarray, method: Methods, out: np.ndarray = None, thresholder: Thresholder = None, intermediates: FitIntermediates = None) -> np.ndarray:
+    """Prepare an image for fitting with `method`: binarize it, detect its edges for the Hough transform, or nothing
+    for ray casting. Takes the same arguments as `measureCircle`.
+
+    Returns:
+        The binarized image, the edges, or `im` itself.
+    """
+    if intermediates is not None:
+        if thresholder is None:
+            thresholder = Thresholder(stride=1)  # Gives the same threshold as `thresholdLi` and records it.
+        intermediates.method = method
+        intermediates.downSampled = im
+    if method in (Methods.LiMinimization, Methods.LeastSquaresEdge):
+        data = binarizeImageLi(im, out=out, thresholder=thresholder)
+    elif method == Methods.OtsuMinimization:
+        data = binarizeImageOtsu(im, out=out, thresholder=thresholder)
+    elif method == Methods.HoughTransform:
+        data = detectEdges(im)
+    elif method == Methods.RayCasting:
+        data = im  # The rays are cast on the raw image.
+    else:
+        raise ValueError("No recognized method")
+    if intermediates is not None:
+        if method == Methods.HoughTransform:
+            intermediates.edges = data
+        elif method != Methods.RayCasting:
+            intermediates.binary = data
+            intermediates.threshold = thresholder.threshold
+    return data
+
+
+def measureCircle(im: np.ndarray, method: Methods, guess: Tuple[float, float, float] = None, out: np.ndarray = None, thresholder: Thresholder = None, intermediates: FitIntermediates = None) -> Tuple[Tuple[float, float, float], Tuple[float, float, float]]:
+    """Measure the aperture circle in a camera image.
+
+    Args:
+        im: The image from the camera.
+        method: The method used to fit the circle.
+        guess: An x, y, r to start the fit from. If not provided then `initialGuessCircle` of the binarized image is used.
+        out: A boolean array with the same shape as `im` that the binarized image is stored in. Passing the same array for
+            each frame avoids allocating a new one.
+        thresholder: Calculates the binarization threshold for a stream of frames. If not provided the threshold is
+            calculated from scratch.
+        intermediates: If provided then the binarized image, edges and threshold are stored in it.
+
+    Returns:
+        The x, y, r of the initial guess and the x, y, r of the final fit.
+    """
+    with pipelineTimer.time('binarize'):
+        data = preprocessImage(im, method, out=out, thresholder=thresholder, intermediates=intermediates)
+    with pipelineTimer.time('initialGuess'):
+        if guess is not None:
+            x0, y0, r0 = guess
+        elif method == Methods.HoughTransform:  # The moments of the edges don't give the radius, so seed from the binarized aperture.
+            x0, y0, r0 = initialGuessCircle(binarizeImageLi(im, out=out, thresholder=thresholder))
+        elif method == Methods.RayCasting:  # The seed only needs to be roughly right, so a subsample of the image is binarized.
+            s = max(min(im.shape[:2]) // 512, 1)
+            x0, y0, r0 = initialGuessCircle(binarizeImageLi(im[::s, ::s], thresholder=thresholder))
+            x0, y0, r0 = x0 * s, y0 * s, r0 * s
+        else:
+            x0, y0, r0 = initialGuessCircle(data)
+    with pipelineTimer.time('optimize'):
+        if method in (Methods.LiMinimization, Methods.OtsuMinimization):
+            x, y, r = fitCircle(data, x0, y0, r0)
+        elif method == Methods.HoughTransform:
+            x, y, r = fitCircleHoughGradient(im, data, x0, y0, r0)
+        elif method == Methods.RayCasting:
+            x, y, r = fitCircleRays(im, x0, y0, r0)
+        else:
+            x, y, r = fitCircleLeastSquares(data, x0, y0, r0)
+    return (x0, y0, r0), (x, y, r)
+
+
+def measureCircleScaled(im: np.ndarray, method: Methods, downSample: int = 1, pyramidLevels: int = 0, guess: Tuple[float, float, float] = None, buffers: 'ScratchBuffers' = None, thresholder: Thresholder = None, intermediates: FitIntermediates = None) -> Tuple[Tuple[float, float, float], Tuple[float, float, float]]:
+    """Measure the aperture circle at reduced resolution. This is the full pipeline used by the GUI.
+
+    Args:
+        im: The image from the camera.
+        method: The method used to fit the circle.
+        downSample: The factor to down-sample the image by before fitting. Ignored if `pyramidLevels` is greater than 0.
+        pyramidLevels: If greater than 0 then `measureCirclePyramid` is used with this many levels.
+        guess: An x, y, r in full resolution coordinates to start the fit from.
+        buffers: If provided then the intermediate arrays are stored in these buffers rather than newly allocated.
+        thresholder: Calculates the binarization threshold for a stream of frames.
+        intermediates: If provided then the down-sampled image, binarized image, edges and threshold are stored in it.
+
+    Returns:
+        The x, y, r of the initial guess and the x, y, r of the final fit, both in full resolution coordinates.
+    """
+    if pyramidLevels > 0:
+        return measureCirclePyramid(im, method, pyramidLevels, guess=guess, buffers=buffers, thresholder=thresholder, intermediates=intermediates)
+    ds = downSample
+    offset = (ds - 1) / 2  # The center of a down-sampled pixel in full resolution coordinates.
+    if ds != 1:
+        with pipelineTimer.time('downSample'):
+            out = buffers.get('downSampled', binnedShape(im.shape, ds), im.dtype) if buffers is not None else None
+            im = binImage(im, ds, out=out, buffers=buffers)
+        if guess is not None:
+            guess = ((guess[0] - offset) / ds, (guess[1] - offset) / ds, guess[2] / ds)
+    out = buffers.get('binary', im.shape, bool) if buffers is not None else None
+    (x0, y0, r0), (x, y, r) = measureCircle(im, method, guess=guess, out=out, thresholder=thresholder, intermediates=intermediates)
+    if intermediates is not None:
+        intermediates.scale = ds
+    if ds != 1:
+        x0, y0, r0 = x0 * ds + offset, y0 * ds + offset, r0 * ds
+        x, y, r = x * ds + offset, y * ds + offset, r * ds
+    return (x0, y0, r0), (x, y, r)
+
+
+def edgeContrast(im: np.ndarray, x: float, y: float, r: float, numSamples: int = 180) -> float:
+    """Measure how well a circle lines up with an edge in the image by comparing the pixels just inside of the circle to
+    the pixels just outside of it. Only `2 * numSamples` pixels are read.
+
+    Returns:
+        The contrast, `(inside - outside) / (inside + outside)`. A value near 1 indicates a bright disk with a sharp edge
+        exactly where the circle is. Values near 0 indicate the circle doesn't match an edge.
+    """
+    if r <= 0:
+        return 0.
+    offset = max(2., 0.02 * r)
+    theta = np.linspace(0, 2 * np.pi, numSamples, endpoint=False)
+    cos, sin = np.cos(theta), np.sin(theta)
+    h, w = im.shape[:2]
+    sums = []
+    for radius in [r - offset, r + offset]:
+        xs = np.clip(np.rint(x + radius * cos).astype(np.intp), 0, w - 1)
+        ys = np.clip(np.rint(y + radius * sin).astype(np.intp), 0, h - 1)
+        sums.append(im[ys, xs].sum(dtype=float))
+    inside, outside = sums
+    if inside + outside == 0:
+        return 0.
+    return (inside - outside) / (inside + outside)
+
+
+def _refineInBand(im: np.ndarray, factor: int, method: Methods, thresh: float, x: float, y: float, r: float, band: float) -> Tuple[float, float, float]:
+    """Refine a circle estimate at `factor` times lower resolution than `im` using only the pixels within `band` pixels,
+    at that resolution, of the circle's edge.
+
+    Only the bounding box of the circle is binned so the cost depends on the size of the circle rather than of the image.
+    Pixels that are well inside or outside of the circle are forced to the value they are expected to have so that they
+    don't affect the fit. This is only valid if the estimate is already within `band` pixels of the correct answer.
+    `x`, `y`, `r` and the result are in the coordinates of `im`.
+    """
+    reach = r + (band + 2) * factor
+    top, bottom = max(int(y - reach), 0), min(int(np.ceil(y + reach)) + 1, im.shape[0])
+    left, right = max(int(x - reach), 0), min(int(np.ceil(x + reach)) + 1, im.shape[1])
+    if top >= bottom or left >= right:
+        return x, y, r
+    crop = im[top:bottom, left:right]
+    if factor > 1:
+        crop = binImage(crop, factor)
+    offset = (factor - 1) / 2  # The center of a binned pixel in the coordinates of `im`.
+    cx, cy, cr = (x - left - offset) / factor, (y - top - offset) / factor, r / factor
+    if method == Methods.RayCasting:  # The rays only read pixels within the band anyway.
+        fx, fy, fr = fitCircleRays(crop, cx, cy, cr, band=band, iterations=1)
+    else:
+        yy, xx = np.ogrid[:crop.shape[0], :crop.shape[1]]
+        dist = np.sqrt((xx - cx) ** 2 + (yy - cy) ** 2)
+        inner = dist < cr - band
+        outer = dist > cr + band
+        if method == Methods.HoughTransform:
+            edges = detectEdges(crop)
+            edges[inner] = False
+            edges[outer] = False
+            radii = np.arange(max(int(cr - band), 1), int(cr + band) + 1)
+            fx, fy, fr = fitCircleHoughGradient(crop, edges, cx, cy, cr, radii=radii, centerRange=band)
+        else:
+            # Every thresholded method is refined by fitting the boundary in closed form. At this point it agrees with
+            # the best overlapping circle to well under a pixel, and an optimizer would cost more than the coarse fit.
+            binar = crop > thresh
+            binar[inner] = True
+            binar[outer] = False
+            bx, by = detectBoundaryPoints(binar)
+            fx, fy, fr = _fitPointsInBands(bx, by, cx, cy, cr, [band, 1.5])
+    if fr <= 0:  # No circle was found. Stick with the estimate from the previous level.
+        return x, y, r
+    return fx * factor + offset + left, fy * factor + offset + top, fr * factor
+
+
+def measureCirclePyramid(im: np.ndarray, method: Methods, levels: int, band: float = 4, guess: Tuple[float, float, float] = None, buffers: 'ScratchBuffers' = None, thresholder: Thresholder = None, intermediates: FitIntermediates = None) -> Tuple[Tuple[float, float, float], Tuple[float, float, float]]:
+    """Measure the aperture circle using a coarse-to-fine image pyramid.
+
+    The circle is first measured with `measureCircle` on the image binned by `2 ** levels`. The result is then refined
+    at each finer level of the pyramid, from `2 ** (levels - 1)` down to full resolution, using only a narrow band of
+    pixels around the edge of the circle. Only the coarsest level is binned from the whole image, the finer levels are
+    binned from the region around the circle as they are needed, giving full resolution accuracy for little more than
+    the cost of the coarse fit.
+
+    Args:
+        im: The image from the camera.
+        method: The method used to fit the circle.
+        levels: The number of pyramid levels. 0 is equivalent to `measureCircle`.
+        band: The half-width, in pixels of each level, of the region around the circle edge used for refinement.
+        guess: An x, y, r in full resolution coordinates to start the coarse fit from. If not provided then
+            `initialGuessCircle` is used.
+        buffers: If provided then the coarse level and its binarized image are stored in these buffers.
+        thresholder: Calculates the binarization threshold of the coarse level for a stream of frames.
+        intermediates: If provided then the intermediate results of the coarse fit are stored in it.
+
+    Returns:
+        The x, y, r of the initial guess and the x, y, r of the final fit, both in full resolution coordinates.
+    """
+    while levels > 0 and min(im.shape[:2]) // 2 ** levels < 2:  # The coarsest level must be at least 2 x 2.
+        levels -= 1
+    scale = 2 ** levels
+    offset = (scale - 1) / 2  # The center of a coarse pixel in full resolution coordinates.
+    with pipelineTimer.time('downSample'):
+        out = buffers.get('downSampled', binnedShape(im.shape, scale), im.dtype) if buffers is not None else None
+        coarse = binImage(im, scale, out=out, buffers=buffers)
+    if guess is not None:
+        guess = ((guess[0] - offset) / scale, (guess[1] - offset) / scale, guess[2] / scale)
+    if thresholder is None:
+        thresholder = Thresholder(stride=1)  # Only used for this frame, so the coarse level's threshold isn't calculated twice.
+    out = buffers.get('binary', coarse.shape, bool) if buffers is not None else None
+    (x0, y0, r0), (x, y, r) = measureCircle(coarse, method, guess=guess, out=out, thresholder=thresholder, intermediates=intermediates)
+    if intermediates is not None:
+        intermediates.scale = scale
+    guess = (x0 * scale + offset, y0 * scale + offset, r0 * scale)
+    x, y, r = x * scale + offset, y * scale + offset, r * scale
+    if r <= 0:  # The coarse fit failed, there is nothing to refine.
+        return guess, (x, y, r)
+
+    if method == Methods.OtsuMinimization:
+        thresh = thresholder.otsu(coarse)  # The threshold from the coarse fit is reused.
+    elif method in (Methods.LiMinimization, Methods.LeastSquaresEdge):
+        thresh = thresholder.li(coarse)
+    else:
+        thresh = None  # Hough and ray casting don't use a threshold.
+
+    with pipelineTimer.time('refine'):
+        for level in reversed(range(levels)):
+            x, y, r = _refineInBand(im, 2 ** level, method, thresh, x, y, r, band)
+    return guess, (x, y, r)
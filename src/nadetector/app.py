@@ -4,12 +4,14 @@ A very simple GUI that uses a CameraView to view live video from a camera.
 """
 from __future__ import annotations
 import sys
+import threading
 
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import (QApplication)
 
 import os
 
+from .analysis import importDependencies
 from .hardware.cameraManager import CameraManager
 from .mainWindow import Window
 from .widgets.cameraView import CircleOverlayCameraView
@@ -22,17 +24,21 @@ class App(QApplication):
         self.aboutToQuit.connect(self.onQuit)
 
         self.cameraManager = CameraManager(camera, self)
-        self.camview = CircleOverlayCameraView(self.cameraManager)
+        self.camview = CircleOverlayCameraView(self.cameraManager, sceneGraph=True)
         self.window = Window(self.camview, self.cameraManager)
 
         settings = QtCore.QSettings("BackmanLab", "NADetector")
         self.window.loadSettings(settings.value("windowSettings", defaultValue={'targetNA': 0.52, 'referenceNA': 1.49}))
 
         self.window.show()
+        # Load the fitting libraries while the camera starts up rather than when the first frame arrives.
+        threading.Thread(target=importDependencies, name="ImportDependencies", daemon=True).start()
 
     def onQuit(self) -> None:
         settings = QtCore.QSettings("BackmanLab", "NADetector")
         settings.setValue("windowSettings", self.window.getSettings())
+        self.window.recorder.stop()
+        self.camview.shutdown()
 
 
 
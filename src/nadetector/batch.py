@@ -0,0 +1,197 @@
+"""
+Measure the aperture in saved frames without the GUI. Frames can be TIFF files (single images or multi-page stacks) or
+NPY files (2D images or 3D stacks), given individually or as directories. Frames are fit in parallel by a pool of
+processes and the results are written one row per frame to a CSV file, or to a Parquet file if `pyarrow` is installed
+and the output path ends in `.parquet`.
+
+Example:
+    nadetector-batch calibration_frames/ -o results.csv --method LeastSquaresEdge --downsample 2 --reference-na 1.49 --reference-diameter 812
+"""
+from __future__ import annotations
+import argparse
+import csv
+import math
+import os
+import pathlib as pl
+import time
+import typing as t_
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from nadetector.analysis import measureCircleScaled
+from nadetector.constants import Methods
+from nadetector.fitWorker import ScratchBuffers
+from nadetector.thresholding import Thresholder
+
+TIFF_SUFFIXES = ('.tif', '.tiff')
+NPY_SUFFIXES = ('.npy',)
+
+COLUMNS = ['file', 'frame', 'method', 'downSample', 'pyramidLevels', 'x', 'y', 'r', 'na', 'x0', 'y0', 'r0', 'loadTime', 'fitTime', 'error']
+
+Task = t_.Tuple[str, int]  # A file path and the index of the frame within that file.
+
+_buffers: ScratchBuffers = None  # Each worker process gets its own scratch buffers.
+_thresholder: Thresholder = None  # And its own thresholder, consecutive frames of a stack often share a threshold.
+
+
+def countFrames(path: pl.Path) -> int:
+    """Return the number of frames in an image file."""
+    if path.suffix.lower() in NPY_SUFFIXES:
+        arr = np.load(path, mmap_mode='r')
+        return 1 if arr.ndim == 2 else arr.shape[0]
+    else:
+        import tifffile
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            return 1 if len(series.shape) == 2 else int(np.prod(series.shape[:-2]))
+
+
+def loadFrame(path: pl.Path, index: int) -> np.ndarray:
+    """Load a single frame from an image file. Stacks are memory-mapped or read one page at a time so the whole file
+    isn't loaded."""
+    if path.suffix.lower() in NPY_SUFFIXES:
+        arr = np.load(path, mmap_mode='r')
+        return np.asarray(arr if arr.ndim == 2 else arr[index])
+    else:
+        import tifffile
+        return tifffile.imread(path, key=index)
+
+
+def findTasks(inputs: t_.Iterable[str]) -> t_.List[Task]:
+    """Expand the input files and directories into a list of frames to fit, in a stable order."""
+    files = []
+    for i in inputs:
+        p = pl.Path(i)
+        if p.is_dir():
+            files += sorted(f for f in p.iterdir() if f.suffix.lower() in TIFF_SUFFIXES + NPY_SUFFIXES)
+        else:
+            files.append(p)
+    tasks = []
+    for f in files:
+        tasks += [(str(f), i) for i in range(countFrames(f))]
+    return tasks
+
+
+def _initWorker():
+    global _buffers, _thresholder
+    _buffers = ScratchBuffers()
+    _thresholder = Thresholder()
+
+
+def _fitTask(task: Task, method: Methods, downSample: int, pyramidLevels: int, naPerPix: t_.Optional[float]) -> dict:
+    path, index = task
+    row = dict(file=path, frame=index, method=method.name, downSample=downSample, pyramidLevels=pyramidLevels, error='')
+    try:
+        t = time.perf_counter()
+        im = loadFrame(pl.Path(path), index)
+        row['loadTime'] = time.perf_counter() - t
+        t = time.perf_counter()
+        (x0, y0, r0), (x, y, r) = measureCircleScaled(im, method, downSample, pyramidLevels, buffers=_buffers, thresholder=_thresholder)
+        row['fitTime'] = time.perf_counter() - t
+    except Exception as e:  # Record the failure and keep going with the other frames.
+        row['error'] = f"{type(e).__name__}: {e}"
+        return row
+    row.update(x=float(x), y=float(y), r=float(r), x0=float(x0), y0=float(y0), r0=float(r0))
+    row['na'] = 2 * float(r) * naPerPix if naPerPix is not None else math.nan
+    return row
+
+
+class CsvResultWriter:
+    """Writes result rows to a CSV file as they arrive."""
+    def __init__(self, path: str):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, row: dict):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResultWriter:
+    """Writes result rows to a Parquet file in row groups of `batchSize` rows. Requires `pyarrow`."""
+    def __init__(self, path: str, batchSize: int = 1000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        floatCols = ['x', 'y', 'r', 'na', 'x0', 'y0', 'r0', 'loadTime', 'fitTime']
+        self._schema = pa.schema([(c, pa.float64() if c in floatCols else (pa.int64() if c in ('frame', 'downSample', 'pyramidLevels') else pa.string())) for c in COLUMNS])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._batchSize = batchSize
+        self._rows: t_.List[dict] = []
+
+    def write(self, row: dict):
+        self._rows.append(row)
+        if len(self._rows) >= self._batchSize:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            cols = {c: [r.get(c) for r in self._rows] for c in COLUMNS}
+            self._writer.write_table(self._pa.Table.from_pydict(cols, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def runBatch(inputs: t_.Iterable[str], output: str, method: Methods = Methods.LiMinimization, downSample: int = 1,
+             pyramidLevels: int = 0, naPerPix: float = None, processes: int = None, chunkSize: int = 8) -> int:
+    """
+    Fit every frame found in `inputs` and write the results to `output`.
+
+    Args:
+        inputs: Image files and directories of image files.
+        output: The file to save results to. A `.parquet` extension writes Parquet, anything else writes CSV.
+        method: The fitting method.
+        downSample: The factor to down-sample each frame by before fitting.
+        pyramidLevels: If greater than 0 then coarse-to-fine fitting with this many levels is used instead of `downSample`.
+        naPerPix: The NA per pixel of diameter, from a reference measurement. If `None` the NA column is left empty.
+        processes: The number of worker processes. Defaults to the number of CPUs.
+        chunkSize: The number of frames sent to a worker process at a time.
+
+    Returns:
+        The number of frames processed.
+    """
+    tasks = findTasks(inputs)
+    writer = ParquetResultWriter(output) if output.lower().endswith('.parquet') else CsvResultWriter(output)
+    n = 0
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_initWorker) as pool:
+            args = (tasks, [method] * len(tasks), [downSample] * len(tasks), [pyramidLevels] * len(tasks), [naPerPix] * len(tasks))
+            for row in pool.map(_fitTask, *args, chunksize=chunkSize):  # Results arrive in order as they complete.
+                writer.write(row)
+                n += 1
+    finally:
+        writer.close()
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='nadetector-batch', description="Measure the aperture in saved TIFF/NPY frames.")
+    parser.add_argument('inputs', nargs='+', help="Image files or directories containing image files.")
+    parser.add_argument('-o', '--output', required=True, help="The results file. Use a `.parquet` extension for Parquet output, otherwise CSV is written.")
+    parser.add_argument('-m', '--method', choices=[m.name for m in Methods], default=Methods.LiMinimization.name)
+    parser.add_argument('-d', '--downsample', type=int, default=1, help="Down-sampling factor applied before fitting.")
+    parser.add_argument('--pyramid-levels', type=int, default=0, help="Use coarse-to-fine fitting with this many levels instead of down-sampling.")
+    parser.add_argument('--reference-na', type=float, help="The NA of a reference aperture, used to convert the measured diameter to NA.")
+    parser.add_argument('--reference-diameter', type=float, help="The diameter in pixels of the reference aperture.")
+    parser.add_argument('-j', '--processes', type=int, default=os.cpu_count(), help="The number of worker processes.")
+    args = parser.parse_args()
+
+    naPerPix = None
+    if args.reference_na is not None and args.reference_diameter:
+        naPerPix = args.reference_na / args.reference_diameter
+
+    t = time.perf_counter()
+    n = runBatch(args.inputs, args.output, Methods[args.method], args.downsample, args.pyramid_levels, naPerPix, args.processes)
+    print(f"Processed {n} frames in {time.perf_counter() - t:.1f} seconds.")
+
+
+if __name__ == '__main__':
+    main()
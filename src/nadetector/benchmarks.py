@@ -0,0 +1,251 @@
+"""
+Benchmarks for the circle fitting pipeline. Frames with a known aperture position are generated by `TestCamera` for a
+range of resolutions, noise levels and disc/ring modes. Every fitting method is run at each down-sampling factor, and
+the latency percentiles, peak memory, and center/radius error are recorded. Results are saved as JSON so that they can
+be compared between versions.
+
+The time taken to import the GUI and open the main window can be checked against a budget with `--startup`. This
+fails if the budget is exceeded or if any of the slow to import libraries in `DEFERRED_MODULES` are imported along with
+the GUI rather than when they are first needed.
+
+Example:
+    python -m nadetector.benchmarks -o before.json
+    python -m nadetector.benchmarks -o after.json --compare before.json
+    python -m nadetector.benchmarks --startup
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import typing as t_
+
+import numpy as np
+
+import nadetector
+from nadetector.analysis import measureCircleScaled
+from nadetector.constants import Methods
+from nadetector.fitWorker import ScratchBuffers
+from nadetector.thresholding import Thresholder
+from nadetector.hardware.testCamera import TestCamera
+
+RESOLUTIONS = [(512, 1024), (1024, 1280), (2048, 2448)]
+NOISE_LEVELS = [10, 60]
+DOWN_SAMPLES = [1, 2, 3]
+DEFERRED_MODULES = ['scipy.ndimage', 'scipy.optimize', 'skimage.feature', 'skimage.transform', 'instrumental']  # Shouldn't be imported with the GUI.
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import nadetector.app
+imported = time.perf_counter()
+loaded = [m for m in {deferred!r} if m in sys.modules]
+from nadetector.hardware import TestCamera
+app = nadetector.app.App(sys.argv[:1], TestCamera((512, 1024), 10, fast=True, seed=0))
+app.processEvents()
+shown = time.perf_counter()
+print(json.dumps(dict(importTime=imported - start, startupTime=shown - start, deferredLoaded=loaded)))
+app.camview.shutdown()
+"""
+
+
+def generateFrames(shape: t_.Tuple[int, int], noiseLevel: float, ring: bool, numFrames: int, seed: int = 0) -> t_.List[t_.Tuple[np.ndarray, t_.Tuple[float, float, float]]]:
+    """Generate frames and their ground truth x, y, r using the fast mode of `TestCamera`. The circle wanders a large
+    step between frames so that they cover a range of positions. The same seed gives the same frames."""
+    cam = TestCamera(shape, noiseLevel, ring=ring, fast=True, seed=seed, motion=min(shape) / 8)
+    return [cam.generate() for _ in range(numFrames)]
+
+
+def benchmarkCase(frames, method: Methods, downSample: int) -> dict:
+    """Fit each frame and summarize the latency, memory and accuracy."""
+    buffers = ScratchBuffers()
+    thresholder = Thresholder()  # As used by the GUI.
+    measureCircleScaled(frames[0][0], method, downSample, buffers=buffers)  # Warm up so that imports and buffer allocation aren't timed.
+
+    latencies, centerErrors, radiusErrors = [], [], []
+    failures = 0
+    for im, (tx, ty, tr) in frames:
+        t = time.perf_counter()
+        try:
+            _, (x, y, r) = measureCircleScaled(im, method, downSample, buffers=buffers, thresholder=thresholder)
+        except Exception:
+            failures += 1
+            continue
+        latencies.append(time.perf_counter() - t)
+        centerErrors.append(float(np.hypot(x - tx, y - ty)))
+        radiusErrors.append(float(abs(r - tr)))
+
+    # Memory is measured in a separate pass since tracing slows everything down.
+    tracemalloc.start()
+    try:
+        measureCircleScaled(frames[0][0], method, downSample, buffers=ScratchBuffers())
+    except Exception:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def pct(values, q):
+        return float(np.percentile(values, q)) if values else None
+
+    return dict(
+        latency_p50=pct(latencies, 50),
+        latency_p90=pct(latencies, 90),
+        latency_p99=pct(latencies, 99),
+        latency_max=max(latencies) if latencies else None,
+        peak_memory_mb=peak / 1e6,
+        center_error_mean=float(np.mean(centerErrors)) if centerErrors else None,
+        center_error_max=max(centerErrors) if centerErrors else None,
+        radius_error_mean=float(np.mean(radiusErrors)) if radiusErrors else None,
+        radius_error_max=max(radiusErrors) if radiusErrors else None,
+        failures=failures,
+    )
+
+
+def runBenchmarks(numFrames: int = 10, resolutions=RESOLUTIONS, noiseLevels=NOISE_LEVELS, methods: t_.Iterable[Methods] = Methods,
+                  downSamples=DOWN_SAMPLES, verbose: bool = True) -> dict:
+    """
+    Run every combination of resolution, noise level, disc/ring mode, method and down-sampling factor.
+
+    Returns:
+        A dictionary with `metadata` describing the environment and a list of `results`, one per combination.
+    """
+    results = []
+    methods = list(methods)
+    for shape in resolutions:
+        for noise in noiseLevels:
+            for ring in [False, True]:
+                frames = generateFrames(shape, noise, ring, numFrames)
+                for method in methods:
+                    for ds in downSamples:
+                        case = dict(height=shape[0], width=shape[1], noise=noise, ring=ring, method=method.name, downSample=ds, frames=numFrames)
+                        case.update(benchmarkCase(frames, method, ds))
+                        results.append(case)
+                        if verbose:
+                            p50 = case['latency_p50']
+                            print(f"{shape[1]}x{shape[0]} noise={noise} ring={ring} {method.name} ds={ds}: "
+                                  f"p50={p50 * 1e3 if p50 is not None else float('nan'):.1f} ms, "
+                                  f"center err={case['center_error_mean']}, failures={case['failures']}")
+    metadata = dict(
+        version=nadetector.__version__,
+        python=sys.version,
+        numpy=np.__version__,
+        platform=platform.platform(),
+        processor=platform.processor(),
+        date=datetime.datetime.now().isoformat(),
+    )
+    return dict(metadata=metadata, results=results)
+
+
+def benchmarkStartup(runs: int = 5) -> dict:
+    """
+    Time importing the GUI, and opening the main window with a simulated camera, in fresh interpreters.
+
+    Returns:
+        The median `importTime` and `startupTime` in seconds, and the `DEFERRED_MODULES` that were imported with the GUI.
+    """
+    script = _STARTUP_SCRIPT.format(deferred=DEFERRED_MODULES)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return dict(
+        importTime=float(np.median([s['importTime'] for s in samples])),
+        startupTime=float(np.median([s['startupTime'] for s in samples])),
+        deferredLoaded=sorted({m for s in samples for m in s['deferredLoaded']}),
+    )
+
+
+def checkStartupBudget(startup: dict, importBudget: float, startupBudget: float) -> t_.List[str]:
+    """Returns a description of each way that the results of `benchmarkStartup` break the budget."""
+    problems = []
+    if startup['importTime'] > importBudget:
+        problems.append(f"importing the GUI took {startup['importTime']:.2f} s, the budget is {importBudget:.2f} s")
+    if startup['startupTime'] > startupBudget:
+        problems.append(f"opening the window took {startup['startupTime']:.2f} s, the budget is {startupBudget:.2f} s")
+    for m in startup['deferredLoaded']:
+        problems.append(f"{m} was imported with the GUI")
+    return problems
+
+
+def _caseKey(case: dict) -> tuple:
+    return tuple(case[k] for k in ('height', 'width', 'noise', 'ring', 'method', 'downSample'))
+
+
+def compareResults(baseline: dict, current: dict, tolerance: float = 0.2) -> t_.List[str]:
+    """
+    Compare two sets of benchmark results.
+
+    Args:
+        baseline: Results loaded from a previous run.
+        current: The new results.
+        tolerance: The fractional increase in median latency, or absolute increase in mean center/radius error in pixels,
+            that counts as a regression.
+
+    Returns:
+        A description of each regression found.
+    """
+    base = {_caseKey(c): c for c in baseline['results']}
+    regressions = []
+    for case in current['results']:
+        old = base.get(_caseKey(case))
+        if old is None:
+            continue
+        name = "{width}x{height} noise={noise} ring={ring} {method} ds={downSample}".format(**case)
+        if old['latency_p50'] and case['latency_p50'] and case['latency_p50'] > old['latency_p50'] * (1 + tolerance):
+            regressions.append(f"{name}: median latency {old['latency_p50'] * 1e3:.1f} ms -> {case['latency_p50'] * 1e3:.1f} ms")
+        for key in ('center_error_mean', 'radius_error_mean'):
+            if old[key] is not None and case[key] is not None and case[key] > old[key] + tolerance:
+                regressions.append(f"{name}: {key} {old[key]:.2f} -> {case[key]:.2f} px")
+        if case['failures'] > old['failures']:
+            regressions.append(f"{name}: failures {old['failures']} -> {case['failures']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m nadetector.benchmarks', description="Benchmark the circle fitting methods.")
+    parser.add_argument('-o', '--output', help="Save the results to this JSON file.")
+    parser.add_argument('-n', '--frames', type=int, default=10, help="The number of frames per case.")
+    parser.add_argument('-m', '--methods', nargs='+', choices=[m.name for m in Methods], help="Only benchmark these methods.")
+    parser.add_argument('--quick', action='store_true', help="Only use the smallest resolution and lowest noise level.")
+    parser.add_argument('--compare', help="A previous results file to check for regressions against.")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--startup', action='store_true', help="Check the time taken to import the GUI and open the window instead.")
+    parser.add_argument('--import-budget', type=float, default=1.0, help="The longest the GUI may take to import, in seconds.")
+    parser.add_argument('--startup-budget', type=float, default=3.0, help="The longest the window may take to open, in seconds.")
+    args = parser.parse_args()
+
+    if args.startup:
+        startup = benchmarkStartup()
+        print(f"Import: {startup['importTime']:.3f} s, window shown: {startup['startupTime']:.3f} s")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(dict(startup=startup), f, indent=2)
+        problems = checkStartupBudget(startup, args.import_budget, args.startup_budget)
+        for p in problems:
+            print("OVER BUDGET:", p)
+        if problems:
+            sys.exit(1)
+        return
+
+    methods = [Methods[m] for m in args.methods] if args.methods else list(Methods)
+    resolutions, noiseLevels = (RESOLUTIONS[:1], NOISE_LEVELS[:1]) if args.quick else (RESOLUTIONS, NOISE_LEVELS)
+    results = runBenchmarks(args.frames, resolutions, noiseLevels, methods)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compareResults(baseline, results, args.tolerance)
+        for r in regressions:
+            print("REGRESSION:", r)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Fit the aperture with several methods at once and combine the results. Any single method can fail depending on the
+illumination, for example the Hough transform finds no circle or the initial guess falls back to `1, 1, 1`, so fits
+that are implausible or that disagree with the majority are rejected before the rest are averaged.
+
+Most of the fitting methods hold the GIL (the overlap cost is evaluated in Python for every step of the optimizer) so
+threads don't run them in parallel. Each method instead has its own worker process, and the frame is shared with them
+through a block of shared memory so that only the fit parameters are sent between processes.
+"""
+from __future__ import annotations
+import multiprocessing
+import threading
+import time
+import traceback
+import typing as t_
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from nadetector.constants import Methods
+
+Circle = t_.Tuple[float, float, float]
+
+
+def combineFits(fits: t_.Dict[Methods, t_.Optional[Circle]], shape: t_.Tuple[int, int], minTolerance: float = 2) -> t_.Tuple[t_.Optional[Circle], t_.Dict[Methods, float]]:
+    """
+    Combine the fits of several methods, rejecting outliers.
+
+    Fits are first rejected if they aren't plausible: a radius under 2 pixels or a center outside of the image. Each
+    remaining fit's deviation from the median fit is the distance between their centers plus the difference in radius.
+    Fits that deviate by more than 3 robust standard deviations (from the median absolute deviation, but at least
+    `minTolerance` or 1% of the radius) are rejected and the rest are averaged.
+
+    Args:
+        fits: The x, y, r found by each method, or `None` if it failed.
+        shape: The shape of the image.
+        minTolerance: The smallest deviation in pixels that can be treated as an outlier, so that methods which agree
+            to within a pixel or two are all kept.
+
+    Returns:
+        The consensus x, y, r, or `None` if no fit was plausible. And for each method a score from 0 to 1 of how well
+        it agrees with the consensus, 0 if it failed.
+    """
+    h, w = shape[:2]
+    valid = {m: f for m, f in fits.items() if f is not None and np.all(np.isfinite(f)) and f[2] >= 2 and 0 <= f[0] < w and 0 <= f[1] < h}
+    scores = {m: 0. for m in fits}
+    if not valid:
+        return None, scores
+    arr = np.array(list(valid.values()), dtype=float)
+    median = np.median(arr, axis=0)
+    deviation = np.hypot(arr[:, 0] - median[0], arr[:, 1] - median[1]) + np.abs(arr[:, 2] - median[2])
+    tolerance = max(minTolerance, 0.01 * median[2])
+    spread = max(1.4826 * np.median(deviation), tolerance)
+    inliers = deviation <= 3 * spread
+    consensus = arr[inliers].mean(axis=0)
+    deviation = np.hypot(arr[:, 0] - consensus[0], arr[:, 1] - consensus[1]) + np.abs(arr[:, 2] - consensus[2])
+    for m, d in zip(valid, deviation):
+        scores[m] = float(np.exp(-0.5 * (d / (2 * tolerance)) ** 2))  # 1 for an exact match, 0.6 at twice the tolerance.
+    return tuple(float(i) for i in consensus), scores
+
+
+_workerState: t_.Dict[str, t_.Any] = {}  # The shared memory, thresholder and buffers of a worker process.
+
+
+def _fitInWorker(shmName: str, shape: t_.Tuple[int, ...], dtype: str, method: Methods, downSample: int, pyramidLevels: int,
+                 guess: t_.Optional[Circle]) -> t_.Tuple[Circle, Circle, float]:
+    """Run in a worker process. Fits the frame in shared memory and returns the initial guess, the fit, and the time taken."""
+    from nadetector.analysis import measureCircleScaled
+    from nadetector.fitWorker import ScratchBuffers
+    from nadetector.thresholding import Thresholder
+    start = time.perf_counter()
+    shm = _workerState.get('shm')
+    if shm is None or shm.name != shmName:
+        if shm is not None:
+            shm.close()
+        shm = _workerState['shm'] = shared_memory.SharedMemory(shmName)
+    if 'buffers' not in _workerState:
+        _workerState['buffers'] = ScratchBuffers()
+        _workerState['thresholder'] = Thresholder()
+    im = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    guess, fit = measureCircleScaled(im, method, downSample, pyramidLevels, guess=guess, buffers=_workerState['buffers'],
+                                     thresholder=_workerState['thresholder'])
+    return guess, fit, time.perf_counter() - start
+
+
+def _warmUp():
+    """Run in a worker process so the first frame doesn't wait for the imports."""
+    from nadetector.analysis import importDependencies
+    importDependencies()
+
+
+class ConsensusFitter:
+    """
+    Fits each frame with several methods in parallel, one worker process per method, and combines the results with
+    `combineFits`. The wall clock time per frame is close to that of the slowest method. The worker processes are
+    started by the first call to `measure`, and replaced if they die, so they are only created by the thread that calls
+    `measure`, which should be one thread at a time. `shutdown` can be called from any thread, after which `measure`
+    raises an error.
+
+    Args:
+        methods: The methods to combine.
+        minTolerance: See `combineFits`.
+    """
+    def __init__(self, methods: t_.Iterable[Methods] = tuple(Methods), minTolerance: float = 2):
+        self.methods = list(methods)
+        self.minTolerance = minTolerance
+        self._executors: t_.Dict[Methods, ProcessPoolExecutor] = {}
+        self._lock = threading.Lock()  # Protects `_executors`, `_closed` and `_measuring`.
+        self._closed = False
+        self._measuring = False  # True during `measure`, when the shared memory is in use.
+        self._shm: t_.Optional[shared_memory.SharedMemory] = None
+        self._futures: t_.Set[Future] = set()  # Calls to the workers that haven't finished, so `shutdown` can cancel them.
+        self.fits: t_.Dict[Methods, t_.Optional[Circle]] = {}  # The fit found by each method for the last frame.
+        self.scores: t_.Dict[Methods, float] = {}  # How well each method agreed with the consensus for the last frame.
+        self.latencies: t_.Dict[Methods, float] = {}  # The time each method took for the last frame, in seconds.
+
+    def _start(self) -> t_.Dict[Methods, ProcessPoolExecutor]:
+        """Start any worker processes that aren't running and have them import the fitting libraries. Returns the
+        executor of each method."""
+        context = multiprocessing.get_context('spawn')  # Forking a process with running Qt and camera threads isn't safe.
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The ConsensusFitter has been shut down.")
+            for m in self.methods:
+                if m not in self._executors:
+                    self._executors[m] = ProcessPoolExecutor(max_workers=1, mp_context=context)
+                    self._submit(self._executors[m], _warmUp)
+            self._measuring = True
+            return dict(self._executors)
+
+    def _submit(self, executor: ProcessPoolExecutor, func: t_.Callable, *args) -> Future:
+        future = executor.submit(func, *args)
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+        return future
+
+    def shutdown(self):
+        """Stop the worker processes. A `measure` in progress on another thread fails, and releases the shared memory
+        once it returns."""
+        with self._lock:
+            self._closed = True
+            release = not self._measuring
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for future in list(self._futures):  # `cancel_futures` of `Executor.shutdown` needs Python 3.9.
+            future.cancel()  # Only calls that haven't started are cancelled.
+        for ex in executors:
+            ex.shutdown(wait=True)
+        if release:
+            self._releaseSharedMemory()
+
+    def _releaseSharedMemory(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _share(self, im: np.ndarray) -> np.ndarray:
+        """Copy the frame into shared memory, which is only reallocated if it is too small."""
+        if self._shm is None or self._shm.size < im.nbytes:
+            self._releaseSharedMemory()
+            self._shm = shared_memory.SharedMemory(create=True, size=im.nbytes)
+        shared = np.ndarray(im.shape, dtype=im.dtype, buffer=self._shm.buf)
+        np.copyto(shared, im)
+        return shared
+
+    def measure(self, im: np.ndarray, downSample: int = 1, pyramidLevels: int = 0, guess: Circle = None) -> t_.Tuple[Circle, Circle]:
+        """
+        Fit the frame with every method and combine the results. Takes the same arguments as `measureCircleScaled`.
+
+        Returns:
+            The median of the methods' initial guesses and the consensus x, y, r. `0, 0, 0` for both if every method failed.
+        """
+        executors = self._start()
+        try:
+            self._share(im)
+            futures = {m: self._submit(executors[m], _fitInWorker, self._shm.name, im.shape, im.dtype.str, m, downSample, pyramidLevels, guess)
+                       for m in self.methods}
+            guesses = []
+            self.fits.clear()
+            self.latencies.clear()
+            for m, future in futures.items():
+                try:
+                    g, fit, elapsed = future.result()
+                except BrokenProcessPool:  # The worker died. It will be replaced on the next frame.
+                    traceback.print_exc()
+                    with self._lock:
+                        if self._executors.get(m) is executors[m]:
+                            del self._executors[m]
+                    fit = None
+                except Exception:
+                    traceback.print_exc()
+                    fit = None
+                else:
+                    guesses.append(g)
+                    self.latencies[m] = elapsed
+                self.fits[m] = fit
+        finally:
+            with self._lock:
+                self._measuring = False
+                release = self._closed
+            if release:  # Shut down while measuring.
+                self._releaseSharedMemory()
+        fit, self.scores = combineFits(self.fits, im.shape, self.minTolerance)
+        if fit is None:
+            return (0, 0, 0), (0, 0, 0)
+        return tuple(float(i) for i in np.median(guesses, axis=0)), fit
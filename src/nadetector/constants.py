@@ -5,3 +5,5 @@ class Methods(Enum):
     LiMinimization = auto()
     OtsuMinimization = auto()
     HoughTransform = auto()
+    LeastSquaresEdge = auto()
+    RayCasting = auto()
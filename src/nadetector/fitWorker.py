@@ -0,0 +1,175 @@
+from __future__ import annotations
+import threading
+import traceback
+import typing as t_
+
+import numpy as np
+
+
+class ScratchBuffers:
+    """
+    A set of named arrays that are reused between frames. An array is only reallocated when the requested shape or dtype
+    changes, so a stream of same-sized frames doesn't cause any allocations. Not thread safe, each thread should have
+    its own instance.
+    """
+    def __init__(self):
+        self._buffers: t_.Dict[str, np.ndarray] = {}
+
+    def get(self, name: str, shape: t_.Tuple[int, ...], dtype) -> np.ndarray:
+        """
+        Get a buffer. The contents are whatever was left by the last user.
+
+        Args:
+            name: A name identifying the buffer.
+            shape: The shape of the array needed.
+            dtype: The dtype of the array needed.
+        """
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != np.dtype(dtype):
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+    def clear(self):
+        self._buffers.clear()
+
+
+class FitWorker:
+    """
+    A long lived thread that runs a fitting function on frames. New frames are put into a single slot, if a frame is
+    already waiting there when a new one arrives then the older frame is dropped so the worker is always working on the
+    most recent frame available.
+
+    If the fit function returns the same object as its previous result, for example because the frame hadn't changed and
+    the previous fit was reused, then there is no new result. The previous result keeps the `info` of the frame that it
+    was fit from and isn't returned by `takeResult` again.
+
+    Args:
+        fitFunction: The function to run on each frame. It is passed the frame and the worker's `ScratchBuffers`.
+    """
+    def __init__(self, fitFunction: t_.Callable[[np.ndarray, ScratchBuffers], t_.Any]):
+        self._fitFunction = fitFunction
+        self.buffers = ScratchBuffers()
+        self._cond = threading.Condition()
+        self._pending: t_.Optional[t_.Tuple[int, np.ndarray, t_.Any]] = None
+        self._inputs: t_.List[t_.Optional[np.ndarray]] = [None, None]  # The frames copied by `submit`, one waiting and one being fit.
+        self._fitting: t_.Optional[np.ndarray] = None  # The frame the worker is fitting.
+        self._result = None
+        self._resultInfo = None
+        self.resultInfo = None  # The `info` submitted with the frame of the result last returned by `takeResult` or `waitForResult`.
+        self._resultId = 0  # The id of the frame that `_result` belongs to.
+        self._doneId = 0  # The id of the last frame that the worker finished with, whether or not it succeeded.
+        self._resultTaken = True
+        self._nextId = 0
+        self._busy = False
+        self._running = True
+        self.droppedFrames = 0  # The number of frames that were replaced before the worker got to them.
+        self.fittedFrames = 0  # The number of frames that gave a new result.
+        self._thread = threading.Thread(target=self._run, name="FitWorker", daemon=True)
+        self._thread.start()
+
+    def submit(self, im: np.ndarray, info: t_.Any = None, copy: bool = False) -> int:
+        """
+        Give a new frame to the worker. Unless `copy` is true the worker keeps a reference to the array so it should not
+        be modified afterwards.
+
+        Args:
+            im: The frame.
+            copy: If true then the frame is copied before this returns, into one of two buffers that are reused for each
+                frame. This should be used for frames that will be overwritten, such as views into a ring buffer.
+            info: Anything identifying the frame, such as its sequence number. It is available as `resultInfo` once the
+                result for this frame is taken.
+
+        Returns:
+            An id that can be passed to `waitForResult`.
+        """
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("The FitWorker has been shut down.")
+            if self._pending is not None:
+                self.droppedFrames += 1
+            if copy:
+                im = self._copyInput(im)
+            self._nextId += 1
+            self._pending = (self._nextId, im, info)
+            self._cond.notify_all()
+            return self._nextId
+
+    def _copyInput(self, im: np.ndarray) -> np.ndarray:
+        """Copy a frame into whichever input buffer the worker isn't fitting. Called with the lock held, so a frame that
+        is waiting is safely overwritten."""
+        i = 1 if self._fitting is not None and self._inputs[0] is self._fitting else 0
+        buf = self._inputs[i]
+        if buf is None or buf.shape != im.shape or buf.dtype != im.dtype:
+            buf = self._inputs[i] = np.empty_like(im)
+        np.copyto(buf, im)
+        return buf
+
+    def isBusy(self) -> bool:
+        """Returns True if the worker is fitting a frame or has a frame waiting to be fit."""
+        with self._cond:
+            return self._busy or self._pending is not None
+
+    def takeResult(self):
+        """Returns the most recent result if it hasn't already been taken, otherwise `None`. Does not block."""
+        with self._cond:
+            if self._resultTaken:
+                return None
+            self._resultTaken = True
+            self.resultInfo = self._resultInfo
+            return self._result
+
+    def waitForResult(self, frameId: int, timeout: float = None):
+        """
+        Block until the frame with id `frameId` (or a more recent one) has been fit.
+
+        Returns:
+            The result, or `None` if the timeout expired, the fit failed, the previous result was reused, or the worker
+            was shut down.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._doneId >= frameId or not self._running, timeout)
+            if self._resultId < frameId:
+                return None
+            self._resultTaken = True
+            self.resultInfo = self._resultInfo
+            return self._result
+
+    def shutdown(self, timeout: float = None):
+        """Stop the worker thread. A frame that is waiting to be fit is discarded. Blocks until the thread has exited or
+        `timeout` seconds have passed."""
+        with self._cond:
+            self._running = False
+            self._pending = None
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def isRunning(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or not self._running)
+                if not self._running:
+                    return
+                frameId, im, info = self._pending
+                self._pending = None
+                self._busy = True
+                self._fitting = im
+            try:
+                result = self._fitFunction(im, self.buffers)
+            except Exception:  # Don't let a bad frame kill the worker.
+                traceback.print_exc()
+                result = None
+            with self._cond:
+                self._busy = False
+                self._fitting = None
+                if result is not None and result is not self._result:
+                    self._result = result
+                    self._resultInfo = info
+                    self._resultId = frameId
+                    self._resultTaken = False
+                    self.fittedFrames += 1
+                self._doneId = frameId  # Waiters for this frame should stop waiting even if it failed.
+                self._cond.notify_all()
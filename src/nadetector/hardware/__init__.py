@@ -1,2 +1,6 @@
 from .cameraManager import CameraManager
-from .testCamera import TestCamera
\ No newline at end of file
+from .testCamera import TestCamera
+from .replayCamera import ReplayCamera
+from .frameBuffer import FrameRingBuffer, Frame
+from .autoExposure import AutoExposer, ExposureController
+from .recorder import Recorder
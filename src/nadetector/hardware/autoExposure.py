@@ -0,0 +1,153 @@
+from __future__ import annotations
+import math
+import threading
+import traceback
+import typing as t_
+
+import numpy as np
+
+if t_.TYPE_CHECKING:
+    from nadetector.hardware.cameraManager import CameraManager
+
+
+def histogramPercentile(arr: np.ndarray, percentile: float, stride: int = 1) -> float:
+    """
+    Find a percentile of an integer image from its histogram rather than by sorting the pixels. 8-bit images use 256
+    bins. Wider images are shifted down to 4096 bins so the result is accurate to within a bin width. The top of the
+    bin is returned, so a saturated image gives full scale.
+
+    Args:
+        arr: An unsigned integer image.
+        percentile: The percentile to find, between 0 and 100.
+        stride: Only every `stride`th pixel along each axis is used.
+
+    Returns:
+        The pixel value at the percentile.
+    """
+    if stride > 1:
+        arr = arr[::stride, ::stride]
+    bits = arr.dtype.itemsize * 8
+    shift = max(bits - 12, 0)
+    values = arr.ravel()
+    if shift:
+        values = values >> shift
+    hist = np.bincount(values, minlength=2 ** (bits - shift))
+    cdf = np.cumsum(hist)
+    idx = int(np.searchsorted(cdf, percentile / 100 * cdf[-1]))
+    return float(((idx + 1) << shift) - 1)
+
+
+class ExposureController:
+    """
+    Calculates exposure changes that bring a bright percentile of the image to a target level.
+
+    Adjustments are made on the logarithm of the exposure. Since signal is proportional to exposure, each step removes
+    a fraction `gain` of the remaining error in a single frame, so the exposure settles within a bounded number of
+    frames without oscillating. When the image is saturated the true level is unknown, so the exposure is divided by
+    `maxStep` instead.
+
+    Args:
+        target: The desired level of the percentile, as a fraction of full scale.
+        tolerance: No change is made if the level is within this fraction of full scale of the target.
+        gain: The fraction of the error (in log space) corrected each step. Values between 0 and 1 are damped.
+        maxStep: The largest factor the exposure can change by in one step.
+        minExposure: The smallest allowed exposure in ms.
+        maxExposure: The largest allowed exposure in ms.
+    """
+    def __init__(self, target: float = 250 / 255, tolerance: float = 5 / 255, gain: float = 0.8, maxStep: float = 4,
+                 minExposure: float = 0.01, maxExposure: float = 1000):
+        self.target = target
+        self.tolerance = tolerance
+        self.gain = gain
+        self.maxStep = maxStep
+        self.minExposure = minExposure
+        self.maxExposure = maxExposure
+
+    def update(self, exposure: float, level: float) -> t_.Optional[float]:
+        """
+        Args:
+            exposure: The exposure in ms that the frame was taken with.
+            level: The measured percentile as a fraction of full scale.
+
+        Returns:
+            The new exposure in ms, or `None` if no change is needed.
+        """
+        if level >= 1:  # Saturated
+            newExp = exposure / self.maxStep
+        elif abs(self.target - level) <= self.tolerance:
+            return None
+        else:
+            maxLog = math.log(self.maxStep)
+            step = self.gain * math.log(self.target / max(level, 1e-3))
+            newExp = exposure * math.exp(min(max(step, -maxLog), maxLog))
+        newExp = min(max(newExp, self.minExposure), self.maxExposure)
+        if newExp == exposure:  # Pinned at one of the limits
+            return None
+        return newExp
+
+
+class AutoExposer:
+    """
+    Runs auto exposure on a background thread. Each time a frame acquired after the last exposure change arrives in the
+    camera's ring buffer, a high percentile of the frame (or of the box around `roi`) is measured and the exposure is
+    updated by an `ExposureController`. Nothing runs on the GUI thread.
+
+    Args:
+        camera: The camera manager whose exposure is controlled.
+        controller: Calculates the exposure changes. A default controller is used if not provided.
+        percentile: The percentile of the image that is brought to the target level.
+        stride: Only every `stride`th pixel along each axis is used to measure the percentile.
+    """
+    def __init__(self, camera: CameraManager, controller: ExposureController = None, percentile: float = 99.7, stride: int = 2):
+        self._camera = camera
+        self.controller = controller if controller is not None else ExposureController()
+        self.percentile = percentile
+        self.stride = stride
+        self.roi: t_.Optional[t_.Tuple[float, float, float]] = None  # If set then only the box around this x, y, r is measured.
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        if self.isRunning():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="AutoExposure", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def isRunning(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _crop(self, arr: np.ndarray) -> np.ndarray:
+        if self.roi is None:
+            return arr
+        b = self._camera.binningOf(arr)  # The ROI is in unbinned pixels.
+        x, y, r = (self.roi[0] - (b - 1) / 2) / b, (self.roi[1] - (b - 1) / 2) / b, self.roi[2] / b
+        top, left = max(int(y - r), 0), max(int(x - r), 0)
+        crop = arr[top:int(y + r) + 1, left:int(x + r) + 1]
+        return crop if crop.size > 0 else arr
+
+    def _run(self):
+        lastSeq = 0
+        while not self._stop.is_set():
+            # We have to wait for a fresh frame to make sure it's actually at the correct exposure.
+            frame = self._camera.frameBuffer.waitForFrame(max(lastSeq, self._camera.exposureSeq), timeout=0.1)
+            if frame is None or not self._camera.isRunning or self._camera.exposurePending:
+                continue  # Frames taken while a change is pending would lead to the same correction being made twice.
+            if frame.seq <= self._camera.exposureSeq:
+                continue  # The exposure was changed while we were waiting.
+            lastSeq = frame.seq
+            try:
+                arr = self._crop(frame.data)
+                fullScale = np.iinfo(arr.dtype).max if arr.dtype.kind in 'ui' else 1
+                level = histogramPercentile(arr, self.percentile, self.stride) / fullScale
+                newExp = self.controller.update(self._camera.getExposure(), level)
+                if newExp is not None and not self._stop.is_set():
+                    self._camera.setExposure(newExp)
+            except Exception:
+                traceback.print_exc()
@@ -1,9 +1,19 @@
-from PyQt5.QtCore import QTimer, pyqtSignal, QObject
-from instrumental.drivers.cameras import Camera
+from __future__ import annotations
+from PyQt5.QtCore import pyqtSignal, QObject
+import collections
+import threading
 import time
 import os
+import traceback
+import typing as t_
 import numpy as np
 
+from nadetector.hardware.autoExposure import AutoExposer
+from nadetector.hardware.frameBuffer import FrameRingBuffer
+from nadetector.timing import pipelineTimer
+if t_.TYPE_CHECKING:
+    from instrumental.drivers.cameras import Camera  # Importing instrumental is slow.
+
 # def log(n):
 #     def dec(f):
 #         def newf(*args, **kwargs):
@@ -13,101 +23,309 @@ import numpy as np
 #         return newf
 #     return dec
 
+def supportedBinnings(camera) -> t_.Set[int]:
+    """Ask the camera driver which binning factors the camera supports in both directions. Only uc480 cameras can be
+    asked, other cameras are assumed not to support binning since the base class of Instrumental cameras accepts the
+    `vbin` and `hbin` arguments whether or not the driver does anything with them."""
+    supported = {1}
+    if type(camera).__module__ != 'instrumental.drivers.cameras.uc480':  # Only checked by name so that instrumental isn't imported.
+        return supported
+    try:
+        from instrumental.drivers.cameras import uc480
+        mask = camera._dev.SetBinning(uc480.lib.GET_SUPPORTED_BINNING)
+        for factor, vCode in uc480.BIN_V_CODE_FROM_NUM.items():
+            hCode = uc480.BIN_H_CODE_FROM_NUM[factor]
+            if factor > 1 and mask & vCode and mask & hCode:
+                supported.add(factor)
+    except Exception:
+        traceback.print_exc()
+    return supported
+
+
 class CameraManager(QObject):
+    """
+    Wraps an Instrumental camera. While live video is running a dedicated acquisition thread blocks on the camera and
+    copies each new frame into a `FrameRingBuffer`. `frameReady` is emitted on the GUI thread with a view of the latest
+    frame, its sequence number and its acquisition timestamp. If the GUI falls behind then intermediate frames are
+    skipped rather than queued up, they are counted in `frameBuffer.overruns['display']`.
+
+    Exposure changes are applied by a background thread. Requests that arrive while a change is in progress are coalesced
+    so that only the most recent value is applied. If the camera driver can change the exposure during live video then
+    that is used, otherwise live video is restarted, no more often than `minRestartInterval` seconds.
+
+    If the camera driver supports binning then `setBinning` has the camera average blocks of pixels itself, so smaller
+    frames are transferred and copied. `width` and `height` are always those of an unbinned frame, use `binningOf` to
+    find the binning of a frame.
+
+    Args:
+        camera: The camera to use.
+        parent: The parent QObject.
+        numSlots: The number of frames held in the ring buffer.
+    """
     exposureChanged = pyqtSignal(float)
-    frameReady = pyqtSignal(np.ndarray)
+    exposureChangeCost = pyqtSignal(float, int)  # The exposure applied and the number of frames the change cost.
+    frameReady = pyqtSignal(np.ndarray, int, float)  # The frame, its sequence number and its `time.perf_counter` timestamp.
+    _frameAvailable = pyqtSignal()  # Emitted from the acquisition thread
 
-    def __init__(self, camera: Camera, parent: QObject = None):
+    def __init__(self, camera: Camera, parent: QObject = None, numSlots: int = 8):
         super().__init__(parent)
         self._cam = camera
         self._exposure = 10
         self.isRunning = False
-        self._aeEnabled = False
-        self._aeTimer = QTimer()
-        self._aeTimer.setSingleShot(True)
-        self._aeTimer.setInterval(100)  # This is in milliseconds
-        self._aeTimer.timeout.connect(self._runAutoExpose)
-        self._frameGrabTimer = QTimer()
-        self._frameGrabTimer.setSingleShot(False)
-        self._frameGrabTimer.setInterval(50)
-        self._frameGrabTimer.timeout.connect(self._waitForFrame)
-
-    def _waitForFrame(self):
-        ready = self._cam.wait_for_frame(timeout='0 ms')
-        if ready and self.isRunning:
-            self.frameReady.emit(self._cam.latest_frame())
+        self.minRestartInterval = 0.25  # Restarting live video too quickly can crash the driver. See `camtest.py`.
+        self._inPlaceExposure = hasattr(type(camera), 'exposure')  # Checked on the type so the camera isn't queried.
+        self._supportedBinnings = supportedBinnings(camera)
+        self._binning = 1
+        self._sensorShape: t_.Optional[t_.Tuple[int, int]] = None  # The height and width of an unbinned frame, once binning has been requested.
+        self._exposureCond = threading.Condition()
+        self._requestedExposure: float = None
+        self._exposureBusy = False
+        self._lastRestart = 0.
+        self._pendingCost = None  # The sequence number, timestamp and exposure of an exposure change whose cost isn't known yet.
+        self._frameInterval: float = None  # A running average of the time between frames.
+        self._lastFrameTime: float = None
+        self._costLock = threading.Lock()  # Protects `_pendingCost`, which is shared by the exposure and acquisition threads.
+        self.exposureChanges = collections.deque(maxlen=100)  # (exposure, requests coalesced, restarted, frames cost) of recent changes. The cost is `None` if unknown.
+        self._coalesced = 0
+        self.frameBuffer = FrameRingBuffer(numSlots)
+        self.frameBuffer.register('display')
+        self._exposureSeq = 0  # Frames after this sequence number were taken with the current exposure.
+        self._acqThread: threading.Thread = None
+        self._stopAcquisition = threading.Event()
+        self._notifyPending = threading.Event()  # Set while a `_frameAvailable` emission hasn't been handled yet.
+        self._frameAvailable.connect(self._onFrameAvailable)
+        self._lock = threading.RLock()  # The exposure is changed from the exposure thread.
+        self.autoExposer = AutoExposer(self)
+        self._exposureThread = threading.Thread(target=self._applyExposures, name="CameraExposure", daemon=True)
+        self._exposureThread.start()
+
+    def _acquire(self):
+        """Run on the acquisition thread. Starts live video, then copies each new frame from the camera into the ring
+        buffer. The camera is started here rather than by `start_live_video` since starting can be slow."""
+        try:
+            self._callCamera(self._cam.start_live_video)
+        except Exception as e:  # If the exposure setting string is bad we can get an error here
+            print(e)
+            return
+        checkBinning = self._binning != 1
+        while not self._stopAcquisition.is_set():
+            try:
+                ready = self._cam.wait_for_frame(timeout='100 ms')
+                if not ready or self._stopAcquisition.is_set():
+                    continue
+                t0 = time.perf_counter()
+                arr = self._cam.latest_frame(copy=False)
+                if checkBinning:
+                    checkBinning = False
+                    if self.binningOf(arr) != self._binning:  # The driver accepted the binning but didn't apply it.
+                        print(f"The camera didn't apply a binning of {self._binning}, binning is disabled.")
+                        self._supportedBinnings = {1}
+                        self._binning = 1
+                t1 = time.perf_counter()
+                seq = self.frameBuffer.write(arr)
+                t2 = time.perf_counter()
+                pipelineTimer.record('acquire', t1 - t0, t1)
+                pipelineTimer.record('copy', t2 - t1, t2)
+                self._updateExposureCost(seq)
+            except Exception:
+                traceback.print_exc()
+                time.sleep(0.1)  # Don't spin if the camera is in a bad state.
+                continue
+            if not self._notifyPending.is_set():
+                self._notifyPending.set()
+                self._frameAvailable.emit()
+
+    def _onFrameAvailable(self):
+        """Runs on the GUI thread in response to `_frameAvailable`."""
+        self._notifyPending.clear()
+        frame = self.frameBuffer.readLatest('display')
+        if frame is not None and self.isRunning:
+            self.frameReady.emit(frame.data, frame.seq, frame.timestamp)
 
     def setAutoExposure(self, enabled: bool):
-        self._aeEnabled = enabled
-        if self._aeTimer.isActive() and (not enabled):
-            self._aeTimer.stop()
-        elif (not self._aeTimer.isActive()) and enabled:
-            self._aeTimer.start()
+        """Auto exposure runs on a background thread while live video is running."""
+        if enabled:
+            self.autoExposer.start()
+        else:
+            self.autoExposer.stop()
 
     def isAutoExposure(self):
-        return self._aeEnabled
+        return self.autoExposer.isRunning()
+
+    def setAutoExposureROI(self, x: float = None, y: float = None, r: float = None):
+        """Only expose for the pixels in the box around the circle at x, y, r. Call with no arguments to use the whole
+        frame."""
+        self.autoExposer.roi = None if r is None else (x, y, r)
+
+    @property
+    def exposureSeq(self) -> int:
+        """Frames with a sequence number greater than this were taken with the current exposure."""
+        return self._exposureSeq
+
+    @property
+    def exposurePending(self) -> bool:
+        """True if an exposure change has been requested but not applied yet."""
+        return self._exposureBusy
 
     def setExposure(self, exp: float):
-        oldexp = self._exposure
-        self._exposure = exp
-        if self.isRunning:
-            self.stop_live_video()
-#            time.sleep(oldexp/1000 + 0.1)  # This delay helps prevent a hard crash. Still happens sometimes though. Makes things laggy during autoexposure
-            self.start_live_video()  # This is to update the exposure used.
-        self.exposureChanged.emit(self._exposure)
+        """Request a new exposure in ms. This returns immediately, `exposureChanged` is emitted once it is applied."""
+        with self._exposureCond:
+            if self._requestedExposure is not None:
+                self._coalesced += 1
+            self._requestedExposure = exp
+            self._exposureBusy = True
+            self._exposureCond.notify_all()
 
     def getExposure(self):
+        """The exposure in ms that is currently applied."""
         return self._exposure
 
+    def _applyExposures(self):
+        """Runs on the exposure thread. Applies the most recently requested exposure."""
+        while True:
+            with self._exposureCond:
+                self._exposureCond.wait_for(lambda: self._requestedExposure is not None)
+            if self.isRunning and not self._inPlaceExposure:
+                wait = self._lastRestart + self.minRestartInterval - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)  # Further requests that arrive in the meantime replace this one.
+            with self._exposureCond:
+                exp = self._requestedExposure
+                coalesced = self._coalesced
+                self._requestedExposure = None
+                self._coalesced = 0
+            try:
+                self._applyExposure(exp, coalesced)
+            except Exception:
+                traceback.print_exc()
+            with self._exposureCond:
+                self._exposureBusy = self._requestedExposure is not None
+
+    def _applyExposure(self, exp: float, coalesced: int):
+        with self._lock:
+            self._exposure = exp
+            restarted = False
+            if self.isRunning:
+                last = self.frameBuffer.latest()
+                applied = False
+                if self._inPlaceExposure:
+                    try:
+                        self._cam.exposure = exp
+                        applied = True
+                    except Exception:
+                        traceback.print_exc()  # Fall back to restarting the video.
+                if applied:
+                    self._exposureSeq = self.frameBuffer.latestSeq + 1  # The next frame may have started with the old exposure.
+                else:
+                    self.stop_live_video()
+                    self._exposureSeq = self.frameBuffer.latestSeq
+                    self.start_live_video()  # This is to update the exposure used.
+                    self._lastRestart = time.perf_counter()
+                    restarted = True
+                with self._costLock:
+                    superseded = self._pendingCost
+                    if superseded is not None:  # Changed again before a frame arrived, the cost of the earlier change is unknown.
+                        self.exposureChanges.append((superseded[2], superseded[3], superseded[4], None))
+                    self._pendingCost = (last.seq, last.timestamp, exp, coalesced, restarted) if last is not None else None
+            else:
+                self.exposureChanges.append((exp, coalesced, False, 0))
+        self.exposureChanged.emit(self._exposure)
+
+    def _updateExposureCost(self, seq: int):
+        """Called by the acquisition thread after each frame. Tracks the frame interval and, once the first frame with a
+        new exposure arrives, how many frames the exposure change cost."""
+        now = time.perf_counter()
+        with self._costLock:
+            pending = self._pendingCost
+            if pending is not None and seq > self._exposureSeq:
+                self._pendingCost = None
+        if pending is None:
+            if self._lastFrameTime is not None:
+                interval = now - self._lastFrameTime
+                self._frameInterval = interval if self._frameInterval is None else 0.9 * self._frameInterval + 0.1 * interval
+            self._lastFrameTime = now
+            return
+        self._lastFrameTime = now  # Intervals that span an exposure change aren't used for the average.
+        if seq <= self._exposureSeq:
+            return
+        lastSeq, lastTime, exp, coalesced, restarted = pending
+        if self._frameInterval:
+            cost = max(int(round((now - lastTime) / self._frameInterval)) - 1, 0)
+        else:
+            cost = seq - lastSeq - 1
+        self.exposureChanges.append((exp, coalesced, restarted, cost))
+        self.exposureChangeCost.emit(exp, cost)
+
+    def _callCamera(self, func: t_.Callable):
+        """Call `start_live_video` or `grab_image` of the camera with the current exposure and binning. If the camera
+        doesn't accept the binning then binning is turned off and it is called again."""
+        kwargs = dict(exposure_time=f"{self._exposure} ms")
+        if self._binning != 1:
+            try:
+                return func(vbin=self._binning, hbin=self._binning, **kwargs)
+            except Exception as e:
+                print(f"Camera binning of {self._binning} failed, binning is disabled: {e}")
+                self._supportedBinnings = {1}
+                self._binning = 1
+        return func(**kwargs)
+
+    @property
+    def binning(self) -> int:
+        """The binning requested from the camera."""
+        return self._binning
+
+    @property
+    def supportsBinning(self) -> bool:
+        return len(self._supportedBinnings) > 1
+
+    def setBinning(self, factor: int):
+        """Have the camera bin blocks of pixels, using the largest binning it supports that `factor` is a multiple of.
+        Live video is restarted to apply it. Does nothing if the camera doesn't support binning."""
+        if not self.supportsBinning:
+            return
+        factor = max(b for b in self._supportedBinnings if factor % b == 0)
+        with self._lock:
+            if factor == self._binning:
+                return
+            if self._sensorShape is None:
+                self._sensorShape = (self._cam.height, self._cam.width)  # The camera reports the binned size once binning is on.
+            self._binning = factor
+            if self.isRunning:
+                self.stop_live_video()
+                self.start_live_video()
+
+    def binningOf(self, frame: np.ndarray) -> int:
+        """The binning of a frame from this camera, found from its size. Frames taken before a binning change may still
+        be in use after it, so this should be used rather than `binning`."""
+        return max(int(round(self.width / frame.shape[1])), 1)
+
     def grab_image(self):
         try:
-            return self._cam.grab_image(exposure_time=f"{self._exposure} ms")
+            return self._callCamera(self._cam.grab_image)
         except Exception as e:  # If the exposure setting string is bad we can get an eror here
             print(e)
 
     def start_live_video(self):
-        self.isRunning = True
-        try:
-            self._cam.start_live_video(exposure_time=f"{self._exposure} ms")
-            self._frameGrabTimer.start()
-        except Exception as e: #If the exposure setting string is bad we can get an error here
-            print(e)
+        """Start live video. Returns immediately, the camera is started on the acquisition thread."""
+        with self._lock:
+            self.isRunning = True
+            self._stopAcquisition.clear()
+            self._acqThread = threading.Thread(target=self._acquire, name="CameraAcquisition", daemon=True)
+            self._acqThread.start()
 
     def stop_live_video(self):
-        self.isRunning = False
-        self._frameGrabTimer.stop()
-        self._cam.stop_live_video()
+        with self._lock:
+            self.isRunning = False
+            if self._acqThread is not None:
+                self._stopAcquisition.set()
+                self._acqThread.join()
+                self._acqThread = None
+            self._cam.stop_live_video()
 
     @property
     def width(self):
-        return self._cam.width
+        return self._cam.width if self._sensorShape is None else self._sensorShape[1]
 
     @property
     def height(self):
-        return self._cam.height
-
-    def _runAutoExpose(self):
-        try:
-            target = 250  # Assuming a max of 255
-            if self.isRunning:
-                frameReady = False # We have to get a fresh frame to make sure it's actually at the correct exposure.
-                while not frameReady:
-                    frameReady = self._cam.wait_for_frame(timeout='0 ms')
-                arr = self._cam.latest_frame(copy=True)
-                self.frameReady.emit(arr)
-            else:
-                arr = self.grab_image()
-            if arr is None:
-                return  # This can sometime happen when the video is stopped.
-            m = np.percentile(arr, 99.7)
-            if m >= 255:
-                newExp = self._exposure * 0.8
-            elif abs(target - m) > 5:  # Don't do anything if we're within a decent window.
-                newExp = self._exposure * target / m
-                if newExp > 1000:
-                    newExp = 1000  # Don't exceed one seconds`
-            else:
-                return
-            self.setExposure(newExp)
-        finally:
-            self._aeTimer.start()
+        return self._cam.height if self._sensorShape is None else self._sensorShape[0]
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import threading
+import time
+import typing as t_
+
+import numpy as np
+
+
+class Frame(t_.NamedTuple):
+    """A frame stored in a `FrameRingBuffer`.
+
+    Attributes:
+        seq: The sequence number of the frame. The first frame written to the buffer is 1.
+        timestamp: The `time.perf_counter` time that the frame was written to the buffer.
+        data: A view into the buffer's slot. This will be overwritten once the buffer wraps around.
+    """
+    seq: int
+    timestamp: float
+    data: np.ndarray
+
+
+class FrameRingBuffer:
+    """
+    A fixed number of preallocated slots that frames are copied into as they are acquired. Readers get views into the
+    slots rather than copies. Each named consumer has its own read position so that the number of frames it missed,
+    either because it only asked for the latest frame or because it fell so far behind that the frames were overwritten,
+    can be counted.
+
+    Args:
+        numSlots: The number of frames that can be held before the oldest is overwritten.
+    """
+    def __init__(self, numSlots: int = 8):
+        self._numSlots = numSlots
+        self._slots: t_.Optional[np.ndarray] = None
+        self._timestamps = np.zeros(numSlots, dtype=float)
+        self._seq = 0  # The sequence number of the most recently written frame.
+        self._validFrom = 1  # Frames before this were written before the slots were last reallocated.
+        self._lock = threading.Lock()
+        self._newFrame = threading.Condition(self._lock)
+        self._cursors: t_.Dict[str, int] = {}  # The last sequence number read by each consumer.
+        self.overruns: t_.Dict[str, int] = {}  # The number of frames each consumer missed.
+
+    @property
+    def numSlots(self) -> int:
+        return self._numSlots
+
+    @property
+    def latestSeq(self) -> int:
+        return self._seq
+
+    def write(self, arr: np.ndarray) -> int:
+        """Copy a new frame into the next slot. The slots are reallocated if the frame shape or dtype changes.
+
+        Returns:
+            The sequence number of the new frame.
+        """
+        if self._slots is None or self._slots.shape[1:] != arr.shape or self._slots.dtype != arr.dtype:
+            slots = np.empty((self._numSlots,) + arr.shape, dtype=arr.dtype)
+            with self._lock:
+                self._slots = slots
+                self._validFrom = self._seq + 1
+        seq = self._seq + 1
+        idx = seq % self._numSlots
+        np.copyto(self._slots[idx], arr)
+        with self._lock:
+            self._timestamps[idx] = time.perf_counter()
+            self._seq = seq
+            self._newFrame.notify_all()
+        return seq
+
+    def waitForFrame(self, afterSeq: int, timeout: float = None) -> t_.Optional[Frame]:
+        """Block until a frame newer than `afterSeq` has been written and return the latest frame. Returns `None` if
+        `timeout` seconds pass first."""
+        with self._lock:
+            if not self._newFrame.wait_for(lambda: self._seq > afterSeq, timeout):
+                return None
+            return self._get(self._seq)
+
+    def isValid(self, frame: Frame) -> bool:
+        """Returns False if the slot that `frame` points to has been overwritten since it was read."""
+        return frame.seq > self._seq - self._numSlots and frame.seq >= self._validFrom
+
+    def _get(self, seq: int) -> Frame:
+        idx = seq % self._numSlots
+        return Frame(seq, self._timestamps[idx], self._slots[idx])
+
+    def latest(self) -> t_.Optional[Frame]:
+        """Returns the most recent frame without affecting any consumer's read position."""
+        with self._lock:
+            if self._seq == 0:
+                return None
+            return self._get(self._seq)
+
+    def register(self, consumer: str):
+        """Register a consumer. It will start reading from the next frame written."""
+        with self._lock:
+            self._cursors[consumer] = self._seq
+            self.overruns[consumer] = 0
+
+    def readLatest(self, consumer: str) -> t_.Optional[Frame]:
+        """Return the most recent frame if `consumer` hasn't already read it, otherwise `None`. Any frames between the last
+        one it read and the latest are counted as overruns."""
+        with self._lock:
+            last = self._cursors[consumer]
+            if self._seq <= last:
+                return None
+            self.overruns[consumer] += self._seq - last - 1
+            self._cursors[consumer] = self._seq
+            return self._get(self._seq)
+
+    def readNext(self, consumer: str) -> t_.Optional[Frame]:
+        """Return the frame after the last one `consumer` read, otherwise `None` if it is caught up. If that frame has
+        already been overwritten then the oldest frame still available is returned and the frames that were lost are
+        counted as overruns."""
+        with self._lock:
+            last = self._cursors[consumer]
+            if self._seq <= last:
+                return None
+            oldest = max(self._seq - self._numSlots + 1, self._validFrom)
+            nxt = last + 1
+            if nxt < oldest:
+                self.overruns[consumer] += oldest - nxt
+                nxt = oldest
+            self._cursors[consumer] = nxt
+            return self._get(nxt)
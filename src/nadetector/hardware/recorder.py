@@ -0,0 +1,191 @@
+from __future__ import annotations
+import csv
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import typing as t_
+
+import numpy as np
+
+if t_.TYPE_CHECKING:
+    from nadetector.hardware.cameraManager import CameraManager
+
+
+def _truncateNpy(path: str, numFrames: int):
+    """Shrink the first dimension of a `.npy` file in place. The header is rewritten with the same length so the data
+    doesn't move, then the file is truncated."""
+    with open(path, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            lenSize = 2
+        elif version == (2, 0):
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            lenSize = 4
+        else:
+            raise ValueError(f"Unsupported .npy version {version}")
+        offset = f.tell()
+        newShape = (numFrames,) + tuple(shape[1:])
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(dtype), newShape)
+        headerLen = offset - 8 - lenSize  # The magic string and version take 8 bytes.
+        f.seek(8 + lenSize)
+        f.write(header.ljust(headerLen - 1).encode('latin1') + b'\n')
+        f.truncate(offset + int(np.prod(newShape)) * dtype.itemsize)
+
+
+class Recorder:
+    """
+    Records every frame acquired by a `CameraManager`, along with the fit results, to a directory on disk.
+
+    The recorder is a consumer of the camera's `FrameRingBuffer`, read by its own writer thread, so recording adds no
+    work to the GUI thread, the acquisition thread or the fit worker. Frames are copied straight from the ring buffer
+    into memory-mapped `.npy` files of `chunkFrames` frames each, which the OS writes out in the background. Since the
+    ring buffer is the queue between the camera and the writer, the writer can fall at most `numSlots` frames behind;
+    frames that are overwritten before they are written are counted in `droppedFrames` rather than slowing the camera
+    down.
+
+    A recording directory contains:
+        chunk_0000.npy, ...: Stacks of frames. Each is a normal `.npy` file that can be opened with `np.load(mmap_mode='r')`.
+        frames.csv: The chunk, index within the chunk, sequence number, `time.perf_counter` timestamp and exposure of each frame.
+        fits.csv: The timestamp, the sequence number of the frame it was fit from, x, y, r and confidence of each fit
+            result. The sequence number is 0 if the frame isn't known.
+        metadata.json: The start time, frame counts, and a list of the chunks with their shape, dtype and camera
+            binning. Rewritten after each chunk.
+
+    Args:
+        camera: The camera manager to record from.
+        chunkFrames: The number of frames in each chunk file.
+    """
+    consumer = 'recorder'  # The name the recorder reads the ring buffer as.
+
+    def __init__(self, camera: CameraManager, chunkFrames: int = 256):
+        self._camera = camera
+        self.chunkFrames = chunkFrames
+        self.directory: t_.Optional[str] = None
+        self._thread: threading.Thread = None
+        self._stop = threading.Event()
+        self._fits: queue.SimpleQueue = queue.SimpleQueue()
+        self._lastSeq = 0
+        self.recordedFrames = 0
+        self.tornFrames = 0  # Frames that were overwritten in the ring buffer while being copied.
+        self.maxBacklog = 0  # The most frames the writer has fallen behind by.
+
+    @property
+    def droppedFrames(self) -> int:
+        """The number of frames acquired while recording that weren't recorded."""
+        return self._camera.frameBuffer.overruns.get(self.consumer, 0) + self.tornFrames
+
+    @property
+    def backlog(self) -> int:
+        """The number of frames waiting to be written."""
+        return max(self._camera.frameBuffer.latestSeq - self._lastSeq, 0) if self.isRecording() else 0
+
+    def isRecording(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, directory: str):
+        """Start recording into `directory`, which is created if it doesn't exist."""
+        if self.isRecording():
+            raise RuntimeError("Already recording.")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.recordedFrames = 0
+        self.tornFrames = 0
+        self.maxBacklog = 0
+        self._fits = queue.SimpleQueue()
+        buf = self._camera.frameBuffer
+        buf.register(self.consumer)
+        self._lastSeq = buf.latestSeq
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="Recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop recording. Blocks until the files are closed."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def recordFit(self, x: float, y: float, r: float, confidence: float = float('nan'), seq: int = 0):
+        """Add a fit result to the recording, with the sequence number `seq` of the frame it was fit from so that it
+        can be matched with the frame in frames.csv."""
+        if self.isRecording():
+            self._fits.put((time.perf_counter(), seq, x, y, r, confidence))
+
+    def _run(self):
+        buf = self._camera.frameBuffer
+        metadata = dict(
+            startTime=datetime.datetime.now().isoformat(),
+            perfCounterAtStart=time.perf_counter(),  # Relates the frame timestamps to `startTime`.
+            chunks=[],
+        )
+        chunk: t_.Optional[np.ndarray] = None
+        chunkPath = None
+        index = 0
+        binning = 1  # The camera binning of the frames in the current chunk.
+        exposure = self._camera.getExposure()
+
+        def closeChunk():
+            nonlocal chunk
+            if chunk is None:
+                return
+            chunk.flush()
+            shape, dtype = chunk.shape[1:], chunk.dtype
+            chunk = None  # Release the memory map before resizing the file.
+            if index == 0:
+                os.remove(chunkPath)
+                return
+            if index < self.chunkFrames:
+                _truncateNpy(chunkPath, index)
+            metadata['chunks'].append(dict(file=os.path.basename(chunkPath), frames=index, shape=list(shape), dtype=str(dtype), binning=binning))
+            writeMetadata()
+
+        def writeMetadata():
+            metadata.update(recordedFrames=self.recordedFrames, droppedFrames=self.droppedFrames)
+            with open(os.path.join(self.directory, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f, indent=2)
+
+        with open(os.path.join(self.directory, 'frames.csv'), 'w', newline='') as framesFile, \
+                open(os.path.join(self.directory, 'fits.csv'), 'w', newline='') as fitsFile:
+            framesLog = csv.writer(framesFile)
+            framesLog.writerow(['chunk', 'index', 'seq', 'timestamp', 'exposure'])
+            fitsLog = csv.writer(fitsFile)
+            fitsLog.writerow(['timestamp', 'seq', 'x', 'y', 'r', 'confidence'])
+            try:
+                while not self._stop.is_set():
+                    while not self._fits.empty():
+                        fitsLog.writerow(self._fits.get())
+                    frame = buf.readNext(self.consumer)
+                    if frame is None:
+                        buf.waitForFrame(self._lastSeq, timeout=0.1)
+                        continue
+                    self.maxBacklog = max(self.maxBacklog, buf.latestSeq - frame.seq)
+                    self._lastSeq = frame.seq
+                    data = frame.data
+                    if chunk is None or index == self.chunkFrames or chunk.shape[1:] != data.shape or chunk.dtype != data.dtype:
+                        closeChunk()
+                        chunkPath = os.path.join(self.directory, f"chunk_{len(metadata['chunks']):04d}.npy")
+                        chunk = np.lib.format.open_memmap(chunkPath, mode='w+', dtype=data.dtype, shape=(self.chunkFrames,) + data.shape)
+                        binning = self._camera.binningOf(data)
+                        index = 0
+                    chunk[index] = data
+                    if not buf.isValid(frame):  # Overwritten while we were copying it. The slot in the chunk is reused.
+                        self.tornFrames += 1
+                        continue
+                    if frame.seq > self._camera.exposureSeq:
+                        exposure = self._camera.getExposure()
+                    framesLog.writerow([len(metadata['chunks']), index, frame.seq, frame.timestamp, exposure])
+                    index += 1
+                    self.recordedFrames += 1
+                while not self._fits.empty():
+                    fitsLog.writerow(self._fits.get())
+            except Exception:
+                traceback.print_exc()
+            finally:
+                closeChunk()
+                writeMetadata()
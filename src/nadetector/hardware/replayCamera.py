@@ -0,0 +1,165 @@
+import json
+import os
+import re
+import threading
+import time
+import typing as t_
+
+import numpy as np
+
+
+def _parseSeconds(timeout) -> t_.Optional[float]:
+    """Convert a timeout in the form instrumental accepts, such as '100 ms', to seconds. Numbers are taken as seconds."""
+    if timeout is None:
+        return None
+    if isinstance(timeout, (int, float)):
+        return float(timeout)
+    m = re.fullmatch(r"\s*([0-9.eE+-]+)\s*(ms|s|us)?\s*", str(timeout))
+    if m is None:
+        raise ValueError(f"Could not parse timeout: {timeout}")
+    value, unit = float(m.group(1)), m.group(2) or 's'
+    return value * {'s': 1, 'ms': 1e-3, 'us': 1e-6}[unit]
+
+
+def loadStacks(path: str) -> t_.List[np.ndarray]:
+    """
+    Open the frames saved at `path` as read-only memory maps, without loading them.
+
+    Args:
+        path: A directory saved by `Recorder` (the chunks listed in its `metadata.json`), any other directory of `.npy`
+            files, or a single `.npy` file. Each `.npy` file can hold one 2D frame or a 3D stack of frames.
+
+    Returns:
+        A list of 3D stacks of frames, in order.
+    """
+    if os.path.isdir(path):
+        metaPath = os.path.join(path, 'metadata.json')
+        if os.path.exists(metaPath):
+            with open(metaPath) as f:
+                files = [c['file'] for c in json.load(f)['chunks']]
+        else:
+            files = sorted(f for f in os.listdir(path) if f.lower().endswith('.npy'))
+        files = [os.path.join(path, f) for f in files]
+    else:
+        files = [path]
+    stacks = []
+    for f in files:
+        arr = np.load(f, mmap_mode='r')
+        stacks.append(arr[None] if arr.ndim == 2 else arr)
+    if not stacks or sum(len(s) for s in stacks) == 0:
+        raise ValueError(f"No frames found at {path}")
+    return stacks
+
+
+class ReplayCamera:
+    def __init__(self, path: str, fps: t_.Optional[float] = None, loop: bool = True):
+        """
+        Simulates a Instrumental-lib camera object by playing back frames saved on disk, such as a recording made by
+        `Recorder`. The frames are memory-mapped so long recordings don't need to fit in memory. Playback is the same
+        every time, making it useful for measuring the throughput of the whole pipeline without hardware.
+
+        Args:
+            path: The frames to play, see `loadStacks`.
+            fps: The rate to deliver frames at during live video. If `None` then a new frame is available every time
+                one is waited for, so the rest of the pipeline sets the rate.
+            loop: If true then playback starts over after the last frame, otherwise live video stops producing frames.
+        """
+        self._stacks = loadStacks(path)
+        self._index = [(i, j) for i, stack in enumerate(self._stacks) for j in range(len(stack))]  # The stack and position of each frame.
+        self.fps = fps
+        self.loop = loop
+        self._pos = -1  # The index of the current frame.
+        self._started = False
+        self._nextTime = 0.  # When the next frame is due, in `time.perf_counter` time.
+        self._lock = threading.Lock()
+        self.framesServed = 0  # The number of frames delivered during live video.
+        self.loops = 0  # The number of times playback has wrapped around to the first frame.
+
+    @property
+    def numFrames(self) -> int:
+        return len(self._index)
+
+    @property
+    def finished(self) -> bool:
+        """True if playback isn't looped and the last frame has been delivered."""
+        return not self.loop and self._pos >= self.numFrames - 1
+
+    def rewind(self):
+        """Start playback from the first frame again."""
+        with self._lock:
+            self._pos = -1
+            self.loops = 0
+
+    def _frame(self, pos: int) -> np.ndarray:
+        i, j = self._index[pos]
+        return self._stacks[i][j]
+
+    def _advance(self) -> bool:
+        if self._pos + 1 >= self.numFrames:
+            if not self.loop:
+                return False
+            self._pos = -1
+            self.loops += 1
+        self._pos += 1
+        return True
+
+    def grab_image(self, **kwargs):
+        with self._lock:
+            if not self._advance():
+                self._pos = self.numFrames - 1  # Keep returning the last frame.
+            return np.array(self._frame(self._pos))
+
+    def start_live_video(self, **kwargs):
+        self._started = True
+        self._nextTime = time.perf_counter()  # Exposure changes restart the video, playback carries on from the same frame.
+
+    def stop_live_video(self):
+        self._started = False
+
+    def wait_for_frame(self, timeout=None, **kwargs) -> bool:
+        """Wait until the next frame is due. Returns False if it isn't due within `timeout` or playback has finished."""
+        if not self._started or self.finished:
+            if timeout is not None:
+                time.sleep(_parseSeconds(timeout))  # Don't let the caller spin.
+            return False
+        if self.fps is not None:
+            wait = self._nextTime - time.perf_counter()
+            timeout = _parseSeconds(timeout)
+            if timeout is not None and wait > timeout:
+                time.sleep(timeout)
+                return False
+            if wait > 0:
+                time.sleep(wait)
+            # Schedule from the previous deadline so the rate doesn't drift, unless we have fallen behind.
+            self._nextTime = max(self._nextTime + 1 / self.fps, time.perf_counter())
+        with self._lock:
+            if not self._advance():
+                return False
+            self.framesServed += 1
+        return True
+
+    def latest_frame(self, copy: bool = True, **kwargs):
+        with self._lock:
+            frame = self._frame(max(self._pos, 0))
+        return np.array(frame) if copy else frame
+
+    def set_auto_exposure(self, enable=True):
+        pass
+
+    @property
+    def auto_exposure(self) -> bool:
+        return False
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    @property
+    def width(self):
+        return self._frame(0).shape[1]
+
+    @property
+    def height(self):
+        return self._frame(0).shape[0]
@@ -1,38 +1,98 @@
 import random
+import time
 
 import numpy as np
-import skimage
 import typing as t_
 
 
 class TestCamera:
-    def __init__(self, shape: t_.Tuple[int, int], noiseLevel: float, ring: bool = False):
+    def __init__(self, shape: t_.Tuple[int, int], noiseLevel: float, ring: bool = False, fast: bool = False,
+                 seed: t_.Optional[int] = None, dtype=np.uint8, fps: t_.Optional[float] = None, vignetting: float = 0,
+                 motion: float = 0, noiseBankSize: int = 8):
         """
         Simulates a Insturmental-lib camera object.
 
+        By default every frame has a circle at a new random position drawn with hard edges. In `fast` mode the noise is
+        taken from a bank of precomputed noise frames at a random offset, the circle is drawn with anti-aliased edges
+        and only the pixels around it are touched, so frames can be produced at hundreds of fps. Fast mode is
+        reproducible for a given `seed`.
+
         Args:
             shape: The shape of the 2d camera image array.
-            noiseLevel: The noise present in the image.
+            noiseLevel: The noise present in the image, in 8-bit units.
             ring: If true then a donut will be drawn rather than a circle.
+            fast: Use the fast generator. The following arguments only apply in fast mode.
+            seed: Seeds the random number generator.
+            dtype: `np.uint8` or `np.uint16`. The circle is at half of full scale.
+            fps: Live video produces frames at this rate. If `None` then a frame is always ready.
+            vignetting: The fraction the brightness of the circle falls by at the corners of the image.
+            motion: The standard deviation in pixels of the random step the circle's center takes each frame. If 0 the
+                circle doesn't move.
+            noiseBankSize: The number of precomputed noise frames.
         """
         self._started = False
         self._noiseLevel = noiseLevel
         self._arrayShape = shape
         self._ring = ring
+        self._fast = fast
+        self.fps = fps
+        self._nextTime = 0.  # When the next frame is due, in `time.perf_counter` time.
+        self.groundTruth: t_.Optional[t_.Tuple[float, float, float]] = None  # The x, y, r of the circle in the last frame generated.
+        if fast:
+            self._initFast(seed, np.dtype(dtype), vignetting, motion, noiseBankSize)
+
+    def _initFast(self, seed: t_.Optional[int], dtype: np.dtype, vignetting: float, motion: float, noiseBankSize: int):
+        h, w = self._arrayShape
+        self._rng = np.random.default_rng(seed)
+        self._dtype = dtype
+        fullScale = np.iinfo(dtype).max
+        self._level = 127 * fullScale / 255
+        self._motion = motion
+        self._noisePad = 16  # Each frame's noise starts at a random offset of up to this many pixels into a bank frame.
+        self._noiseBank = np.empty((noiseBankSize, h + self._noisePad, w + self._noisePad), dtype=dtype)
+        for noise in self._noiseBank:  # Clipped so that adding the circle can't overflow.
+            noise[:] = np.minimum(self._rng.random(noise.shape, dtype=np.float32) * (self._noiseLevel * fullScale / 255), fullScale - self._level)
+        self._out = np.empty(self._arrayShape, dtype=dtype)
+        if vignetting:
+            yy, xx = np.ogrid[:h, :w]
+            rho2 = ((yy - (h - 1) / 2) ** 2 + (xx - (w - 1) / 2) ** 2) / (((h - 1) / 2) ** 2 + ((w - 1) / 2) ** 2)
+            self._gain = (1 - vignetting * rho2).astype(np.float32)
+        else:
+            self._gain = None
+        self._lower = np.array([w // 4, h // 4], dtype=float)  # The circle's center stays in the same range as the default mode.
+        self._upper = np.array([w // 2, h // 2], dtype=float)
+        self._center = self._rng.uniform(self._lower, self._upper)
+        self._radius = float(self._rng.uniform(50, 200))
 
     def grab_image(self, **kwargs):
+        if self._fast:
+            return self._getFrameFast().copy()
         return self._getFrame(self._ring)
 
+    def generate(self) -> t_.Tuple[np.ndarray, t_.Tuple[float, float, float]]:
+        """Returns a new frame and the x, y, r of the circle in it."""
+        im = self.grab_image()
+        return im, self.groundTruth
+
     def start_live_video(self, **kwargs):
         self._started = True
+        self._nextTime = time.perf_counter()
 
     def stop_live_video(self):
         self._started = False
 
     def wait_for_frame(self, **kwargs):
+        if self._started and self.fps is not None:
+            wait = self._nextTime - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            self._nextTime = max(self._nextTime + 1 / self.fps, time.perf_counter())
         return self._started
 
-    def latest_frame(self, **kwargs):
+    def latest_frame(self, copy: bool = True, **kwargs):
+        if self._fast:
+            im = self._getFrameFast()
+            return im.copy() if copy else im  # Without a copy the frame is overwritten by the next one.
         return self._getFrame(self._ring)
 
     def set_auto_exposure(self, enable=True):
@@ -51,9 +111,11 @@ class TestCamera:
         Returns: 2D image array.
 
         """
+        import skimage.draw
         y = random.randrange(self._arrayShape[0] // 4, self._arrayShape[0] // 2)
         x = random.randrange(self._arrayShape[1] // 4, self._arrayShape[1] // 2)
         r = random.randrange(50, 200)
+        self.groundTruth = (x, y, r)
 
         coords = skimage.draw.circle(y, x, r, shape=self._arrayShape)
         im = np.zeros(self._arrayShape, dtype=np.uint8)
@@ -67,6 +129,46 @@ class TestCamera:
 
         return im
 
+    def _getFrameFast(self) -> np.ndarray:
+        """
+        Generate the next frame in fast mode into a reused buffer.
+
+        Returns: 2D image array.
+
+        """
+        h, w = self._arrayShape
+        rng = self._rng
+        if self._motion:
+            center = self._center + rng.normal(0, self._motion, 2)
+            center = np.where(center < self._lower, 2 * self._lower - center, center)  # Reflect off the edges of the range.
+            center = np.where(center > self._upper, 2 * self._upper - center, center)
+            self._center = np.clip(center, self._lower, self._upper)
+        x, y = self._center
+        r = self._radius
+        self.groundTruth = (float(x), float(y), r)
+
+        dy, dx = rng.integers(self._noisePad + 1, size=2)
+        out = self._out
+        np.copyto(out, self._noiseBank[rng.integers(len(self._noiseBank)), dy:dy + h, dx:dx + w])
+
+        top, bottom = max(int(y - r) - 1, 0), min(int(y + r) + 2, h)
+        left, right = max(int(x - r) - 1, 0), min(int(x + r) + 2, w)
+        if top >= bottom or left >= right:
+            return out
+        yy = np.arange(top, bottom, dtype=np.float32)[:, None] - np.float32(y)
+        xx = np.arange(left, right, dtype=np.float32)[None, :] - np.float32(x)
+        dist = np.sqrt(yy ** 2 + xx ** 2)
+        # The fraction of each pixel covered by the circle, approximated from the distance of the pixel's center to the edge.
+        signal = np.clip(r + 0.5 - dist, 0, 1)
+        if self._ring:
+            signal -= np.clip(r * 0.5 + 0.5 - dist, 0, 1)
+        signal *= self._level
+        if self._gain is not None:
+            signal *= self._gain[top:bottom, left:right]
+        signal += 0.5  # Round rather than truncate.
+        out[top:bottom, left:right] += signal.astype(self._dtype)
+        return out
+
     def __enter__(self):
         pass
 
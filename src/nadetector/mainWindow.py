@@ -1,8 +1,11 @@
 from __future__ import annotations
-from PyQt5.QtCore import QPoint
-from PyQt5.QtWidgets import QMainWindow, QPushButton, QWidget, QGridLayout, QHBoxLayout, QLabel
+import datetime
+import os
 
-from nadetector.hardware import CameraManager
+from PyQt5.QtCore import QPoint, QTimer
+from PyQt5.QtWidgets import QMainWindow, QPushButton, QWidget, QGridLayout, QHBoxLayout, QLabel, QFileDialog
+
+from nadetector.hardware import CameraManager, Recorder
 from nadetector.widgets import AdvancedSettingsDialog
 from nadetector.widgets.fittingWidget import FittingWidget
 import typing
@@ -23,9 +26,14 @@ class Window(QMainWindow):
         self.videoButton = QPushButton("Start Video", self)
         self.btn_grab = QPushButton("Grab Frame", self)
         self.advancedButton = QPushButton("Advanced...", self)
+        self.recordButton = QPushButton("Record...", self)
+        self.recordLabel = QLabel(self)
+        self.recorder = Recorder(camManager)
 
         def setCoordLabel(x, y):
-            v = self.cameraView.rawArray[y, x]
+            arr = self.cameraView.rawArray
+            b = self.cameraView.camera.binningOf(arr)  # The coordinates are in unbinned pixels.
+            v = arr[min(y // b, arr.shape[0] - 1), min(x // b, arr.shape[1] - 1)]
             self.coordsLabel.setText(f"x={x}, y={y}, value={v}")
         self.cameraView.mouseMoved.connect(setCoordLabel)
 
@@ -55,6 +63,60 @@ class Window(QMainWindow):
 
         self.advancedButton.released.connect(showAdvanced)
 
+        def recordFit(x, y, r):
+            self.recorder.recordFit(x, y, r, camview.fitConfidence, camview.fitSeq)
+        camview.fitCompleted.connect(recordFit)
+
+        def updateRecordLabel():
+            rec = self.recorder
+            self.recordLabel.setText(f"REC {rec.recordedFrames} frames, {rec.droppedFrames} dropped, backlog {rec.backlog} (max {rec.maxBacklog})")
+        self._recordTimer = QTimer(self)
+        self._recordTimer.setInterval(500)
+        self._recordTimer.timeout.connect(updateRecordLabel)
+
+        def startStopRecording():
+            if self.recorder.isRecording():
+                self.recorder.stop()
+                self._recordTimer.stop()
+                updateRecordLabel()
+                self.recordButton.setText("Record...")
+            else:
+                parent = QFileDialog.getExistingDirectory(self, "Save Recording In")
+                if not parent:
+                    return
+                directory = os.path.join(parent, datetime.datetime.now().strftime("recording_%Y%m%d_%H%M%S"))
+                try:
+                    self.recorder.start(directory)
+                except Exception as e:
+                    print(e)
+                    return
+                self._recordTimer.start()
+                self.recordButton.setText("Stop Recording")
+        self.recordButton.clicked.connect(startStopRecording)
+
+        self.statsLabel = QLabel(self)
+        self.statusBar().addPermanentWidget(self.statsLabel)
+        def updateStats():
+            view = self.cameraView
+            worker = view.fitWorker
+            notDisplayed = camManager.frameBuffer.overruns.get('display', 0)
+            text = (f"Frame #{view.frameSeq} | displayed {view.displayedFrames}, skipped by display {notDisplayed} | "
+                    f"fit {worker.fittedFrames}, dropped by fitter {worker.droppedFrames}, unchanged {view.skippedFrames}")
+            age = view.fitAge()
+            if age is not None:
+                text += f" | fit from #{view.fitSeq}, {age * 1000:.0f} ms old"
+            costs = [cost for _, _, _, cost in list(camManager.exposureChanges) if cost is not None]  # Copied since the acquisition thread appends to it.
+            if costs:
+                text += f" | exposure changes cost {sum(costs) / len(costs):.1f} frames on average"
+            if view.isConsensus() and view.consensus.scores:
+                text += " | agreement " + ", ".join(f"{m.name} {s:.2f}" for m, s in view.consensus.scores.items())
+            self.statsLabel.setText(text)
+        self._statsTimer = QTimer(self)
+        self._statsTimer.setInterval(250)
+        self._statsTimer.timeout.connect(updateStats)
+        self._statsTimer.start()
+        camManager.exposureChangeCost.connect(self._showExposureChangeCost)  # A bound method so that Qt delivers it on the GUI thread.
+
         main_area = QWidget(self)
         main_area.setLayout(QGridLayout())
         button_area = QWidget()
@@ -71,13 +133,18 @@ class Window(QMainWindow):
         l = button_area.layout()
         l.addStretch()  # Makes the buttons move over rather than spread out.
         l.addWidget(self.coordsLabel)
+        l.addWidget(self.recordLabel)
         l.addWidget(self.videoButton)
         l.addWidget(self.btn_grab)
+        l.addWidget(self.recordButton)
         l.addWidget(self.advancedButton)
 
         # Attach some child widgets directly
         self.setCentralWidget(main_area)
 
+    def _showExposureChangeCost(self, exposure: float, cost: int):
+        self.statusBar().showMessage(f"Exposure of {exposure:g} ms applied, {cost} frames lost", 5000)
+
     def getSettings(self) -> dict:
         return self.fittingWidget.getSetting()
 
@@ -0,0 +1,175 @@
+"""
+Li and Otsu thresholds calculated from an image histogram. The pixels are only read once, to build the histogram, after
+which each threshold costs O(bins) rather than O(pixels). `Thresholder` additionally remembers the previous frame's
+histogram and threshold so that a stream of similar frames can reuse or warm-start the calculation.
+"""
+from __future__ import annotations
+import typing as t_
+
+import numpy as np
+
+
+def imageHistogram(im: np.ndarray, stride: int = 1) -> t_.Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the pixels at each intensity. Unsigned integer images get one bin per value (images wider than 16 bits are
+    shifted down to 16 bits). Other images are binned into 1024 bins spanning their range.
+
+    Args:
+        im: The image.
+        stride: Only every `stride`th pixel along each axis is counted.
+
+    Returns:
+        The counts and the intensity at the center of each bin.
+    """
+    if stride > 1:
+        im = im[::stride, ::stride]
+    values = im.ravel()
+    if im.dtype.kind == 'u':
+        shift = max(im.dtype.itemsize * 8 - 16, 0)
+        if shift:
+            values = values >> shift
+        counts = np.bincount(values)
+        centers = np.arange(len(counts), dtype=float)
+        if shift:
+            centers = centers * 2 ** shift + (2 ** shift - 1) / 2
+    else:
+        counts, edges = np.histogram(values, bins=1024)
+        centers = (edges[:-1] + edges[1:]) / 2
+    return counts, centers
+
+
+def _trim(counts: np.ndarray, centers: np.ndarray) -> t_.Tuple[np.ndarray, np.ndarray]:
+    """Remove the empty bins below the darkest pixel and above the brightest pixel."""
+    nonzero = np.flatnonzero(counts)
+    return counts[nonzero[0]:nonzero[-1] + 1], centers[nonzero[0]:nonzero[-1] + 1]
+
+
+def thresholdOtsuHist(counts: np.ndarray, centers: np.ndarray) -> float:
+    """Otsu's threshold from a histogram. Gives the same result as `skimage.filters.threshold_otsu` for integer images.
+
+    Args:
+        counts: The number of pixels in each bin.
+        centers: The intensity at the center of each bin.
+
+    Returns:
+        The threshold. Pixels brighter than this are foreground.
+    """
+    counts, centers = _trim(counts, centers)
+    if len(counts) == 1:
+        return float(centers[0])
+    weight1 = np.cumsum(counts, dtype=float)
+    weight2 = np.cumsum(counts[::-1], dtype=float)[::-1]
+    moment = counts * centers
+    mean1 = np.cumsum(moment) / weight1
+    mean2 = (np.cumsum(moment[::-1]) / weight2[::-1])[::-1]
+    variance12 = weight1[:-1] * weight2[1:] * (mean1[:-1] - mean2[1:]) ** 2
+    return float(centers[np.argmax(variance12)])
+
+
+def thresholdLiHist(counts: np.ndarray, centers: np.ndarray, initialGuess: float = None, tolerance: float = None) -> float:
+    """Li's minimum cross entropy threshold from a histogram. Follows `skimage.filters.threshold_li`, but the class
+    means at each iteration are looked up from cumulative sums of the histogram rather than recalculated.
+
+    Args:
+        counts: The number of pixels in each bin.
+        centers: The intensity at the center of each bin.
+        initialGuess: The threshold to start iterating from, such as the previous frame's threshold. The mean intensity
+            is used if this isn't provided or isn't within the range of the histogram.
+        tolerance: Iteration stops when the threshold changes by less than this. Defaults to half of the bin width.
+
+    Returns:
+        The threshold. Pixels brighter than this are foreground.
+    """
+    counts, centers = _trim(counts, centers)
+    if len(counts) == 1:
+        return float(centers[0])
+    lowest = centers[0]
+    values = centers - lowest  # Li's method uses logarithms so the intensities are shifted to start at 0, as in skimage.
+    cumCounts = np.cumsum(counts, dtype=float)
+    cumMoment = np.cumsum(counts * values)
+    totalCounts, totalMoment = cumCounts[-1], cumMoment[-1]
+    if tolerance is None:
+        tolerance = np.min(np.diff(centers)) / 2
+    if initialGuess is not None and 0 < initialGuess - lowest < values[-1]:
+        tNext = initialGuess - lowest
+    else:
+        tNext = totalMoment / totalCounts
+    tCurr = -2 * tolerance
+    while abs(tNext - tCurr) > tolerance:
+        tCurr = tNext
+        k = np.searchsorted(values, tCurr, side='right') - 1  # The last background bin.
+        meanBack = cumMoment[k] / cumCounts[k]
+        meanFore = (totalMoment - cumMoment[k]) / (totalCounts - cumCounts[k])
+        if meanBack == 0:
+            break
+        tNext = (meanBack - meanFore) / (np.log(meanBack) - np.log(meanFore))
+    return float(tNext + lowest)
+
+
+def thresholdLi(im: np.ndarray, stride: int = 1) -> float:
+    """Li's threshold of an image, calculated from its histogram."""
+    return thresholdLiHist(*imageHistogram(im, stride))
+
+
+def thresholdOtsu(im: np.ndarray, stride: int = 1) -> float:
+    """Otsu's threshold of an image, calculated from its histogram."""
+    return thresholdOtsuHist(*imageHistogram(im, stride))
+
+
+class Thresholder:
+    """
+    Calculates thresholds for a stream of frames. One histogram is built per frame, optionally from a subsample of the
+    pixels. If the histogram has barely changed since the threshold was last calculated then that threshold is reused,
+    otherwise Li's method is started from the previous threshold so it converges in a few iterations. Not thread safe,
+    each stream of frames should have its own instance.
+
+    Args:
+        stride: Only every `stride`th pixel along each axis is used to build the histogram.
+        changeTolerance: The previous threshold is reused if no point of the cumulative histogram has moved by more than
+            this fraction of the pixels. Unlike comparing bins directly this isn't affected by noise moving pixels
+            between neighbouring bins.
+    """
+    def __init__(self, stride: int = 2, changeTolerance: float = 0.005):
+        self.stride = stride
+        self.changeTolerance = changeTolerance
+        self._cache: t_.Dict[str, t_.Tuple[np.ndarray, float]] = {}  # The normalized cumulative histogram and threshold for each method.
+        self.computed = 0  # The number of thresholds calculated.
+        self.reused = 0  # The number of times a previous threshold was reused.
+        self.threshold: t_.Optional[float] = None  # The threshold most recently returned.
+
+    def reset(self):
+        """Forget the previous frames."""
+        self._cache.clear()
+
+    def li(self, im: np.ndarray) -> float:
+        """Li's threshold for the next frame."""
+        return self._threshold(im, 'li')
+
+    def otsu(self, im: np.ndarray) -> float:
+        """Otsu's threshold for the next frame."""
+        return self._threshold(im, 'otsu')
+
+    def _threshold(self, im: np.ndarray, name: str) -> float:
+        counts, centers = imageHistogram(im, self.stride)
+        cdf = None
+        previous = self._cache.get(name)
+        if im.dtype.kind == 'u':  # The bins of other images depend on the image's range, so they can't be compared.
+            cdf = np.cumsum(counts, dtype=float)
+            cdf /= cdf[-1]
+            if previous is not None:
+                prevCdf, thresh = previous
+                n = min(len(cdf), len(prevCdf))
+                changed = max(np.abs(cdf[:n] - prevCdf[:n]).max(), 1 - cdf[n - 1], 1 - prevCdf[n - 1])
+                if changed < self.changeTolerance:
+                    self.reused += 1
+                    self.threshold = thresh
+                    return thresh
+        if name == 'li':
+            thresh = thresholdLiHist(counts, centers, initialGuess=previous[1] if previous is not None else None)
+        else:
+            thresh = thresholdOtsuHist(counts, centers)
+        self.computed += 1
+        if cdf is not None:
+            self._cache[name] = (cdf, thresh)
+        self.threshold = thresh
+        return thresh
@@ -0,0 +1,116 @@
+"""
+Timing instrumentation for the stages of the pipeline between the camera and the overlay. Each stage's most recent
+durations are kept in a preallocated ring buffer so that recording a duration costs little more than reading the clock.
+The shared `pipelineTimer` is used by `CameraManager`, the fitting functions in `analysis` and `CircleOverlayCameraView`.
+"""
+from __future__ import annotations
+import contextlib
+import csv
+import time
+import typing as t_
+
+import numpy as np
+
+STAGES = ['acquire', 'copy', 'downSample', 'binarize', 'initialGuess', 'optimize', 'refine', 'fit', 'render', 'fitLatency', 'displayLatency']  # In pipeline order, used to sort the summary.
+# The latencies are from when a frame was acquired until its fit result was taken by the GUI, and until it was displayed.
+
+
+class _StageRing:
+    """The durations and end times of the most recent `capacity` calls of a stage."""
+    def __init__(self, capacity: int):
+        self.durations = np.zeros(capacity, dtype=float)
+        self.timestamps = np.zeros(capacity, dtype=float)
+        self.count = 0  # The total number recorded, including those that have been overwritten.
+
+    def samples(self) -> t_.Tuple[np.ndarray, np.ndarray]:
+        """The durations and end times held, oldest first."""
+        capacity = len(self.durations)
+        n = min(self.count, capacity)
+        idx = (np.arange(self.count - n, self.count)) % capacity
+        return self.durations[idx], self.timestamps[idx]
+
+
+class StageTimer:
+    """
+    Records how long each stage of the pipeline takes.
+
+    Stages can be recorded from any thread. No lock is taken, a stage is normally only recorded by one thread and a
+    sample that is torn by a concurrent write only affects the statistics.
+
+    Args:
+        capacity: The number of recent durations kept for each stage.
+    """
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.enabled = True
+        self._stages: t_.Dict[str, _StageRing] = {}
+
+    def record(self, stage: str, seconds: float, end: float = None):
+        """Record that `stage` took `seconds`, ending at the `time.perf_counter` time `end` (by default now)."""
+        if not self.enabled:
+            return
+        ring = self._stages.get(stage)
+        if ring is None:
+            ring = self._stages.setdefault(stage, _StageRing(self.capacity))
+        i = ring.count % self.capacity
+        ring.durations[i] = seconds
+        ring.timestamps[i] = time.perf_counter() if end is None else end
+        ring.count += 1
+
+    @contextlib.contextmanager
+    def time(self, stage: str):
+        """Time the body of a `with` block as `stage`."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.record(stage, end - start, end)
+
+    def reset(self):
+        self._stages.clear()
+
+    def stages(self) -> t_.List[str]:
+        """The names of the stages recorded so far, in pipeline order."""
+        order = {name: i for i, name in enumerate(STAGES)}
+        return sorted(self._stages, key=lambda s: (order.get(s, len(order)), s))
+
+    def summary(self, percentiles: t_.Sequence[float] = (50, 90, 99)) -> t_.Dict[str, dict]:
+        """
+        Summarize the durations held for each stage.
+
+        Returns:
+            For each stage a dict of the total `count` recorded, the `mean` and `max` in ms, and each percentile in ms
+            under the key `p<percentile>`.
+        """
+        result = {}
+        for stage in self.stages():
+            durations, _ = self._stages[stage].samples()
+            if len(durations) == 0:
+                continue
+            ms = durations * 1000
+            stats = dict(count=self._stages[stage].count, mean=float(ms.mean()), max=float(ms.max()))
+            for p, value in zip(percentiles, np.percentile(ms, percentiles)):
+                stats[f'p{p:g}'] = float(value)
+            result[stage] = stats
+        return result
+
+    def exportCsv(self, path: str):
+        """Save every duration held to a CSV file with the columns stage, timestamp (`time.perf_counter` seconds) and
+        duration_ms, sorted by timestamp."""
+        rows = []
+        for stage in self.stages():
+            durations, timestamps = self._stages[stage].samples()
+            rows.extend(zip(timestamps, [stage] * len(durations), durations * 1000))
+        rows.sort()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'timestamp', 'duration_ms'])
+            for timestamp, stage, duration in rows:
+                writer.writerow([stage, f'{timestamp:.6f}', f'{duration:.4f}'])
+
+
+pipelineTimer = StageTimer()
@@ -0,0 +1,261 @@
+from __future__ import annotations
+import typing as t_
+
+import numpy as np
+
+from nadetector.analysis import edgeContrast
+
+Circle = t_.Tuple[float, float, float]
+MeasureFunction = t_.Callable[..., t_.Tuple[Circle, Circle]]  # Called as `measure(im, guess=None)`, returns the guess and fit.
+
+
+class CircleTracker:
+    """
+    Tracks the aperture from frame to frame. Rather than searching the whole image each frame is cropped to a padded
+    box around the previous fit and the previous fit is used as the initial guess. If the contrast across the edge of the
+    tracked circle drops below a fraction of the contrast found by the last full frame search then the tracker falls
+    back to searching the full frame.
+
+    Args:
+        padding: The amount of space to leave around the previous circle when cropping, as a fraction of the radius.
+        tolerance: The fraction of the reference edge contrast that a tracked fit must reach to be accepted.
+        minPadding: The minimum padding in pixels.
+    """
+    def __init__(self, padding: float = 0.15, tolerance: float = 0.8, minPadding: int = 10):
+        self.padding = padding
+        self.tolerance = tolerance
+        self.minPadding = minPadding
+        self._last: t_.Optional[Circle] = None
+        self._refContrast = 0.
+        self.contrast = 0.  # The edge contrast of the most recent fit.
+        self.fullSearches = 0  # The number of frames that required a full frame search.
+        self.trackedFrames = 0  # The number of frames that were fit using only the cropped region.
+        self.cropOrigin = (0, 0)  # The top, left corner of the region the most recent fit was measured in.
+
+    def reset(self):
+        """Forget the previous fit so the next frame gets a full frame search. This should be called when the fitting
+        settings change."""
+        self._last = None
+
+    def measure(self, im: np.ndarray, measure: MeasureFunction) -> t_.Tuple[Circle, Circle]:
+        """
+        Measure the circle in a new frame.
+
+        Args:
+            im: The image from the camera.
+            measure: The function used to fit the circle in an image.
+
+        Returns:
+            The x, y, r of the initial guess and the x, y, r of the final fit.
+        """
+        last = self._last
+        if last is not None:
+            result = self._measureTracked(im, measure, last)
+            if result is not None:
+                self.trackedFrames += 1
+                return result
+        self.fullSearches += 1
+        self.cropOrigin = (0, 0)
+        guess, fit = measure(im)
+        self.contrast = edgeContrast(im, *fit)
+        self._refContrast = self.contrast
+        self._last = fit if fit[2] > 0 else None
+        return guess, fit
+
+    def _measureTracked(self, im: np.ndarray, measure: MeasureFunction, last: Circle) -> t_.Optional[t_.Tuple[Circle, Circle]]:
+        """Fit the circle in a crop around the previous result. Returns `None` if the result isn't good enough."""
+        x, y, r = last
+        pad = r + max(self.padding * r, self.minPadding)
+        top, left = max(int(y - pad), 0), max(int(x - pad), 0)
+        bottom, right = min(int(np.ceil(y + pad)) + 1, im.shape[0]), min(int(np.ceil(x + pad)) + 1, im.shape[1])
+        crop = im[top:bottom, left:right]
+        self.cropOrigin = (top, left)
+        (x0, y0, r0), (fx, fy, fr) = measure(crop, guess=(x - left, y - top, r))
+        # A circle that doesn't fit inside the crop means the aperture moved or grew too much to be tracked.
+        if fr <= 0 or fx - fr < 0 or fy - fr < 0 or fx + fr > crop.shape[1] or fy + fr > crop.shape[0]:
+            if (top, left, bottom, right) != (0, 0, im.shape[0], im.shape[1]):  # Unless the crop is already the whole image.
+                return None
+        fit = (fx + left, fy + top, fr)
+        contrast = edgeContrast(im, *fit)
+        if contrast < self.tolerance * self._refContrast:
+            return None
+        self.contrast = contrast
+        self._last = fit
+        return (x0 + left, y0 + top, r0), fit
+
+
+class FrameChangeDetector:
+    """
+    Decides whether a frame differs enough from the last one that was fit to be worth fitting again. Each frame is
+    reduced to a small signature, the mean of each cell of a `gridSize` x `gridSize` grid over a subsample of the pixels,
+    which averages out most of the sensor noise. A frame is considered changed if any cell has changed by more than
+    `threshold` of full scale since the last changed frame, or if `maxAge` frames have passed since then.
+
+    Args:
+        gridSize: The number of cells along each axis of the signature.
+        threshold: The change in a cell's mean, as a fraction of full scale, that counts as a change.
+        maxAge: A frame is always considered changed after this many unchanged frames, so slow drifts that never cross
+            the threshold are still picked up.
+    """
+    def __init__(self, gridSize: int = 16, threshold: float = 0.03, maxAge: int = 10):
+        self.gridSize = gridSize
+        self.threshold = threshold
+        self.maxAge = maxAge
+        self._reference: t_.Optional[np.ndarray] = None
+        self._age = 0
+        self.difference = 0.  # The largest change of a cell in the last frame checked, as a fraction of full scale.
+
+    def reset(self):
+        """Forget the reference frame so the next frame is considered changed."""
+        self._reference = None
+
+    def signature(self, im: np.ndarray) -> np.ndarray:
+        """Reduce an image to the mean of each cell of a grid, as a fraction of full scale."""
+        stride = max(min(im.shape[:2]) // (16 * self.gridSize), 1)  # About 16 samples along each side of a cell.
+        sub = im[::stride, ::stride]
+        ch, cw = sub.shape[0] // self.gridSize, sub.shape[1] // self.gridSize
+        if ch == 0 or cw == 0:  # A tiny image, every pixel is its own cell.
+            ch, cw = 1, 1
+        h, w = sub.shape[0] // ch, sub.shape[1] // cw
+        cells = sub[:h * ch, :w * cw].reshape(h, ch, w * cw).sum(axis=1, dtype=float).reshape(h, w, cw).sum(axis=2)
+        fullScale = np.iinfo(im.dtype).max if im.dtype.kind in 'ui' else 1
+        return cells / (ch * cw * fullScale)
+
+    def changed(self, im: np.ndarray) -> bool:
+        """Check a new frame. If it is considered changed then it becomes the reference for the following frames."""
+        sig = self.signature(im)
+        if self._reference is None or self._reference.shape != sig.shape:
+            self.difference = np.inf
+        else:
+            self.difference = float(np.abs(sig - self._reference).max())
+            if self.difference <= self.threshold and self._age < self.maxAge:
+                self._age += 1
+                return False
+        self._reference = sig
+        self._age = 0
+        return True
+
+
+class CircleFilter:
+    """
+    Smooths a sequence of circle fits with a separate Kalman filter for x, y and r. Each filter tracks a position and a
+    velocity, so an aperture that is being opened or moved steadily is followed without lagging behind.
+
+    How much the aperture really wanders and how much the fits jitter are both estimated from the changes between
+    successive fits. Independent jitter makes successive changes anti-correlated, with a covariance of minus the jitter's
+    variance, while real random movement doesn't, so the variance and lag-one covariance of the changes separate the two.
+    An aperture that is being moved around is then followed closely and a stationary one is smoothed over many frames.
+    A fit that is more than `gate` standard deviations from the prediction is treated as an outlier and ignored, unless
+    `jumpFrames` outliers arrive in a row, in which case the aperture has really moved and the filter restarts from the
+    latest fit.
+
+    Args:
+        processNoise: The minimum standard deviation, in pixels, of the random drift of the aperture between frames.
+        measurementNoise: The initial standard deviation, in pixels, of the fits.
+        gate: The number of standard deviations beyond which a fit is an outlier.
+        jumpFrames: The number of consecutive outliers that restarts the filter.
+        velocityNoise: The standard deviation, in pixels per frame, of the expected change in velocity between frames.
+        adaptRate: The weight of each new change between fits in the running estimates of the drift and jitter.
+    """
+    def __init__(self, processNoise: float = 0.05, measurementNoise: float = 0.5, gate: float = 4, jumpFrames: int = 2,
+                 velocityNoise: float = 0.02, adaptRate: float = 0.05):
+        self.processNoise = processNoise
+        self.measurementNoise = measurementNoise
+        self.gate = gate
+        self.jumpFrames = jumpFrames
+        self.velocityNoise = velocityNoise
+        self.adaptRate = adaptRate
+        self.reset()
+
+    def reset(self):
+        """Forget the previous fits. This should be called when the fitting settings change."""
+        self._state: t_.Optional[np.ndarray] = None
+        self._velocity = np.zeros(3)  # In pixels per frame.
+        self._variance = np.zeros((3, 3))  # The covariance of each position and velocity, as the variance of the position, the covariance, and the variance of the velocity.
+        self._lastFit: t_.Optional[np.ndarray] = None
+        self._meanStep = np.zeros(3)  # A running average of the change between fits, the steady part of the movement.
+        self._lastDeviation = np.zeros(3)  # The previous change between fits, minus `_meanStep`.
+        self._stepVariance = np.full(3, 2 * self.measurementNoise ** 2)  # Running estimates of the variance and lag-one covariance of the deviations.
+        self._stepCovariance = np.full(3, -self.measurementNoise ** 2)
+        self._outliers = 0
+        self.confidence = 0.  # A running average of the fraction of fits that agreed with the filter, from 0 to 1.
+
+    @property
+    def std(self) -> t_.Optional[Circle]:
+        """The standard deviation, in pixels, of the filtered x, y, r."""
+        return None if self._state is None else tuple(np.sqrt(self._variance[0]))
+
+    @property
+    def velocity(self) -> t_.Optional[Circle]:
+        """The rate of change of x, y, r in pixels per frame."""
+        return None if self._state is None else tuple(self._velocity)
+
+    @property
+    def noise(self) -> Circle:
+        """The estimated standard deviation, in pixels, of the jitter of the fits of x, y, r."""
+        return tuple(np.sqrt(self._noiseVariance()))
+
+    @property
+    def drift(self) -> Circle:
+        """The estimated standard deviation, in pixels, of the random movement of x, y, r between frames."""
+        return tuple(np.sqrt(self._driftVariance()))
+
+    def _noiseVariance(self) -> np.ndarray:
+        return np.maximum(-self._stepCovariance, 1e-4)
+
+    def _driftVariance(self) -> np.ndarray:
+        return np.maximum(self._stepVariance - 2 * self._noiseVariance(), self.processNoise ** 2)
+
+    def _updateStatistics(self, z: np.ndarray):
+        """Update the estimates of the drift and jitter with the change from the previous fit. Each change is limited
+        to `gate` of its standard deviations, so that a single bad fit has a small effect while sustained movement
+        still raises the estimates within a few frames."""
+        if self._lastFit is not None:
+            a = self.adaptRate
+            limit = self.gate * np.sqrt(self._stepVariance)
+            deviation = np.clip(z - self._lastFit - self._meanStep, -limit, limit)
+            self._meanStep += a * deviation
+            self._stepVariance = (1 - a) * self._stepVariance + a * deviation ** 2
+            self._stepCovariance = (1 - a) * self._stepCovariance + a * deviation * self._lastDeviation
+            self._lastDeviation = deviation
+        self._lastFit = z
+
+    def update(self, fit: Circle) -> Circle:
+        """Add a new fit and return the filtered x, y, r."""
+        z = np.asarray(fit, dtype=float)
+        self._updateStatistics(z)
+        if self._state is None:
+            self._restart(z)
+            return fit
+        # Predict with constant velocity. The velocity noise is white noise acceleration integrated over one frame.
+        pp, pv, vv = self._variance
+        q = self.velocityNoise ** 2
+        predicted = np.array([pp + 2 * pv + vv + q / 4 + self._driftVariance(), pv + vv + q / 2, vv + q])
+        statePredicted = self._state + self._velocity
+        s = predicted[0] + self._noiseVariance()
+        innovation = z - statePredicted
+        if np.any(innovation ** 2 > self.gate ** 2 * s):
+            self._outliers += 1
+            self.confidence *= 0.8
+            if self._outliers >= self.jumpFrames:
+                # The aperture is really moving, so expect it to keep moving by as much until the estimates catch up.
+                self._stepVariance = np.maximum(self._stepVariance, innovation ** 2)
+                self._restart(z)
+            else:
+                self._state = statePredicted
+                self._variance = predicted
+            return tuple(self._state)
+        self._outliers = 0
+        gainP, gainV = predicted[0] / s, predicted[1] / s
+        self._state = statePredicted + gainP * innovation
+        self._velocity = self._velocity + gainV * innovation
+        self._variance = np.array([(1 - gainP) * predicted[0], (1 - gainP) * predicted[1], predicted[2] - gainV * predicted[1]])
+        self.confidence = 0.8 * self.confidence + 0.2
+        return tuple(self._state)
+
+    def _restart(self, z: np.ndarray):
+        self._state = z
+        self._velocity = self._meanStep.copy()
+        noise = self._noiseVariance()
+        self._variance = np.array([noise, np.zeros(3), noise])  # The velocity is unknown, up to about a fit's noise per frame.
+        self._outliers = 0
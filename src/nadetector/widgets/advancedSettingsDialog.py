@@ -1,8 +1,9 @@
 from __future__ import annotations
 from PyQt5 import QtCore
 from PyQt5.QtCore import QTimer
-from PyQt5.QtWidgets import QDialog, QWidget, QCheckBox, QVBoxLayout, QComboBox, QTabWidget, QDoubleSpinBox, QGridLayout, QLabel
+from PyQt5.QtWidgets import QDialog, QWidget, QCheckBox, QVBoxLayout, QComboBox, QTabWidget, QDoubleSpinBox, QGridLayout, QLabel, QTableWidget, QTableWidgetItem, QPushButton, QFileDialog, QHeaderView
 from nadetector.constants import Methods
+from nadetector.timing import pipelineTimer
 import typing
 if typing.TYPE_CHECKING:
     from nadetector.hardware import CameraManager
@@ -18,12 +19,14 @@ class AdvancedSettingsDialog(QDialog):
         tab = QTabWidget(self)
 
         self.debugTab = DebugTab(tab, camview)
-        self.cameraTab = CameraTab(tab, camManager)
+        self.cameraTab = CameraTab(tab, camManager, camview)
+        self.timingTab = TimingTab(tab)
         # self.thresholdTab = ThresholdTab(tab)
 
         tab.addTab(self.cameraTab, "Camera")
         # tab.addTab(self.thresholdTab, "Threshold")
         tab.addTab(self.debugTab, "Debug")
+        tab.addTab(self.timingTab, "Timing")
 
         l = QGridLayout()
         l.addWidget(tab, 0, 0)
@@ -35,7 +38,7 @@ class AdvancedSettingsDialog(QDialog):
 
 
 class CameraTab(QWidget):
-    def __init__(self, parent: QWidget, camManager: CameraManager):
+    def __init__(self, parent: QWidget, camManager: CameraManager, camview: CircleOverlayCameraView):
         super().__init__(parent)
 
         self.autoExposeCB = QCheckBox("Auto Exposure", self)
@@ -62,22 +65,35 @@ class CameraTab(QWidget):
                 setExposure()
         self.autoExposeCB.stateChanged.connect(autoExposeChanged)
 
+        self.exposeApertureCB = QCheckBox("Expose for aperture only", self)
+        def exposeApertureChanged():
+            if self.exposeApertureCB.isChecked():
+                camview.fitCompleted.connect(camManager.setAutoExposureROI)
+                if camview.fitCoords is not None:
+                    camManager.setAutoExposureROI(*camview.fitCoords)
+            else:
+                camview.fitCompleted.disconnect(camManager.setAutoExposureROI)
+                camManager.setAutoExposureROI()
+        self.exposeApertureCB.stateChanged.connect(exposeApertureChanged)
+
         def expChanged():
             self.expChangeDebounce.start()
         self.exposure.valueChanged.connect(expChanged)
 
-        def updateExpField(newExp: float):
-            self.exposure.blockSignals(True)
-            self.exposure.setValue(newExp)
-            self.exposure.blockSignals(False)
-        camManager.exposureChanged.connect(updateExpField)
+        camManager.exposureChanged.connect(self._updateExpField)  # A bound method so that Qt delivers it on the GUI thread.
 
         l = QGridLayout()
         l.addWidget(self.autoExposeCB, 0, 0, 1, 2)
-        l.addWidget(QLabel("Exposure (ms):"), 1, 0)
-        l.addWidget(self.exposure, 1, 1)
+        l.addWidget(self.exposeApertureCB, 1, 0, 1, 2)
+        l.addWidget(QLabel("Exposure (ms):"), 2, 0)
+        l.addWidget(self.exposure, 2, 1)
         self.setLayout(l)
 
+    def _updateExpField(self, newExp: float):
+        self.exposure.blockSignals(True)
+        self.exposure.setValue(newExp)
+        self.exposure.blockSignals(False)
+
 class DebugTab(QWidget):
     def __init__(self, parent: QWidget, camview: CircleOverlayCameraView):
         super().__init__(parent)
@@ -86,6 +102,7 @@ class DebugTab(QWidget):
         self.viewPreprocessed.setLayoutDirection(QtCore.Qt.RightToLeft)  # Put label on left side of box
         def setBinary():
             camview.displayPreProcessed = self.viewPreprocessed.isChecked()
+            camview.requestReset(camview.changeDetector)  # Fit the next frame even if it hasn't changed, so that the preview is rendered.
         self.viewPreprocessed.stateChanged.connect(setBinary)
         self.viewPreprocessed.setChecked(camview.displayPreProcessed)
 
@@ -96,6 +113,42 @@ class DebugTab(QWidget):
         self.viewPreOpt.stateChanged.connect(viewPreOpt)
         self.viewPreOpt.setChecked(camview.preOptFitOverlay.active)
 
+        self.tracking = QCheckBox("Track aperture:", self)
+        self.tracking.setLayoutDirection(QtCore.Qt.RightToLeft)  # Put label on left side of box
+        def setTracking():
+            camview.setTracking(self.tracking.isChecked())
+        self.tracking.stateChanged.connect(setTracking)
+        self.tracking.setChecked(camview.isTracking())
+
+        self.smoothing = QCheckBox("Smooth fit over time:", self)
+        self.smoothing.setLayoutDirection(QtCore.Qt.RightToLeft)  # Put label on left side of box
+        def setSmoothing():
+            camview.setSmoothing(self.smoothing.isChecked())
+        self.smoothing.stateChanged.connect(setSmoothing)
+        self.smoothing.setChecked(camview.isSmoothing())
+
+        self.skipUnchanged = QCheckBox("Skip unchanged frames:", self)
+        self.skipUnchanged.setLayoutDirection(QtCore.Qt.RightToLeft)  # Put label on left side of box
+        def setSkipUnchanged():
+            camview.setSkipUnchanged(self.skipUnchanged.isChecked())
+        self.skipUnchanged.stateChanged.connect(setSkipUnchanged)
+        self.skipUnchanged.setChecked(camview.isSkippingUnchanged())
+
+        self.consensus = QCheckBox("Combine all methods:", self)
+        self.consensus.setLayoutDirection(QtCore.Qt.RightToLeft)  # Put label on left side of box
+        def setConsensus():
+            camview.setConsensus(self.consensus.isChecked())
+        self.consensus.stateChanged.connect(setConsensus)
+        self.consensus.setChecked(camview.isConsensus())
+
+        self.cameraBinning = QCheckBox("Downsample on camera:", self)
+        self.cameraBinning.setLayoutDirection(QtCore.Qt.RightToLeft)  # Put label on left side of box
+        def setCameraBinning():
+            camview.setCameraBinning(self.cameraBinning.isChecked())
+        self.cameraBinning.stateChanged.connect(setCameraBinning)
+        self.cameraBinning.setChecked(camview.isCameraBinning())
+        self.cameraBinning.setEnabled(camview.camera.supportsBinning)
+
         self.methodCombo = QComboBox(self)
         for i in Methods:
             self.methodCombo.addItem(i.name, i)
@@ -112,11 +165,87 @@ class DebugTab(QWidget):
         self.downSampleCombo.currentIndexChanged.connect(dsChanged)
         self.downSampleCombo.setCurrentText("2")
 
+        self.pyramidCombo = QComboBox(self)
+        self.pyramidCombo.addItem("Off", 0)
+        for i in [1, 2, 3, 4]:
+            self.pyramidCombo.addItem(str(i), i)
+        def pyramidChanged():
+            levels = self.pyramidCombo.currentData()
+            camview.setPyramidLevels(levels)
+            self.downSampleCombo.setEnabled(levels == 0)  # Downsampling isn't used by the coarse-to-fine fit.
+            self.cameraBinning.setEnabled(levels == 0 and camview.camera.supportsBinning)
+        self.pyramidCombo.currentIndexChanged.connect(pyramidChanged)
+
         layout = QVBoxLayout()
         layout.addWidget(self.viewPreprocessed)
         layout.addWidget(self.viewPreOpt)
+        layout.addWidget(self.tracking)
+        layout.addWidget(self.smoothing)
+        layout.addWidget(self.skipUnchanged)
+        layout.addWidget(self.consensus)
         layout.addWidget(QLabel("Method:", self))
         layout.addWidget(self.methodCombo)
         layout.addWidget(QLabel("Downsampling:", self))
         layout.addWidget(self.downSampleCombo)
+        layout.addWidget(self.cameraBinning)
+        layout.addWidget(QLabel("Coarse-to-fine Levels:", self))
+        layout.addWidget(self.pyramidCombo)
         self.setLayout(layout)
+
+
+class TimingTab(QWidget):
+    """Shows percentiles of how long each stage of the pipeline has recently taken, from `pipelineTimer`."""
+    columns = ['count', 'mean', 'p50', 'p90', 'p99', 'max']
+
+    def __init__(self, parent: QWidget):
+        super().__init__(parent)
+
+        self.enabledCB = QCheckBox("Record timings", self)
+        self.enabledCB.setChecked(pipelineTimer.enabled)
+        def setEnabled():
+            pipelineTimer.enabled = self.enabledCB.isChecked()
+        self.enabledCB.stateChanged.connect(setEnabled)
+
+        self.table = QTableWidget(0, len(self.columns), self)
+        self.table.setHorizontalHeaderLabels(["Count"] + [f"{c} (ms)" for c in self.columns[1:]])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.resetButton = QPushButton("Reset", self)
+        self.resetButton.released.connect(self._reset)
+        self.exportButton = QPushButton("Export CSV...", self)
+        def export():
+            path, _ = QFileDialog.getSaveFileName(self, "Export Timings", "timings.csv", "CSV (*.csv)")
+            if path:
+                try:
+                    pipelineTimer.exportCsv(path)
+                except Exception as e:
+                    print(e)
+        self.exportButton.released.connect(export)
+
+        self.refreshTimer = QTimer(self)
+        self.refreshTimer.setInterval(500)
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.refreshTimer.start()
+
+        l = QGridLayout()
+        l.addWidget(self.enabledCB, 0, 0, 1, 2)
+        l.addWidget(self.table, 1, 0, 1, 2)
+        l.addWidget(self.resetButton, 2, 0)
+        l.addWidget(self.exportButton, 2, 1)
+        self.setLayout(l)
+
+    def _reset(self):
+        pipelineTimer.reset()
+        self.refresh()
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        summary = pipelineTimer.summary()
+        self.table.setRowCount(len(summary))
+        self.table.setVerticalHeaderLabels(list(summary))
+        for row, stats in enumerate(summary.values()):
+            for col, name in enumerate(self.columns):
+                text = str(stats[name]) if name == 'count' else f"{stats[name]:.2f}"
+                self.table.setItem(row, col, QTableWidgetItem(text))
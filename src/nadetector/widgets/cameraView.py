@@ -1,22 +1,24 @@
 from __future__ import annotations
-from queue import Queue
-from threading import Thread
+import threading
+import time
 from typing import List
 
 import numpy as np
-import scipy
-import skimage
 from PyQt5 import QtGui, QtCore
 from PyQt5.QtCore import QTimer, pyqtSignal
+from PyQt5.QtCore import QRectF
 from PyQt5.QtGui import QImage, QPixmap, QPainter, QPen, QBrush, QColor
-from PyQt5.QtWidgets import QLabel, QSizePolicy, QGraphicsView, QGraphicsScene
+from PyQt5.QtWidgets import QLabel, QSizePolicy, QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsItem, QGraphicsSceneHoverEvent, QStyleOptionGraphicsItem, QWidget
 
 from abc import ABC, abstractmethod
 
-from skimage.transform import downscale_local_mean
-
-from nadetector.analysis import binarizeImageLi, binarizeImageOtsu, initialGuessCircle, fitCircle, fitCircleHough, detectEdges
+from nadetector.analysis import FitIntermediates, measureCircleScaled, preprocessImage
+from nadetector.consensus import ConsensusFitter
 from nadetector.constants import Methods
+from nadetector.fitWorker import FitWorker, ScratchBuffers
+from nadetector.thresholding import Thresholder
+from nadetector.timing import pipelineTimer
+from nadetector.tracking import CircleTracker, CircleFilter, FrameChangeDetector
 import typing
 if typing.TYPE_CHECKING:
     from nadetector.hardware import CameraManager
@@ -35,7 +37,10 @@ class ZoomableView(QGraphicsView):
     def __init__(self, imageView: CameraView):
         super().__init__()
         scene = QGraphicsScene(self)
-        scene.addWidget(imageView)
+        if imageView.pixmapItem is not None:
+            imageView.attachToScene(scene)
+        else:
+            scene.addWidget(imageView)
         self.setScene(scene)
         self._scaleFactor = 1
 
@@ -72,9 +77,18 @@ class ZoomableView(QGraphicsView):
 
 
 class CameraView(QLabel):
-    def __init__(self, camera: CameraManager):
+    """
+    Displays live video from a `CameraManager`.
+
+    Args:
+        camera: The camera to display.
+        sceneGraph: If True then the frames are displayed by a `QGraphicsPixmapItem` that is added to a scene with
+            `attachToScene` rather than by this label. Overlays can then be redrawn without touching the frame.
+    """
+    def __init__(self, camera: CameraManager, sceneGraph: bool = False):
         super(CameraView, self).__init__()
         self.camera = camera
+        self.pixmapItem = FramePixmapItem(self) if sceneGraph else None
         self._cmin = 0
         self._cmax = None
         self.setScaledContents(True)
@@ -84,17 +98,39 @@ class CameraView(QLabel):
         self.isRunning = False
         self.rawArray = None
         self.processedArray = None
-        self.grab_image(withProcessing=False)
+        self.frameSeq = 0  # The ring buffer sequence number of `rawArray`. 0 for frames from `grab_image`.
+        self.frameTimestamp = 0.  # The `time.perf_counter` time that `rawArray` was acquired.
+        self.displayedFrames = 0
+        self.frameBinning = 1  # The camera binning of the frame being displayed, which is scaled up to unbinned pixels.
+        # Start with a blank frame rather than grabbing one from the camera so that the window can open straight away.
+        self.rawArray = self.processedArray = np.zeros((camera.height, camera.width), dtype=np.uint8)
+        self._set_pixmap_from_array(self.processedArray)
 
     def refresh(self):
-        self._set_pixmap_from_array(self.processedArray)
-        self.processPixmap()
+        if self.pixmapItem is None:
+            self._set_pixmap_from_array(self.processedArray)
+        self.processPixmap()  # In scene graph mode the frame is unchanged, only the overlays need updating.
+
+    def attachToScene(self, scene: QGraphicsScene):
+        """Add the graphics items used in scene graph mode to `scene`."""
+        scene.addItem(self.pixmapItem)
+
+    def framePixmap(self) -> QPixmap:
+        """The pixmap of the frame currently being displayed."""
+        return self.pixmap() if self.pixmapItem is None else self.pixmapItem.pixmap()
+
+    def _setFramePixmap(self, pm: QPixmap):
+        if self.pixmapItem is None:
+            self.setPixmap(pm)
+        else:
+            self.pixmapItem.setPixmap(pm)
 
     def processImage(self, im: np.ndarray, **kwargs) -> np.ndarray:
         return im  # This class is to be overridden by inheriting classes.
 
     def grab_image(self, withProcessing=True):
         self.rawArray = self.camera.grab_image()
+        self.frameSeq, self.frameTimestamp = 0, time.perf_counter()
         if withProcessing:
             self.processedArray = self.processImage(self.rawArray, block=True)
         else:
@@ -120,6 +156,7 @@ class CameraView(QLabel):
             elif arr.dtype == np.uint16:
                 if not self._cmax:
                     self._cmax = arr.max()  # Set cmax once from first image
+                import scipy.misc
                 arr = scipy.misc.bytescale(arr, self._cmin, self._cmax)
                 fmt = QImage.Format_Indexed8
             else:
@@ -132,43 +169,103 @@ class CameraView(QLabel):
         self._saved_img = arr  # Save a reference to keep Qt from crashing. I don't think this is necessary
         image = QImage(arr.data, arr.shape[1], arr.shape[0], bpl, fmt)
         pm = QPixmap.fromImage(image)
-        self.setPixmap(pm)
-
-    def _displayNewFrame(self, frame):
-        self.camera.frameReady.disconnect(self._displayNewFrame)
-        self.rawArray = frame.copy()
+        self._setFramePixmap(pm)
+        binning = self.camera.binningOf(arr)
+        if binning != self.frameBinning:
+            self.frameBinning = binning
+            if self.pixmapItem is not None:
+                self.pixmapItem.setScale(binning)  # So that the overlays, in unbinned pixels, line up with the frame.
+
+    def _displayNewFrame(self, frame: np.ndarray, seq: int, timestamp: float):
+        self.rawArray = frame  # This is a view into the camera's ring buffer, it will be overwritten after a few frames.
+        self.frameSeq, self.frameTimestamp = seq, timestamp
         self.processedArray = self.processImage(self.rawArray, block=False)
-        self._set_pixmap_from_array(self.processedArray)
-        self.processPixmap()
-        self.camera.frameReady.connect(self._displayNewFrame)
+        with pipelineTimer.time('render'):
+            self._set_pixmap_from_array(self.processedArray)
+            self.processPixmap()
+        self.displayedFrames += 1
+        pipelineTimer.record('displayLatency', time.perf_counter() - timestamp)
 
 
     def processPixmap(self):
         pass
 
+    def pixelHovered(self, x: float, y: float):
+        """Called by the pixmap item in scene graph mode when the mouse moves over the frame, in pixel coordinates."""
+        pass
+
+
+class FramePixmapItem(QGraphicsPixmapItem):
+    """Displays the frames of a `CameraView` in scene graph mode and reports the pixel the mouse is hovering over."""
+    def __init__(self, view: CameraView):
+        super().__init__()
+        self._view = view
+        self.setAcceptHoverEvents(True)
+
+    def hoverMoveEvent(self, event: QGraphicsSceneHoverEvent) -> None:
+        pos = event.pos() * self._view.frameBinning
+        self._view.pixelHovered(pos.x(), pos.y())
+        super().hoverMoveEvent(event)
+
 
 class CircleOverlayCameraView(CameraView):
     mouseMoved = pyqtSignal(int, int)
     fitCompleted = pyqtSignal(float, float, float)
 
-    def __init__(self, camera):
+    def __init__(self, camera, sceneGraph: bool = False):
         self.fitCoords = None
         self.preoptCoords = None
-        self.fitQ = Queue(maxsize=1)
-        self.fitThread = None
-        self.displayPreProcessed = False
+        self.fitSeq = 0  # The sequence number of the frame that `fitCoords` was measured from.
+        self.fitTimestamp: float = None  # The `time.perf_counter` time that that frame was acquired.
+        self.fitConfidence = 0.  # From 0 to 1, how consistent recent fits have been. Only calculated when smoothing.
+        self.fitWorker = FitWorker(self.measureCircle)
+        self.displayPreProcessed = False  # If true the fit worker renders the binarized image for display, see `FitIntermediates.preview`.
+        self.intermediates: typing.Optional[FitIntermediates] = None  # From the fit of `fitSeq`. Only `preview` and the scalars are safe to read.
         self.preOptFitOverlay = CircleCenterOverlay(QtCore.Qt.NoBrush, QtCore.Qt.red, 0, 0, 0)  # An overlay used for debug purposes to see the initial guess of the aperture circle before optimization.
 
         self._downSample = 1
-        self.method = Methods.LiMinimization
+        self._pyramidLevels = 0  # If greater than 0 then coarse-to-fine fitting is used instead of `_downSample`.
+        self._cameraBinning = True  # If true then as much of `_downSample` as possible is done by binning on the camera.
+        self._method = Methods.LiMinimization
+        self._tracking = False
+        self.tracker = CircleTracker()
+        self.thresholder = Thresholder()  # Only used by the fit worker thread.
+        self._smoothing = True
+        self.circleFilter = CircleFilter()
+        self._skipUnchanged = True
+        self.changeDetector = FrameChangeDetector()
+        self._lastResult = None  # The last result from the fit worker, reused for frames that haven't changed.
+        self._pendingResets: typing.Set[typing.Union[CircleTracker, CircleFilter, FrameChangeDetector]] = set()  # Reset by the fit worker before its next fit, see `requestReset`.
+        self._resetLock = threading.Lock()
+        self.skippedFrames = 0  # The number of frames that weren't fit because they hadn't changed.
+        self._consensus = False
+        self.consensus = ConsensusFitter()  # Its worker processes are only started once consensus mode is first enabled.
 
         self._overlays: List[Overlay] = [self.preOptFitOverlay]
-        super().__init__(camera)
+        self._overlayItems: typing.Dict[Overlay, OverlayItem] = {}  # Only used in scene graph mode
+        self._scene: QGraphicsScene = None
+        super().__init__(camera, sceneGraph)
         self.setMouseTracking(True) #Makes mouseMoveEventFire without clicking.
 
+    def attachToScene(self, scene: QGraphicsScene):
+        super().attachToScene(scene)
+        self._scene = scene
+        for overlay in self._overlays:
+            self._addOverlayItem(overlay)
+
+    def _addOverlayItem(self, overlay: Overlay):
+        item = OverlayItem(overlay)
+        item.setZValue(1)  # Keep overlays above the frame.
+        self._overlayItems[overlay] = item
+        self._scene.addItem(item)
+
+    def pixelHovered(self, x: float, y: float):
+        if 0 <= x < self.camera.width and 0 <= y < self.camera.height:
+            self.mouseMoved.emit(int(x), int(y))
+
     def _mapWidgetCoordToPixel(self, x, y):
         pm = self.pixmap()
-        scale = self.width()/pm.width() #We assume the height scaling is the same.
+        scale = self.width()/pm.width()/self.frameBinning #We assume the height scaling is the same.
         x /= scale
         y /= scale
         if x > self.camera.width:
@@ -192,81 +289,192 @@ class CircleOverlayCameraView(CameraView):
         self.mouseMoved.emit(x, y)
         super().mouseMoveEvent(ev)
 
-    def measureCircle(self, q: Queue, im):
-        if self._downSample != 1:
-            dtype = im.dtype
-            im = downscale_local_mean(im, (self._downSample, self._downSample)).astype(dtype)
-        if self.method == Methods.LiMinimization:
-            binar = binarizeImageLi(im)
-            x0, y0, r0 = initialGuessCircle(binar)
-            x, y, r = fitCircle(binar, x0, y0, r0)
-        elif self.method == Methods.OtsuMinimization:
-            binar = binarizeImageOtsu(im)
-            x0, y0, r0 = initialGuessCircle(binar)
-            x, y, r = fitCircle(binar, x0, y0, r0)
-        elif self.method == Methods.HoughTransform:
-            edges = detectEdges(im)
-            x0, y0, r0 = initialGuessCircle(edges)
-            x, y, r = fitCircleHough(edges, x0, y0, r0)
-        else:
-            raise ValueError("No recognized method")
-        if self._downSample != 1:
-            x0 *= self._downSample; y0 *= self._downSample; r0 *= self._downSample; x *= self._downSample; y *= self._downSample; r *= self._downSample;
-        if not q.empty():
-            _ = q.get()  # Clear the queue
-        q.put(((x0, y0, r0), (x, y, r)), False)  # This will raise an exception if the queue doesn't have room
+    def _measure(self, im: np.ndarray, guess=None, buffers: ScratchBuffers = None, intermediates: FitIntermediates = None, downSample: int = 1):
+        """Fit the circle using the current method and resolution settings. Returns the initial guess and the fit."""
+        if self._consensus:  # The intermediates are in the worker processes, they aren't filled in.
+            return self.consensus.measure(im, downSample, self._pyramidLevels, guess=guess)
+        return measureCircleScaled(im, self.method, downSample, self._pyramidLevels, guess=guess, buffers=buffers,
+                                   thresholder=self.thresholder, intermediates=intermediates)
+
+    def measureCircle(self, im: np.ndarray, buffers: ScratchBuffers):
+        """Run by the fit worker on each frame. Returns the initial guess, the fit, the confidence in the fit, and the
+        `FitIntermediates` of the fit. For a frame that hasn't changed the previous result object is returned, so the fit
+        worker keeps it paired with the frame it was fit from."""
+        with self._resetLock:
+            pending, self._pendingResets = self._pendingResets, set()
+        for state in pending:
+            state.reset()
+        if self._skipUnchanged and not self.changeDetector.changed(im) and self._lastResult is not None:
+            self.skippedFrames += 1
+            return self._lastResult
+        with pipelineTimer.time('fit'):
+            intermediates = FitIntermediates()
+            binning = self.camera.binningOf(im)
+            ds = max(self._downSample // binning, 1)  # The rest of the down-sampling was done by the camera.
+            if self._tracking:
+                # Crops are a different shape each frame so they don't use the scratch buffers.
+                guess, fit = self.tracker.measure(im, lambda crop, guess=None: self._measure(crop, guess, intermediates=intermediates, downSample=ds))
+                intermediates.origin = self.tracker.cropOrigin
+            else:
+                guess, fit = self._measure(im, buffers=buffers, intermediates=intermediates, downSample=ds)
+            if binning != 1:  # Report the fit in unbinned pixels, the same as the rest of the GUI.
+                offset = (binning - 1) / 2
+                guess, fit = [(x * binning + offset, y * binning + offset, r * binning) for x, y, r in (guess, fit)]
+        if self.displayPreProcessed:
+            # Rendered here rather than on the GUI thread. The arrays it's made from are overwritten by the next fit.
+            if intermediates.method is None:  # Consensus mode
+                preprocessImage(im, self.method, thresholder=self.thresholder, intermediates=intermediates)
+            intermediates.renderPreview(im.shape)
+        confidence = 0.
+        if self._smoothing and fit[2] > 0:
+            fit = self.circleFilter.update(fit)
+            confidence = self.circleFilter.confidence
+        self._lastResult = (guess, fit, confidence, intermediates)
+        return self._lastResult
 
     def processImage(self, im: np.ndarray, block=False) -> np.ndarray:
-        if self.fitThread is None:
-            self.fitThread = Thread(target=self.measureCircle, args=(self.fitQ, im))
-            self.fitThread.start()
-        else:
-            if not self.fitThread.is_alive():
-                self.fitThread = Thread(target=self.measureCircle, args=(self.fitQ, im))
-                self.fitThread.start()
-
+        info = (self.frameSeq, self.frameTimestamp)
+        # `im` is a view into the camera's ring buffer, it is copied before it can be overwritten.
         if block:
-            self.fitThread.join()
+            frameId = self.fitWorker.submit(im, info, copy=True)
+            result = self.fitWorker.waitForResult(frameId)
+        else:
+            self.fitWorker.submit(im, info, copy=True)  # If the worker is busy this replaces any frame that was still waiting.
+            result = self.fitWorker.takeResult()
 
-        if not self.fitQ.empty():
-            self.preoptCoords, self.fitCoords = self.fitQ.get()
+        if result is not None:
+            self.preoptCoords, self.fitCoords, self.fitConfidence, self.intermediates = result
+            self.fitSeq, self.fitTimestamp = self.fitWorker.resultInfo
+            pipelineTimer.record('fitLatency', time.perf_counter() - self.fitTimestamp)
             self.fitCompleted.emit(*self.fitCoords)
 
-        if self.displayPreProcessed:
-            if self.method == Methods.LiMinimization:
-                binary = binarizeImageLi(im)
-                newim = binary.astype(np.uint8) * 255
-            elif self.method == Methods.OtsuMinimization:
-                binary = binarizeImageOtsu(im)
-                newim = binary.astype(np.uint8) * 255
-            elif self.method == Methods.HoughTransform:
-                edges = detectEdges(im)
-                newim = edges.astype(np.uint8) * 255
-            else:
-                raise ValueError("Unrecognized method")
-        else:
-            newim = im
+        newim = im
+        if self.displayPreProcessed and self.intermediates is not None:
+            # The fit worker has already rendered the image it worked on. Until the first fit after this was enabled, and
+            # for ray casting which works on the raw image, there is no preview and the frame itself is shown.
+            preview = self.intermediates.preview
+            if preview is not None and preview.shape == im.shape[:2]:
+                newim = preview
         return newim
 
+    def fitAge(self) -> typing.Optional[float]:
+        """The number of seconds since the frame that the current fit was measured from was acquired."""
+        return None if self.fitTimestamp is None else time.perf_counter() - self.fitTimestamp
+
     def processPixmap(self):
-        pm = self.pixmap()
-        painter = QPainter(pm)
         if self.preoptCoords is not None:
             x, y, r = self.preoptCoords
             self.preOptFitOverlay.setCoords(x, y, r)
+        if self.pixmapItem is not None:
+            for item in self._overlayItems.values():
+                item.sync()
+            return
+        pm = self.pixmap()
+        painter = QPainter(pm)
+        painter.scale(1 / self.frameBinning, 1 / self.frameBinning)  # The overlays are in unbinned pixels.
         for overlay in self._overlays:
             if overlay.active:
                 overlay.draw(painter)
+        painter.end()
         self.setPixmap(pm)
 
+    def shutdown(self):
+        """Stop the background fitting worker and then the consensus worker processes."""
+        self.fitWorker.shutdown(timeout=5)
+        if self.fitWorker.isRunning():  # A consensus fit is taking too long. It will fail once its processes are stopped.
+            print("The fit worker didn't stop in time.")
+        self.consensus.shutdown()
+
     def addOverlay(self, overlay: Overlay):
         self._overlays.append(overlay)
+        if self._scene is not None:
+            self._addOverlayItem(overlay)
 
     def removeOverlay(self, overlay: Overlay):
         self._overlays.remove(overlay)
+        item = self._overlayItems.pop(overlay, None)
+        if item is not None:
+            self._scene.removeItem(item)
+
+    @property
+    def method(self) -> Methods:
+        return self._method
+
+    @method.setter
+    def method(self, method: Methods):
+        self._method = method
+        self._resetTemporalState()
 
     def setDownSampling(self, ds: int):
         self._downSample = ds
+        self._updateCameraBinning()
+        self._resetTemporalState()
+
+    def setPyramidLevels(self, levels: int):
+        """Set the number of levels used for coarse-to-fine fitting. 0 disables the pyramid and the fixed down-sampling
+        factor is used instead."""
+        self._pyramidLevels = levels
+        self._updateCameraBinning()
+        self._resetTemporalState()
+
+    def setCameraBinning(self, enabled: bool):
+        """If enabled, and the camera supports it, then the down-sampling is done by binning on the camera so fewer
+        pixels are transferred. The displayed frames are then binned too."""
+        self._cameraBinning = enabled
+        self._updateCameraBinning()
+        self._resetTemporalState()
+
+    def isCameraBinning(self) -> bool:
+        return self._cameraBinning
+
+    def _updateCameraBinning(self):
+        # The coarse-to-fine fit needs the full resolution frame.
+        self.camera.setBinning(self._downSample if self._cameraBinning and self._pyramidLevels == 0 else 1)
+
+    def setTracking(self, enabled: bool):
+        """If enabled then each frame is fit within a cropped region around the previous fit, falling back to searching
+        the full frame when the tracked fit is poor."""
+        self._tracking = enabled
+        self._resetTemporalState()
+
+    def isTracking(self) -> bool:
+        return self._tracking
+
+    def setConsensus(self, enabled: bool):
+        """If enabled then every method is run on each frame in parallel and their results are combined by `consensus`,
+        rather than only using `method`. The worker processes are started by the first frame fit in this mode."""
+        self._consensus = enabled
+        self._resetTemporalState()
+
+    def isConsensus(self) -> bool:
+        return self._consensus
+
+    def setSmoothing(self, enabled: bool):
+        """If enabled then the fits are smoothed over time by `circleFilter`."""
+        self._smoothing = enabled
+        self.requestReset(self.circleFilter)
+
+    def isSmoothing(self) -> bool:
+        return self._smoothing
+
+    def setSkipUnchanged(self, enabled: bool):
+        """If enabled then frames that `changeDetector` finds haven't changed since the last fit reuse that fit."""
+        self._skipUnchanged = enabled
+        self.requestReset(self.changeDetector)
+
+    def isSkippingUnchanged(self) -> bool:
+        return self._skipUnchanged
+
+    def requestReset(self, *states: typing.Union[CircleTracker, CircleFilter, FrameChangeDetector]):
+        """Reset any of `tracker`, `circleFilter` and `changeDetector` before the next frame is fit. They are only used
+        by the fit worker thread, so rather than being reset here, possibly in the middle of a fit, the fit worker
+        resets them."""
+        with self._resetLock:
+            self._pendingResets.update(states)
+
+    def _resetTemporalState(self):
+        """Called when the fitting settings change so that results from the old settings aren't carried over."""
+        self.requestReset(self.tracker, self.circleFilter, self.changeDetector)
 
 
 class Overlay(ABC):
@@ -283,6 +491,47 @@ class Overlay(ABC):
         """Use the painter passed to this method to draw the shape on the QWidget"""
         pass
 
+    @abstractmethod
+    def boundingRect(self) -> QRectF:
+        """The area that `draw` paints in, used when the overlay is displayed as an `OverlayItem`."""
+        pass
+
+
+class OverlayItem(QGraphicsItem):
+    """
+    Displays an `Overlay` as a persistent item in a QGraphicsScene so that it can be redrawn without repainting the frame.
+    `sync` must be called after the overlay is changed.
+
+    Args:
+        overlay: The overlay to display.
+    """
+    def __init__(self, overlay: Overlay):
+        super().__init__()
+        self.overlay = overlay
+        self._rect = overlay.boundingRect()
+        self._label = getattr(overlay, 'label', '')
+        self.setVisible(overlay.active)
+
+    def boundingRect(self) -> QRectF:
+        return self._rect
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget = None) -> None:
+        self.overlay.draw(painter)
+
+    def sync(self):
+        """Update the item to match the current state of the overlay. Does nothing if the overlay hasn't changed."""
+        rect = self.overlay.boundingRect()
+        if rect != self._rect:
+            self.prepareGeometryChange()
+            self._rect = rect
+            self.update()
+        label = getattr(self.overlay, 'label', '')
+        if label != self._label:
+            self._label = label
+            self.update()
+        if self.isVisible() != self.overlay.active:
+            self.setVisible(self.overlay.active)
+
 
 class CircleOverlay(Overlay):
     """
@@ -298,6 +547,7 @@ class CircleOverlay(Overlay):
         self.x = x
         self.y = y
         self.r = r
+        self.label = ''  # Text drawn beside the top right of the circle, if not empty.
 
     def setCoords(self, x: float, y: float, r: float):
         """
@@ -316,6 +566,17 @@ class CircleOverlay(Overlay):
         painter.setBrush(self.brush)
         painter.setPen(self.pen)
         painter.drawEllipse(self.x-self.r, self.y-self.r, self.r*2, self.r*2)
+        if self.label:
+            painter.drawText(self._labelRect(), QtCore.Qt.AlignLeft | QtCore.Qt.AlignBottom, self.label)
+
+    def _labelRect(self) -> QRectF:
+        corner = self.r * 0.71  # The top right of the circle, at 45 degrees.
+        return QRectF(self.x + corner, self.y - corner - 20, 10 * len(self.label) + 10, 20)
+
+    def boundingRect(self) -> QRectF:
+        pad = 1  # Leave room for the width of the pen.
+        rect = QRectF(self.x - self.r - pad, self.y - self.r - pad, self.r*2 + 2*pad, self.r*2 + 2*pad)
+        return rect.united(self._labelRect()) if self.label else rect
 
 
 class CircleCenterOverlay(CircleOverlay):
@@ -336,6 +597,11 @@ class CircleCenterOverlay(CircleOverlay):
         painter.drawLine(self.x-self.len, self.y, self.x+self.len, self.y)
         painter.drawLine(self.x, self.y-self.len, self.x, self.y+self.len)
 
+    def boundingRect(self) -> QRectF:
+        pad = 1
+        crosshair = QRectF(self.x - self.len - pad, self.y - self.len - pad, self.len*2 + 2*pad, self.len*2 + 2*pad)
+        return super().boundingRect().united(crosshair)
+
 
 class RectangleOverlay(Overlay):
     """
@@ -375,3 +641,7 @@ class RectangleOverlay(Overlay):
         painter.setBrush(self.brush)
         painter.setPen(self.pen)
         painter.drawRect(self._x, self._y, self._w, self._h)
+
+    def boundingRect(self) -> QRectF:
+        pad = 1
+        return QRectF(self._x - pad, self._y - pad, self._w + 2*pad, self._h + 2*pad)
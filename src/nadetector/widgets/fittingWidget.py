@@ -162,6 +162,7 @@ class FittingWidget(QFrame):
         self.measNA = QLabel('0', self)
         self.measNA.setFont(QFont('Arial', pointSize=18))
         self.measNA.font().setBold(True)
+        self.measConfidence = QLabel('', self)
         self.measX = QDoubleSpinBox(self)
         self.measY = QDoubleSpinBox(self)
         self.measureApertureCheckbox = QCheckBox("Measure Aperture", self)
@@ -200,6 +201,9 @@ class FittingWidget(QFrame):
             self.measD.setValue(r*2)
             self.measX.setValue(x)
             self.measY.setValue(y)
+            view = self.parentWindow.cameraView
+            self.measConfidence.setText(f"{view.fitConfidence:.0%}" if view.isSmoothing() else "")
+            self.measuredOverlay.label = f"#{view.fitSeq}" if view.fitSeq else ""
             updateOverlay()
 
         def connectCamViewFit():
@@ -227,9 +231,11 @@ class FittingWidget(QFrame):
         gl.addWidget(self.measY, 1, 2)
         gl.addWidget(QLabel("NA:"), 2, 0)
         gl.addWidget(self.measNA, 2, 1)
-        gl.addWidget(displayCheckbox, 3, 0, 1, 2)
-        gl.addWidget(overlayColorPatch, 3, 2, 1, 1)
-        gl.addWidget(self.measureApertureCheckbox, 4, 0, 1, 3)
+        gl.addWidget(QLabel("Confidence:"), 3, 0)
+        gl.addWidget(self.measConfidence, 3, 1)
+        gl.addWidget(displayCheckbox, 4, 0, 1, 2)
+        gl.addWidget(overlayColorPatch, 4, 2, 1, 1)
+        gl.addWidget(self.measureApertureCheckbox, 5, 0, 1, 3)
         return gl
 
     def _setupTargetPanel(self) -> QGridLayout:
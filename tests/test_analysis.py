@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from nadetector.analysis import binarizeImageLi, fitCircleLeastSquares, initialGuessCircle, measureCircleScaled
+from nadetector.benchmarks import generateFrames
+from nadetector.constants import Methods
+
+
+@pytest.mark.parametrize('noise', [10, 60])
+@pytest.mark.parametrize('ring', [False, True])
+def test_fitCircleLeastSquaresIgnoresThresholdNoise(noise, ring):
+    """A poor Li threshold leaves noise all around the aperture, which shouldn't pull the edge outward."""
+    for im, (tx, ty, tr) in generateFrames((1024, 1280), noise, ring, 2, seed=1):
+        binar = binarizeImageLi(im)
+        x, y, r = fitCircleLeastSquares(binar, *initialGuessCircle(binar))
+        assert np.hypot(x - tx, y - ty) < 0.5
+        assert abs(r - tr) < 1.5
+
+
+@pytest.mark.parametrize('method', list(Methods))
+def test_measureCirclePyramidRefinesToFullResolution(method):
+    for im, (tx, ty, tr) in generateFrames((1024, 1280), 10, True, 2, seed=3):
+        _, (x, y, r) = measureCircleScaled(im, method, pyramidLevels=3)
+        assert np.hypot(x - tx, y - ty) < 0.5
+        assert abs(r - tr) < 0.5
@@ -0,0 +1,18 @@
+import numpy as np
+
+from nadetector.hardware.autoExposure import ExposureController, histogramPercentile
+
+
+def test_histogramPercentile8Bit():
+    arr = np.arange(256, dtype=np.uint8).reshape(16, 16)
+    assert histogramPercentile(arr, 100) == 255
+    assert histogramPercentile(arr, 50) == np.percentile(arr, 50, method='lower')
+
+
+def test_saturatedUint16FrameIsBackedOff():
+    arr = np.full((64, 64), 1000, dtype=np.uint16)
+    arr[:32] = 65535
+    level = histogramPercentile(arr, 99.7) / np.iinfo(np.uint16).max
+    assert level >= 1
+    controller = ExposureController()
+    assert controller.update(100, level) == 100 / controller.maxStep
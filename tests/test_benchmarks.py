@@ -0,0 +1,23 @@
+import numpy as np
+
+from nadetector.benchmarks import generateFrames, runBenchmarks
+from nadetector.constants import Methods
+
+
+def test_generateFramesIsReproducible():
+    a = generateFrames((128, 160), 10, False, 3, seed=5)
+    b = generateFrames((128, 160), 10, False, 3, seed=5)
+    for (imA, truthA), (imB, truthB) in zip(a, b):
+        assert np.array_equal(imA, imB)
+        assert truthA == truthB
+
+
+def test_benchmarksRun():
+    """A smoke test of the whole benchmark at the smallest resolution."""
+    results = runBenchmarks(numFrames=2, resolutions=[(512, 1024)], noiseLevels=[10], downSamples=[1, 2], verbose=False)
+    assert len(results['results']) == 2 * len(Methods) * 2  # Disc and ring, each method, each down-sampling factor.
+    for case in results['results']:
+        name = f"{case['method']} ring={case['ring']} ds={case['downSample']}"
+        assert case['failures'] == 0, name
+        assert case['center_error_mean'] < 2, name
+        assert case['radius_error_mean'] < 1, name
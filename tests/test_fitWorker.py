@@ -0,0 +1,55 @@
+import time
+
+import numpy as np
+
+from nadetector.fitWorker import FitWorker
+
+
+def test_submitCopyKeepsFrameAndInfoTogether():
+    """A frame submitted with `copy=True` can be overwritten straight away without affecting the fit."""
+    def fit(im, buffers):
+        value = im[0, 0]
+        time.sleep(0.005)
+        assert (im == value).all()
+        return int(value)
+
+    worker = FitWorker(fit)
+    src = np.zeros((64, 64), dtype=np.uint8)
+    results = []
+    try:
+        for i in range(100):
+            src[:] = i
+            worker.submit(src, i, copy=True)
+            src[:] = 255  # The ring buffer slot being reused.
+            result = worker.takeResult()
+            if result is not None:
+                results.append((result, worker.resultInfo))
+            time.sleep(0.001)
+        frameId = worker.submit(src, 255, copy=True)
+        results.append((worker.waitForResult(frameId, timeout=5), worker.resultInfo))
+    finally:
+        worker.shutdown(timeout=5)
+    assert len(results) > 1
+    assert all(value == info for value, info in results)
+
+
+def test_reusedResultKeepsItsFrameInfo():
+    """A fit that is reused for an unchanged frame stays paired with the frame it was fit from."""
+    last = []
+    def fit(im, buffers):
+        if last and last[-1][1] == im[0, 0]:
+            return last[-1]
+        last.append(('fit', int(im[0, 0])))
+        return last[-1]
+
+    worker = FitWorker(fit)
+    try:
+        assert worker.waitForResult(worker.submit(np.full((8, 8), 1), info=1), timeout=5) == ('fit', 1)
+        assert worker.waitForResult(worker.submit(np.full((8, 8), 1), info=2), timeout=5) is None
+        assert worker.takeResult() is None
+        assert worker.resultInfo == 1
+        assert worker.waitForResult(worker.submit(np.full((8, 8), 2), info=3), timeout=5) == ('fit', 2)
+        assert worker.resultInfo == 3
+    finally:
+        worker.shutdown(timeout=5)
+    assert worker.fittedFrames == 2
@@ -0,0 +1,53 @@
+import numpy as np
+
+from nadetector.tracking import CircleFilter
+
+
+def test_circleFilterFollowsRamp():
+    """An aperture being opened steadily should be followed, not smoothed away."""
+    rng = np.random.default_rng(0)
+    f = CircleFilter()
+    for i in range(40):
+        r = 100 + 0.5 * i
+        x, y, fr = f.update((50 + rng.normal(0, 0.1), 50 + rng.normal(0, 0.1), r + rng.normal(0, 0.1)))
+    assert abs(fr - r) < 0.5
+    assert abs(x - 50) < 0.2 and abs(y - 50) < 0.2
+
+
+def test_circleFilterSmoothsStationary():
+    rng = np.random.default_rng(1)
+    f = CircleFilter()
+    out = [f.update((50 + rng.normal(0, 0.5), 50, 100))[0] for _ in range(300)]
+    assert np.std(out[100:]) < 0.3
+
+
+def test_circleFilterRestartsOnJump():
+    rng = np.random.default_rng(2)
+    f = CircleFilter()
+    for _ in range(50):
+        f.update((50, 50, 100 + rng.normal(0, 0.1)))
+    for _ in range(3):
+        x, y, r = f.update((50, 50, 130 + rng.normal(0, 0.1)))
+    assert abs(r - 130) < 0.5
+
+
+def test_circleFilterFollowsRandomWalk():
+    """An aperture that is moved around irregularly should be followed as closely as the raw fits, not held back."""
+    rng = np.random.default_rng(3)
+    truth = np.cumsum(rng.normal(0, 1, (400, 3)), axis=0) + [500, 400, 150]
+    f = CircleFilter()
+    out = np.array([f.update(tuple(t + rng.normal(0, 0.3, 3))) for t in truth])
+    error = (out - truth)[20:]
+    assert np.sqrt(np.mean(error ** 2)) < 0.5
+    assert np.abs(error).max() < 3
+
+
+def test_circleFilterFollowsStopAndGo():
+    rng = np.random.default_rng(4)
+    steps = rng.normal(0, 2, (400, 3))
+    for start in range(0, 400, 80):
+        steps[start:start + 40] = 0
+    truth = np.cumsum(steps, axis=0) + [500, 400, 150]
+    f = CircleFilter()
+    out = np.array([f.update(tuple(t + rng.normal(0, 0.2, 3))) for t in truth])
+    assert np.sqrt(np.mean((out - truth)[20:] ** 2)) < 0.6